@@ -0,0 +1,48 @@
+"""Checkpoints of incremental runs, saved as json next to the output file."""
+import json
+import os
+import zlib
+
+__all__ = ['checkpoint_path', 'checksum', 'load', 'save', 'remove']
+
+checkpoint_suffix = '.checkpoint'
+
+
+def checkpoint_path(output_file):
+    return output_file + checkpoint_suffix
+
+
+def checksum(data):
+    """Get the crc32 checksum of bytes as an unsigned integer."""
+    return zlib.crc32(data) & 0xffffffff
+
+
+def load(output_file):
+    """Load the checkpoint of the output file, return None if there is none or it is broken."""
+    path = checkpoint_path(output_file)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        return None
+
+
+def save(output_file, state):
+    """Save the checkpoint of the output file, replacing the old one atomically."""
+    path = checkpoint_path(output_file)
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(temp_path, 'w') as f:
+            json.dump(state, f, sort_keys=True)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def remove(output_file):
+    path = checkpoint_path(output_file)
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,116 @@
+"""Compact in-memory table storing a csv matrix by column."""
+from array import array
+
+__all__ = ['ColumnTable']
+
+# Typecodes of unsigned integer arrays from the narrowest to the widest.
+_typecodes = [(t, (1 << (8 * array(t).itemsize)) - 1) for t in ('B', 'H', 'I', 'L', 'Q')]
+
+
+class ColumnTable():
+    """
+    Store rows of a csv matrix by column, with each column dictionary encoded.
+
+    Every distinct value of a column is kept only once in `values[col]`, and the
+    cells of the column are kept as integer codes in an array, which begins as
+    an array of bytes and is widened when the column gets more distinct values.
+
+    Code 0 is reserved for the empty string, cells missing from short rows are
+    stored as 0 too and cut off by the length of the row when it is decoded.
+
+    A table acts as a read-only list of rows, rows are decoded into new lists
+    when they are got by position or iterated.
+
+    Usage::
+
+        >> table = ColumnTable(csv.reader(f))
+        >> table.find(0, 'Jack')
+        [0, 3]
+        >> table[3]
+        ['Jack', 'F', '1']
+    """
+
+    def __init__(self, rows=()):
+        self.values = []  # in the format of [[value_of_code_0, value_of_code_1, ...], ...]
+        self.columns = []  # in the format of [array_of_codes, ...]
+        self.widths = array('I')  # length of each row
+        self._codes = []  # in the format of [{value: code}, ...]
+        self._limits = []  # max code the array of each column can hold
+        self.extend(rows)
+
+    def __len__(self):
+        return len(self.widths)
+
+    def __getitem__(self, pos):
+        width = self.widths[pos]
+        return [self.values[col][self.columns[col][pos]] for col in range(width)]
+
+    def __iter__(self):
+        for pos in range(len(self.widths)):
+            yield self[pos]
+
+    def __add_column(self):
+        self.values.append([''])
+        self._codes.append({'': 0})
+        typecode, limit = _typecodes[0]
+        self.columns.append(array(typecode, [0]) * len(self.widths))
+        self._limits.append(limit)
+
+    def __widen(self, col):
+        codes = self.columns[col]
+        for typecode, limit in _typecodes:
+            if limit > self._limits[col]:
+                self.columns[col] = array(typecode, codes)
+                self._limits[col] = limit
+                return
+
+    def append(self, row):
+        """Encode a row and append it to the end of the table."""
+        width = len(row)
+        while len(self.columns) < width:
+            self.__add_column()
+
+        for col, value in enumerate(row):
+            codes = self._codes[col]
+            code = codes.get(value)
+            if code is None:
+                code = len(self.values[col])
+                if code > self._limits[col]:
+                    self.__widen(col)
+                codes[value] = code
+                self.values[col].append(value)
+            self.columns[col].append(code)
+
+        for col in range(width, len(self.columns)):
+            self.columns[col].append(0)
+        self.widths.append(width)
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def code_of(self, col, value):
+        """Get the code of `value` in column `col`, None if it never appears."""
+        if col >= len(self._codes):
+            return None
+        return self._codes[col].get(value)
+
+    def find(self, col, value):
+        """Get positions of the rows whose cell in column `col` equals to `value`."""
+        code = self.code_of(col, value)
+        if code is None:
+            return []
+        widths = self.widths
+        return [pos for pos, c in enumerate(self.columns[col]) if c == code and col < widths[pos]]
+
+    def index(self, col):
+        """Group positions of rows by the value of column `col`, in the format of {value: [positions]}."""
+        if col >= len(self.columns):
+            return {}
+        groups = {}
+        widths = self.widths
+        for pos, code in enumerate(self.columns[col]):
+            if col < widths[pos]:
+                groups.setdefault(code, []).append(pos)
+        values = self.values[col]
+        return {values[code]: positions for code, positions in groups.items()}
@@ -0,0 +1,104 @@
+"""Open csv files compressed in gzip, bz2 or xz as they are plain files."""
+import bz2
+import codecs
+import gzip
+import io
+import os
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+__all__ = ['detect_compression', 'compression_of_name', 'compression_extension',
+           'open_binary', 'open_text']
+
+default_buffer_size = 1 << 20
+
+_extensions = {
+    '.gz': 'gzip',
+    '.gzip': 'gzip',
+    '.bz2': 'bz2',
+    '.xz': 'xz',
+    '.lzma': 'xz',
+}
+_magic_numbers = [
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+]
+
+
+def compression_of_name(path):
+    """Get the compression by the extension of file name, None for a plain file."""
+    return _extensions.get(os.path.splitext(path)[1].lower())
+
+
+def compression_extension(compression):
+    """Get the file extension of the compression, '' for None."""
+    return {'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz'}.get(compression, '')
+
+
+def detect_compression(path):
+    """
+    Detect the compression of a file by its extension, or by the magic bytes
+    at the beginning of it if the extension is unknown. None for a plain file.
+    """
+    compression = compression_of_name(path)
+    if compression or not os.path.isfile(path):
+        return compression
+    with open(path, 'rb') as f:
+        head = f.read(6)
+    for magic, compression in _magic_numbers:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def open_binary(path, mode='rb', compression=None, level=None):
+    """
+    Open a file in binary mode, which is decompressed while reading or
+    compressed while writing. `level` is the compression level, the default
+    one of the compression is used if it is None.
+
+    Appending to a compressed file adds a new stream to it, which is read
+    along with the former ones.
+    """
+    if compression is None:
+        return open(path, mode, buffering=0)
+    kwargs = {}
+    if compression == 'gzip':
+        if level is not None and 'r' not in mode:
+            kwargs['compresslevel'] = level
+        return gzip.open(path, mode, **kwargs)
+    if compression == 'bz2':
+        if level is not None and 'r' not in mode:
+            kwargs['compresslevel'] = level
+        return bz2.open(path, mode, **kwargs)
+    if compression == 'xz':
+        if lzma is None:
+            raise ValueError('xz compression is not supported, module `lzma` is missing.')
+        if level is not None and 'r' not in mode:
+            kwargs['preset'] = level
+        return lzma.open(path, mode, **kwargs)
+    raise ValueError('`{}` is not a supported compression.'.format(compression))
+
+
+def open_text(path, mode='r', encoding='utf-8', compression=None, level=None,
+              buffer_size=default_buffer_size):
+    """
+    Open a csv file in text mode, with `newline=''` as the csv module needs.
+
+    `mode` is one of 'r', 'w' and 'a'. Reading and writing go through a
+    buffer of `buffer_size` bytes, so compressors get large blocks.
+    """
+    if mode == 'a' and os.path.isfile(path) and os.path.getsize(path) > 0:
+        # Compressed streams always begin at position 0, do not write another byte order mark.
+        if codecs.lookup(encoding).name == 'utf-8-sig':
+            encoding = 'utf-8'
+    raw = open_binary(path, mode + 'b', compression, level)
+    if 'r' in mode:
+        buffered = io.BufferedReader(raw, buffer_size)
+    else:
+        buffered = io.BufferedWriter(raw, buffer_size)
+    return io.TextIOWrapper(buffered, encoding=encoding, newline='')
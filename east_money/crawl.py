@@ -0,0 +1,240 @@
+# encoding='utf-8'
+
+# pylint: disable=c0111,c0325
+
+"""
+Crawl notices of many stocks in worker processes, resumable after a restart.
+
+Usage::
+
+    # crawl the given stocks
+    > python crawl.py 000004 000005 000006
+
+    # crawl all the stocks in sections.json with 4 processes
+    > python crawl.py --all --processes=4 --output=notices
+
+Finished stocks are recorded in a checkpoint file, `crawl_state.json` in the
+output folder by default. A restarted crawl skips them, and continues the
+unfinished ones, whose notices downloaded before are skipped as well.
+
+Downloaded notices are recorded in a manifest, `notices.sqlite` in the output
+folder. A refreshing crawl of a stock crawled through before stops at the
+first index page of known notices only.
+
+With --store, notices are packed into a `segment_store.SegmentStore` instead
+of a file for each, every worker process appends to segments of its own.
+
+With --index, new notices are added to the full-text index of `search` after
+the crawl.
+
+Options:
+
+    --all               crawl all the stocks in sections.json
+    --sections=FILE     path of sections.json, default the one of the repository
+    --output=DIR        folder of the notices, default the current folder
+    --state=FILE        checkpoint file, default crawl_state.json in the output folder
+    --processes=N       count of worker processes, default 2
+    --refresh           crawl the finished stocks again for new notices
+    --full              walk all the index pages even if the stock is crawled through
+    --page-size=N       notices in an index page, default 100
+    --manifest=FILE     manifest of notices, default notices.sqlite in the output folder
+    --extractor=NAME    extractor of notice texts, fast or soup, default fast
+    --store=DIR         save notices into the segment store DIR instead of files
+    --index=FILE        update the full-text index FILE after the crawl
+    --cache=DIR         keep responses in the cache DIR, shared by the processes
+    --offline           get responses from the cache only
+    --per-host=N        concurrent requests to a host in each process, default 4
+    --rate=N            requests per second in each process, default 5
+    --retries=N         retries of a failed request, default 3
+    --workers=N         threads of each process, default 8
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+import east_money
+from fetcher import Fetcher
+from http_cache import ResponseCache
+from manifest import Manifest, default_manifest
+from search import SearchIndex
+from segment_store import SegmentStore
+
+
+logger = logging.getLogger(__name__)
+
+default_sections = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sections.json')
+
+_fetcher = None
+_manifest = None
+_store = None
+_load_options = {}
+
+
+def load_codes(sections_file=default_sections):
+    """Get all the stock codes in sections.json, which `section.export_stock_section_info` exports."""
+    with open(sections_file) as f:
+        return sorted(json.load(f))
+
+
+def load_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    try:
+        with open(state_file) as f:
+            return json.load(f)
+    except ValueError:
+        logger.warning('broken checkpoint %s, start over', state_file)
+        return {}
+
+
+def save_state(state_file, state):
+    """Save the checkpoint, replacing the old one atomically."""
+    temp_file = state_file + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    if os.name == 'nt' and os.path.exists(state_file):
+        os.remove(state_file)
+    os.rename(temp_file, state_file)
+
+
+def _init_worker(output_dir, manifest_file, store_dir, cache_options, load_options, fetcher_options):
+    global _fetcher, _manifest, _store, _load_options
+    os.chdir(output_dir)
+    cache = ResponseCache(**cache_options) if cache_options else None
+    _fetcher = Fetcher(headers=east_money.HEADERS, cache=cache, **fetcher_options)
+    _manifest = Manifest(manifest_file)
+    if store_dir:
+        _store = SegmentStore(store_dir)
+    _load_options = load_options
+
+
+def crawl_stock(stock_code):
+    """Crawl a stock in a worker process, return (stock_code, result_dict)."""
+    start = time.time()
+    try:
+        if _store is None and not os.path.isdir(stock_code):
+            os.makedirs(stock_code)
+        counts = east_money.load_stock(stock_code, _fetcher, _manifest, store=_store, **_load_options)
+        counts['status'] = 'failed' if counts['failed'] else 'done'
+    except Exception as ex:
+        counts = {'status': 'failed', 'error': '%s: %s' % (type(ex).__name__, ex)}
+    counts['seconds'] = round(time.time() - start, 3)
+    counts['finished_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    return stock_code, counts
+
+
+def format_result(stock_code, result):
+    if 'error' in result:
+        return '[%s] %s %s in %.1fs' % (result['status'], stock_code, result['error'], result['seconds'])
+    seconds = result['seconds'] or 1e-6
+    return '[%s] %s index pages %d, notices %d, downloaded %d, skipped %d, failed %d in %.1fs, %.1f notices/s, %.1f KB/s' % (
+        result['status'], stock_code, result.get('pages', 0), result['notices'], result['downloaded'],
+        result['skipped'], result['failed'], result['seconds'], result['downloaded'] / seconds,
+        result['bytes'] / 1024.0 / seconds,
+    )
+
+
+def crawl(codes, output_dir='.', state_file=None, processes=2, refresh=False, manifest_file=None,
+          page_size=east_money.PAGE_SIZE, full=False, extractor=None, store_dir=None, index_file=None,
+          cache_dir=None, offline=False, **fetcher_options):
+    """
+    Crawl the stocks in worker processes, and record finished ones in the checkpoint.
+
+    Notices are recorded in the manifest `manifest_file`, and saved into the
+    segment store `store_dir` if it is given, then new notices are added to
+    the full-text index `index_file` if it is given. Responses are kept in
+    the cache `cache_dir` if it is given, and got from it only if `offline`.
+    `page_size`, `full` and `extractor` are passed to `east_money.load_stock`.
+
+    Return the state in the format of {stock_code: result_dict}.
+    """
+    output_dir = os.path.abspath(output_dir)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    state_file = os.path.abspath(state_file or os.path.join(output_dir, 'crawl_state.json'))
+    state = load_state(state_file)
+    manifest_file = os.path.abspath(manifest_file or os.path.join(output_dir, default_manifest))
+    # Create the database ahead, so workers do not race to create it.
+    Manifest(manifest_file).close()
+    if store_dir:
+        store_dir = os.path.join(output_dir, store_dir)
+        SegmentStore(store_dir).close()
+
+    pending = [code for code in codes
+               if refresh or state.get(code, {}).get('status') != 'done']
+    logger.info('%d stocks, %d finished before, %d to crawl',
+                len(codes), len(codes) - len(pending), len(pending))
+
+    start = time.time()
+    load_options = {'page_size': page_size, 'full': full, 'extractor': extractor}
+    cache_options = cache_dir and {'root': os.path.abspath(cache_dir), 'offline': offline}
+    pool = multiprocessing.Pool(processes, _init_worker, (
+        output_dir, manifest_file, store_dir, cache_options, load_options, fetcher_options))
+    try:
+        for n, (stock_code, result) in enumerate(pool.imap_unordered(crawl_stock, pending), 1):
+            state[stock_code] = result
+            save_state(state_file, state)
+            elapsed = time.time() - start
+            print '(%d/%d, %.2f stocks/min) %s' % (
+                n, len(pending), n * 60.0 / elapsed, format_result(stock_code, result))
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    if index_file:
+        with SearchIndex(index_file) as index:
+            if store_dir:
+                with SegmentStore(store_dir) as store:
+                    added = index.index_store(store)
+            else:
+                added = index.index_folder(output_dir, manifest_file)
+        logger.info('%d notices indexed', added)
+    return state
+
+
+def parse_options(argv):
+    codes = []
+    options = {}
+    for arg in argv:
+        if arg.startswith('--'):
+            key, _, value = arg[2:].partition('=')
+            options[key] = value
+        else:
+            codes.append(arg)
+    return codes, options
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    codes, options = parse_options(sys.argv[1:])
+    if 'all' in options:
+        codes = load_codes(options.get('sections') or default_sections)
+    if not codes:
+        sys.exit('No stock code to crawl.')
+
+    crawl(
+        codes,
+        output_dir=options.get('output', '.'),
+        state_file=options.get('state'),
+        processes=int(options.get('processes', 2)),
+        refresh='refresh' in options,
+        manifest_file=options.get('manifest'),
+        page_size=int(options.get('page-size', east_money.PAGE_SIZE)),
+        full='full' in options,
+        extractor=options.get('extractor'),
+        store_dir=options.get('store'),
+        index_file=options.get('index'),
+        cache_dir=options.get('cache'),
+        offline='offline' in options,
+        max_per_host=int(options.get('per-host', 4)),
+        rate=float(options.get('rate', 5)),
+        retries=int(options.get('retries', 3)),
+        workers=int(options.get('workers', 8)),
+    )
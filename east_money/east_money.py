@@ -7,13 +7,22 @@ import logging
 import os
 import re
 import sys
+import threading
 from urllib import urlencode
 
-import requests
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
-from bs4 import BeautifulSoup
 import dateutil.parser
 
+from extract import extract_detail
+from fetcher import Fetcher
+from http_cache import ResponseCache, default_cache
+from manifest import Manifest, default_manifest
+from segment_store import SegmentStore
+
 
 console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.DEBUG)
@@ -24,9 +33,11 @@ logger.addHandler(console_handler)
 
 
 # http://data.eastmoney.com/notices/getdata.ashx?StockCode=000004&CodeType=1&PageIndex=2&PageSize=700&SecNodeType=0&FirstNodeType=0&rt=49450435
-idx_addr = 'http://data.eastmoney.com/notices/getdata.ashx?' \
+# Set it to the address of a local server to test.
+base_url = 'http://data.eastmoney.com'
+idx_addr = '%(base_url)s/notices/getdata.ashx?' \
 'StockCode=%(stock_code)s&CodeType=1&jsObj=idx&PageIndex=%(page_idx)s&PageSize=%(page_size)d&SecNodeType=0&FirstNodeType=0&rt=49450435'
-page_addr = 'http://data.eastmoney.com/notices/detail/%(stock_code)s/%(info_code)s,JUU1JTlCJUJEJUU1JTg2JTlDJUU3JUE3JTkxJUU2JThBJTgw.html'
+page_addr = '%(base_url)s/notices/detail/%(stock_code)s/%(info_code)s,JUU1JTlCJUJEJUU1JTg2JTlDJUU3JUE3JTkxJUU2JThBJTgw.html'
 
 HEADERS = {
     'Accept':'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
@@ -38,6 +49,22 @@ HEADERS = {
 
 SPLIT = '\r\n\r\n=====================\r\n\r\n'
 
+# Count of index pages fetched ahead while detail pages are downloaded.
+INDEX_PREFETCH = 2
+# Count of notices in an index page, a larger one takes less round trips.
+PAGE_SIZE = 100
+
+default_fetcher = None
+
+
+def get_fetcher(fetcher=None):
+    global default_fetcher
+    if fetcher is not None:
+        return fetcher
+    if default_fetcher is None:
+        default_fetcher = Fetcher(headers=HEADERS, cache=default_cache())
+    return default_fetcher
+
 
 def validate_title(title):
     rstr = r"[\/\\\:\*\?\"\<\>\|]"  # '/\:*?"<>|'
@@ -45,76 +72,265 @@ def validate_title(title):
     return new_title
 
 
-def read_index(stock_code, page_idx):
+def read_index(stock_code, page_idx, fetcher=None, page_size=PAGE_SIZE):
     url = idx_addr % {
+        'base_url': base_url,
         'stock_code': stock_code,
         'page_idx': page_idx,
-        'page_size': 100,
+        'page_size': page_size,
     }
     print '[get index] %s' % url
-    resp = requests.get(url, headers=HEADERS)
+    resp = get_fetcher(fetcher).get(url, headers=HEADERS)
     assert resp.status_code == 200, 'get index error'
 
     return json.loads(resp.content.decode('gbk').lstrip('var idx = ').rstrip(';'))
 
 
-def read_page(stock_code, info_code):
+def fetch_page(stock_code, info_code, fetcher=None):
+    """Get the raw content and the url of a notice page."""
     url = page_addr % {
+        'base_url': base_url,
         'stock_code': stock_code,
         'info_code': info_code,
     }
     print '[get page] %s' % url
-    resp = requests.get(url, headers=HEADERS)
+    resp = get_fetcher(fetcher).get(url, headers=HEADERS)
     assert resp.status_code == 200, 'get page error'
+    return resp.content, url
 
-    soup = BeautifulSoup(resp.content, 'html.parser', from_encoding='gbk')
-    detail_body = soup.find_all('div', {'class': 'detail-body'})
-    assert len(detail_body) == 1
-    detail_body = detail_body[0]
 
-    return detail_body.text.replace(u'[点击查看PDF原文]', ''), url
+def read_page(stock_code, info_code, fetcher=None, extractor=None):
+    """Get the text of a notice and the url, `extractor` is a name in `extract.extractors`."""
+    content, url = fetch_page(stock_code, info_code, fetcher)
+    return extract_detail(content, extractor), url
 
 
-def load_stock(stock_code):
-    count = 1
-    while True:
-        idx_content = read_index(stock_code, count)
-        if not idx_content['data']:
-            break
-        for info in idx_content['data']:
-            filename = '%s_%s.txt' % (
-                dateutil.parser.parse(info['NOTICEDATE']).strftime('%Y-%m-%d'),
-                validate_title(info['NOTICETITLE']),
-            )
-            folder = '%s_%s' % (stock_code, info['CDSY_SECUCODES'][0]['SECURITYSHORTNAME'])
-            folder = os.path.join(stock_code, folder)
+def iter_index(stock_code, fetcher=None, prefetch=INDEX_PREFETCH, page_size=PAGE_SIZE):
+    """
+    Yield contents of index pages until an empty one.
+
+    Pages are read in a background thread, at most `prefetch` pages ahead of
+    the ones being handled. Closing the generator stops reading more pages.
+    """
+    pages = queue.Queue(prefetch)
+    stop = threading.Event()
+
+    def _put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _read():
+        page_idx = 1
+        try:
+            while True:
+                idx_content = read_index(stock_code, page_idx, fetcher, page_size)
+                if not _put(idx_content) or not idx_content['data']:
+                    return
+                page_idx += 1
+        except Exception as ex:
+            _put(ex)
+
+    reader = threading.Thread(target=_read)
+    reader.daemon = True
+    reader.start()
+    try:
+        while True:
+            idx_content = pages.get()
+            if isinstance(idx_content, Exception):
+                raise idx_content
+            if not idx_content['data']:
+                break
+            yield idx_content
+    finally:
+        stop.set()
+
+
+def build_notice(stock_code, info, fetcher=None, extractor=None):
+    """Download a notice and get the content to save, None if it fails."""
+    try:
+        page_text, url = read_page(stock_code, info['INFOCODE'], fetcher, extractor)
+    except Exception as ex:
+        logger.warning('[skip page] %s: %s', info['INFOCODE'], ex)
+        return None
+    page_text = SPLIT.join([
+        info['NOTICETITLE'],
+        url,
+        page_text,
+    ])
+
+    print '%s.txt' % info['NOTICETITLE'].encode('utf-8')
+
+    return page_text.encode('utf-8')
+
+
+def load_notice(stock_code, info, filename, fetcher=None, extractor=None):
+    content = build_notice(stock_code, info, fetcher, extractor)
+    if content is None:
+        return None
+    # Write to a temporary file first, so an interrupted download is never
+    # taken as a finished one.
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'w') as f:
+        f.write(content)
+    os.rename(temp_filename, filename)
+    return len(content)
+
+
+def notice_filename(stock_code, info):
+    """Get the path of the file to save a notice in, relative to the output folder."""
+    filename = '%s_%s.txt' % (
+        dateutil.parser.parse(info['NOTICEDATE']).strftime('%Y-%m-%d'),
+        validate_title(info['NOTICETITLE']),
+    )
+    folder = '%s_%s' % (stock_code, info['CDSY_SECUCODES'][0]['SECURITYSHORTNAME'])
+    return os.path.join(stock_code, folder, filename)
+
+
+def load_stock(stock_code, fetcher=None, manifest=None, page_size=PAGE_SIZE, full=False, extractor=None,
+               store=None):
+    """
+    Download all notices of a stock, notices downloaded before are skipped.
+
+    Detail pages are downloaded concurrently by the fetcher, while next index
+    pages are fetched ahead.
+
+    With a `Manifest`, known notices are skipped by their info codes, and the
+    downloaded ones are recorded in it. Once the whole history of the stock
+    has been crawled, later crawls stop at the first index page of known
+    notices only, unless `full` is True. Files of notices missing from the
+    manifest are still checked, so files downloaded without it are recorded
+    instead of downloaded again.
+
+    With a `SegmentStore`, notices are saved into it instead of files, by the
+    paths of the files. Texts of notices are extracted by `extractor`, the
+    name of one in `extract.extractors`.
+
+    Return counts of the notices in the format of
+    {'notices': n, 'skipped': n, 'downloaded': n, 'failed': n, 'bytes': n, 'pages': n}.
+    """
+    fetcher = get_fetcher(fetcher)
+    counts = dict.fromkeys(['notices', 'skipped', 'downloaded', 'failed', 'bytes', 'pages'], 0)
+    incremental = manifest is not None and not full and manifest.is_complete(stock_code)
+    # Pages fetched ahead are wasted when the crawl stops early.
+    pages = iter_index(stock_code, fetcher, 1 if incremental else INDEX_PREFETCH, page_size)
+    results = []
+
+    def _record(finished_only):
+        pending = []
+        for info, filename, result in results:
+            if finished_only and not result.ready():
+                pending.append((info, filename, result))
+                continue
+            value = result.get()
+            if value is None:
+                counts['failed'] += 1
+                continue
+            if store is not None:
+                store.put(stock_code, info['INFOCODE'], value, filename, info['NOTICEDATE'][:10])
+                value = len(value)
+            counts['downloaded'] += 1
+            counts['bytes'] += value
+            if manifest is not None:
+                manifest.add(stock_code, info, filename, value)
+        results[:] = pending
+        if store is not None:
+            store.flush()
+        if manifest is not None:
+            manifest.commit()
+
+    reached_end = True
+    for idx_content in pages:
+        counts['pages'] += 1
+        infos = idx_content['data']
+        info_codes = [info['INFOCODE'] for info in infos]
+        known = manifest.known(stock_code, info_codes) if manifest is not None else ()
+        stored = store.known(stock_code, set(info_codes) - set(known)) if store is not None else {}
+        for info in infos:
+            counts['notices'] += 1
+            if info['INFOCODE'] in known:
+                counts['skipped'] += 1
+                continue
+
+            filename = notice_filename(stock_code, info)
+            if store is not None:
+                if info['INFOCODE'] in stored:
+                    counts['skipped'] += 1
+                    if manifest is not None:
+                        manifest.add(stock_code, info, filename, stored[info['INFOCODE']])
+                    continue
+                task = fetcher.submit(build_notice, stock_code, info, fetcher, extractor)
+                results.append((info, filename, task))
+                continue
+
+            folder = os.path.dirname(filename)
             if not os.path.isdir(folder):
                 os.mkdir(folder)
-            filename = os.path.join(folder, filename)
 
             if os.path.exists(filename):
+                counts['skipped'] += 1
+                if manifest is not None:
+                    manifest.add(stock_code, info, filename, os.path.getsize(filename))
                 continue
 
-            try:
-                page_text, url = read_page(stock_code, info['INFOCODE'])
-            except:
-                continue
-            page_text = SPLIT.join([
-                info['NOTICETITLE'],
-                url,
-                page_text,
-            ])
+            results.append((info, filename, fetcher.submit(load_notice, stock_code, info, filename, fetcher, extractor)))
+
+        # Record finished downloads page by page, so an interrupted crawl
+        # keeps most of them.
+        _record(True)
+        if incremental and len(known) == len(infos):
+            reached_end = False
+            pages.close()
+            break
+
+    _record(False)
+    if manifest is not None and reached_end and not counts['failed']:
+        manifest.set_complete(stock_code)
+        manifest.commit()
+    return counts
 
-            print '%s.txt' % info['NOTICETITLE'].encode('utf-8')
 
-            with open(filename, 'w') as f:
-                f.write(page_text.encode('utf-8'))
-        count += 1
+def parse_options(argv):
+    options = {}
+    for arg in argv:
+        if arg.startswith('--'):
+            key, _, value = arg[2:].partition('=')
+            options[key] = value
+    return options
 
 
 if __name__ == '__main__':
 #     load_stock('000004')
+#     load_stock('000004', Fetcher(max_per_host=8, rate=20, headers=HEADERS))
+    options = parse_options(sys.argv[2:])
+    cache = default_cache()
+    if options.get('cache'):
+        cache = ResponseCache(options['cache'], offline='offline' in options)
+    manifest = Manifest(options.get('manifest') or default_manifest)
+    store = SegmentStore(options['store']) if options.get('store') else None
+    fetcher = Fetcher(
+        max_per_host=int(options.get('per-host', 4)),
+        rate=float(options.get('rate', 5)),
+        retries=int(options.get('retries', 3)),
+        workers=int(options.get('workers', 8)),
+        headers=HEADERS,
+        cache=cache,
+    )
     if sys.argv[1]:
         print '--------\nbegin <%s>\n--------' % sys.argv[1]
-        load_stock(sys.argv[1])
+        try:
+            print load_stock(sys.argv[1], fetcher, manifest,
+                             page_size=int(options.get('page-size', PAGE_SIZE)),
+                             full='full' in options,
+                             extractor=options.get('extractor'),
+                             store=store)
+        finally:
+            fetcher.close()
+            manifest.close()
+            if store is not None:
+                store.close()
     print '--------\nfinish\n--------'
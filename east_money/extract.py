@@ -0,0 +1,171 @@
+﻿# encoding='utf-8'
+
+# pylint: disable=c0111,c0325
+
+"""
+Extract the text of the detail body from notice pages.
+
+Extractors take the raw gbk content of a page and return the text of the
+single `div.detail-body`, with the `[点击查看PDF原文]` link removed.
+
+    soup    builds a BeautifulSoup tree of the whole page, slow but tolerant
+    fast    scans the tags of the detail body only, and hands the page over
+            to `soup` when it meets anything it does not handle the same way
+
+Usage::
+
+    >> extract_detail(resp.content)
+    >> extract_detail(resp.content, 'soup')
+"""
+
+import re
+
+try:
+    from html.entities import name2codepoint
+    unichr = chr  # pylint: disable=w0622
+except ImportError:
+    from htmlentitydefs import name2codepoint
+
+from bs4 import BeautifulSoup
+
+
+PDF_LINK = u'[点击查看PDF原文]'
+
+# Tags with an attribute list, quoted values may contain '>'.
+_tag_pattern = re.compile(
+    r'''<(/?)([a-zA-Z][^\s/>]*)((?:[^>"']|"[^"]*"|'[^']*')*)>''')
+# Start tags of divs mentioning detail-body, checked by the class attribute then.
+_detail_pattern = re.compile(
+    r'''<div(?=[\s/>])(?=[^>]*detail-body)((?:[^>"']|"[^"]*"|'[^']*')*)>''', re.I)
+_class_pattern = re.compile(
+    r'''(?:^|\s)class\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))''', re.I)
+# A '&' not followed by '#' or letters is taken as it is.
+_entity_pattern = re.compile(r'&(?:#(\d+);|#[xX]([0-9a-fA-F]+);|([a-zA-Z][a-zA-Z0-9]*);|(?=[#a-zA-Z]))')
+# Contents of them are not tags or keep whitespace, which are left to BeautifulSoup.
+_raw_text_tags = ('script', 'style', 'textarea', 'title', 'xmp', 'plaintext', 'pre')
+_ascii_spaces = u' \n\t\x0c\r'
+
+
+class ExtractError(ValueError):
+    pass
+
+
+def extract_soup(content):
+    soup = BeautifulSoup(content, 'html.parser', from_encoding='gbk')
+    detail_body = soup.find_all('div', {'class': 'detail-body'})
+    if len(detail_body) != 1:
+        raise ExtractError('%d detail bodies in the page' % len(detail_body))
+    return detail_body[0].text.replace(PDF_LINK, '')
+
+
+def _unescape(text):
+    """Replace character references, return None for ones BeautifulSoup may treat differently."""
+    if '&' not in text:
+        return text
+    parts = []
+    pos = 0
+    for m in _entity_pattern.finditer(text):
+        decimal, hexadecimal, name = m.groups()
+        if name is not None:
+            if name not in name2codepoint:
+                return None
+            code = name2codepoint[name]
+        elif decimal is not None or hexadecimal is not None:
+            code = int(decimal) if decimal is not None else int(hexadecimal, 16)
+            # Codes below 256 are decoded in the page encoding by BeautifulSoup.
+            if not 32 <= code < 128 and not 256 <= code <= 0xffff:
+                return None
+        else:
+            # A reference without ';'.
+            return None
+        parts.append(text[pos:m.start()])
+        parts.append(unichr(code))
+        pos = m.end()
+    parts.append(text[pos:])
+    return u''.join(parts)
+
+
+def _text_of(data):
+    """
+    Get the text of the data between two tags, None if it is not sure.
+
+    BeautifulSoup replaces data of ASCII spaces only with a newline, if there
+    is any, or a space.
+    """
+    data = _unescape(data)
+    if data and not data.strip(_ascii_spaces):
+        return u'\n' if u'\n' in data else u' '
+    return data
+
+
+def _is_detail_body(attrs):
+    m = _class_pattern.search(attrs)
+    if not m:
+        return False
+    value = next(v for v in m.groups() if v is not None)
+    return 'detail-body' in value.split()
+
+
+def fast_body(text):
+    """
+    Get the text of the detail body of a decoded page, None if the page is
+    not simple enough to get the same text as BeautifulSoup does.
+    """
+    starts = [m for m in _detail_pattern.finditer(text) if _is_detail_body(m.group(1))]
+    if len(starts) != 1 or starts[0].group(1).rstrip().endswith('/'):
+        return None
+
+    parts = []
+    depth = 1
+    pos = starts[0].end()
+    while True:
+        lt = text.find('<', pos)
+        if lt < 0:
+            # Not closed, BeautifulSoup takes the rest of the page.
+            return None
+        m = _tag_pattern.match(text, lt)
+        if m is None:
+            # A comment, a declaration or a bare '<'.
+            return None
+        data = _text_of(text[pos:lt])
+        if data is None:
+            return None
+        parts.append(data)
+        pos = m.end()
+        closing, name = m.group(1), m.group(2).lower()
+        if name in _raw_text_tags:
+            return None
+        if name != 'div':
+            continue
+        if closing:
+            depth -= 1
+            if depth == 0:
+                break
+        elif not m.group(3).rstrip().endswith('/'):
+            depth += 1
+
+    return u''.join(parts).replace(PDF_LINK, '')
+
+
+def extract_fast(content):
+    try:
+        text = content.decode('gbk')
+    except UnicodeDecodeError:
+        # BeautifulSoup guesses another encoding.
+        return extract_soup(content)
+    body = fast_body(text)
+    if body is None:
+        return extract_soup(content)
+    return body
+
+
+extractors = {
+    'soup': extract_soup,
+    'fast': extract_fast,
+}
+default_extractor = 'fast'
+
+
+def extract_detail(content, extractor=None):
+    """Get the text of the detail body of a page, by the extractor of the given name."""
+    return extractors[extractor or default_extractor](content)
@@ -0,0 +1,137 @@
+﻿# encoding='utf-8'
+
+# pylint: disable=c0111,c0325
+
+"""
+Benchmark of the extractors of notice texts on a corpus of saved pages.
+
+Usage::
+
+    # save detail pages of some stocks into the corpus folder
+    > python extract_bench.py corpus --fetch=000004,000005 --count=200
+
+    # time the extractors, and check them against the soup one
+    > python extract_bench.py corpus --repeat=3
+
+A page the fast extractor hands over to soup is counted as a fallback. The
+exit code is 1 if any extractor gets a text different from soup.
+
+Options:
+
+    --fetch=CODES       save detail pages of the stocks before the benchmark
+    --count=N           count of pages saved for each stock, default 100
+    --repeat=N          run each extractor N times and take the fastest, default 1
+    --extractors=a,b    extractors to time, default all
+"""
+
+import os
+import sys
+import time
+
+import east_money
+import extract
+
+
+def save_pages(corpus_dir, stock_code, count, fetcher=None):
+    """Save raw detail pages of a stock as `<stock_code>_<info_code>.html` in the corpus folder."""
+    if not os.path.isdir(corpus_dir):
+        os.makedirs(corpus_dir)
+    saved = 0
+    for idx_content in east_money.iter_index(stock_code, fetcher):
+        for info in idx_content['data']:
+            path = os.path.join(corpus_dir, '%s_%s.html' % (stock_code, info['INFOCODE']))
+            if not os.path.exists(path):
+                content, _ = east_money.fetch_page(stock_code, info['INFOCODE'], fetcher)
+                with open(path, 'wb') as f:
+                    f.write(content)
+            saved += 1
+            if saved >= count:
+                return saved
+    return saved
+
+
+def load_corpus(corpus_dir):
+    pages = []
+    for name in sorted(os.listdir(corpus_dir)):
+        if name.endswith('.html'):
+            with open(os.path.join(corpus_dir, name), 'rb') as f:
+                pages.append((name, f.read()))
+    return pages
+
+
+def _extract(fn, content):
+    try:
+        return fn(content)
+    except Exception as ex:
+        return '%s: %s' % (type(ex).__name__, ex)
+
+
+def run_extractor(name, pages, repeat=1):
+    """Run an extractor on all the pages, return (fastest_seconds, texts)."""
+    fn = extract.extractors[name]
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        texts = [_extract(fn, content) for _, content in pages]
+        seconds = time.time() - start
+        if best is None or seconds < best:
+            best = seconds
+    return best, texts
+
+
+def count_fallbacks(pages):
+    fallbacks = 0
+    for _, content in pages:
+        try:
+            text = content.decode('gbk')
+        except UnicodeDecodeError:
+            fallbacks += 1
+            continue
+        if extract.fast_body(text) is None:
+            fallbacks += 1
+    return fallbacks
+
+
+def extractors_order(names):
+    # The reference one goes first, so its texts are checked against.
+    return sorted(names, key=lambda name: (name != 'soup', name))
+
+
+def main(argv):
+    args = [arg for arg in argv if not arg.startswith('--')]
+    options = east_money.parse_options(argv)
+    if not args:
+        sys.exit('No corpus folder.')
+    corpus_dir = args[0]
+
+    if options.get('fetch'):
+        count = int(options.get('count', 100))
+        for stock_code in options['fetch'].split(','):
+            print('saved %d pages of %s' % (save_pages(corpus_dir, stock_code, count), stock_code))
+
+    pages = load_corpus(corpus_dir)
+    if not pages:
+        sys.exit('No page in %s.' % corpus_dir)
+    size = sum(len(content) for _, content in pages)
+    repeat = int(options.get('repeat', 1))
+    names = extractors_order(options.get('extractors') and options['extractors'].split(',') or extract.extractors)
+
+    print('%d pages, %.1f MB, %d pages fall back to soup' % (len(pages), size / 1e6, count_fallbacks(pages)))
+    expected = None if 'soup' in names else run_extractor('soup', pages)[1]
+    exit_code = 0
+    for name in names:
+        seconds, texts = run_extractor(name, pages, repeat)
+        if expected is None:
+            expected = texts
+        mismatches = [page_name for (page_name, _), text, e in zip(pages, texts, expected) if text != e]
+        print('%-8s %8.3fs %10.1f pages/s %8.2f MB/s %6d mismatches' % (
+            name, seconds, len(pages) / (seconds or 1e-6), size / 1e6 / (seconds or 1e-6), len(mismatches)))
+        for page_name in mismatches[:10]:
+            print('    mismatch %s' % page_name)
+        if mismatches:
+            exit_code = 1
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
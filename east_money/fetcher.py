@@ -0,0 +1,174 @@
+# encoding='utf-8'
+
+# pylint: disable=c0111,c0325
+
+"""
+Concurrent HTTP fetching with a shared pooled session.
+
+Requests reuse connections of one `requests.Session`, and are limited by a
+count of concurrent requests for each host and by a rate of requests per
+second for all hosts. Failed requests are retried with exponential backoff.
+Responses can be kept in an `http_cache.ResponseCache` for later runs.
+"""
+
+import logging
+import random
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying, the server is busy or failed for now.
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class FetchError(Exception):
+    pass
+
+
+class RateLimiter(object):
+    """Token bucket allowing `rate` calls per second, with bursts up to `burst` calls."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Fetcher(object):
+    """
+    Fetch urls concurrently through a shared pooled session.
+
+    max_per_host is the count of concurrent requests to a host, and the size
+    of the connection pool for it. rate is the count of requests per second
+    to all hosts, no limit if it is 0. A request failed by connection errors,
+    timeouts or status codes in `RETRY_STATUS` is retried `retries` times,
+    waiting `backoff * 2 ** n` seconds with jitter before the n-th retry.
+    With a `cache`, responses are got from it or kept in it, which is not
+    closed by the fetcher.
+
+    Usage::
+
+        >> fetcher = Fetcher(max_per_host=4, rate=10)
+        >> resp = fetcher.get('http://data.eastmoney.com/')
+        >> for resp in fetcher.map(fetcher.get, urls):
+        ..     print resp.status_code
+        >> fetcher.close()
+    """
+
+    def __init__(self, max_per_host=4, rate=5.0, retries=3, backoff=0.5, timeout=30,
+                 workers=8, headers=None, cache=None):
+        self.max_per_host = max_per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.workers = workers
+        self.cache = cache
+        self.rate_limiter = RateLimiter(rate, burst=max(1, int(rate)))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max_per_host)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+        self._host_slots = {}  # in the format of {host: semaphore}
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _slot(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_slots[host]
+
+    def get(self, url, **kwargs):
+        """
+        Get a url through the cache if any, or with the limits and retries,
+        return the response.
+
+        Raise FetchError if it still fails after all the retries, and
+        `http_cache.CacheMiss` if it is not cached in offline mode.
+        """
+        if self.cache is not None:
+            return self.cache.get(url, self.fetch, **kwargs)
+        return self.fetch(url, **kwargs)
+
+    def fetch(self, url, **kwargs):
+        """Get a url from the network with the limits and retries."""
+        kwargs.setdefault('timeout', self.timeout)
+        slot = self._slot(url)
+        attempt = 0
+        while True:
+            error = None
+            self.rate_limiter.acquire()
+            with slot:
+                try:
+                    resp = self.session.get(url, **kwargs)
+                    if resp.status_code not in RETRY_STATUS:
+                        return resp
+                    error = 'status %d' % resp.status_code
+                except (requests.ConnectionError, requests.Timeout) as ex:
+                    error = ex
+
+            if attempt >= self.retries:
+                raise FetchError('get %s failed: %s' % (url, error))
+            wait = self.backoff * 2 ** attempt * (0.5 + random.random())
+            logger.warning('[retry %d] %s in %.2fs: %s', attempt + 1, url, wait, error)
+            time.sleep(wait)
+            attempt += 1
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ThreadPool(self.workers)
+        return self._pool
+
+    def submit(self, fn, *args):
+        """Call fn(*args) in the thread pool, return an `AsyncResult`."""
+        return self.pool.apply_async(fn, args)
+
+    def map(self, fn, iterable):
+        """Call fn on each item in the thread pool, yield the results in order."""
+        return self.pool.imap(fn, iterable)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        self.session.close()
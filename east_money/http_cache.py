@@ -0,0 +1,238 @@
+# encoding='utf-8'
+
+# pylint: disable=c0111,c0325
+
+"""
+On-disk cache of HTTP responses shared by runs and processes.
+
+Responses of 200 are kept in a SQLite database with a time to live chosen by
+the url. A fresh response is returned without a request, a stale one is
+revalidated by `If-None-Match` or `If-Modified-Since` if the server gave an
+`ETag` or `Last-Modified`, and a 304 renews it. The least recently used
+responses are evicted when the cache grows over `max_size` bytes.
+
+In offline mode the network is never touched, cached responses are returned
+however old they are, and a missing one raises `CacheMiss`. So tests can run
+against a cache of fixtures.
+
+The cache of `default_cache()` is configured by the environment::
+
+    EAST_MONEY_CACHE=path/to/cache      folder of the cache, no cache if not set
+    EAST_MONEY_OFFLINE=1                offline mode
+
+Usage::
+
+    >> cache = ResponseCache('http_cache', max_size=512 << 20)
+    >> fetcher = Fetcher(cache=cache)
+    >> resp = fetcher.get(url)
+    >> resp.from_cache
+    True
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+logger = logging.getLogger(__name__)
+
+# Time to live in seconds of the responses of urls matching the patterns,
+# the first matched one is taken. None is forever, 0 is not cached.
+DEFAULT_TTLS = [
+    (r'/notices/detail/', None),  # a notice never changes
+    (r'/notices/getdata\.ashx', 3600),  # index pages get new notices
+    (r'/center/BKList\.html', 86400),  # sections
+    (r'/JS\.aspx', 86400),  # stocks of sections
+]
+DEFAULT_TTL = 3600
+
+# Headers which do not apply to the decoded content kept in the cache.
+_dropped_headers = ('content-encoding', 'content-length', 'transfer-encoding', 'connection')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    content BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    expires_at REAL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+'''
+
+
+class CacheMiss(Exception):
+    pass
+
+
+class ResponseCache(object):
+    """
+    Cache of responses in the folder `root`.
+
+    `ttls` is a list of (url_pattern, seconds) in place of `DEFAULT_TTLS`, and
+    `default_ttl` is for the urls matching none of them. The cache is used by
+    the threads of a fetcher, and by processes opening the same folder.
+    """
+
+    def __init__(self, root, max_size=1 << 30, ttls=None, default_ttl=DEFAULT_TTL, offline=False,
+                 timeout=60):
+        self.root = root
+        self.max_size = max_size
+        self.ttls = [(re.compile(p), ttl) for p, ttl in (DEFAULT_TTLS if ttls is None else ttls)]
+        self.default_ttl = default_ttl
+        self.offline = offline
+        self.stats = dict.fromkeys(['hits', 'misses', 'revalidated', 'stored', 'evicted'], 0)
+
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, 'cache.sqlite'), timeout=timeout,
+                                    check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(_SCHEMA)
+        self.conn.commit()
+        self._size = self.size()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def ttl_of(self, url):
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return self.default_ttl
+
+    def size(self):
+        with self._lock:
+            return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def __load(self, url):
+        with self._lock:
+            return self.conn.execute(
+                'SELECT status, headers, content, expires_at FROM responses WHERE url = ?', (url, )
+            ).fetchone()
+
+    def __touch(self, url, expires_at=False):
+        now = time.time()
+        with self._lock:
+            if expires_at is False:
+                self.conn.execute('UPDATE responses SET accessed_at = ? WHERE url = ?', (now, url))
+            else:
+                self.conn.execute('UPDATE responses SET accessed_at = ?, stored_at = ?, expires_at = ? '
+                                  'WHERE url = ?', (now, now, expires_at, url))
+            self.conn.commit()
+
+    def __store(self, url, resp, ttl):
+        headers = dict((k, v) for k, v in resp.headers.items() if k.lower() not in _dropped_headers)
+        content = resp.content
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, resp.status_code, json.dumps(headers), sqlite3.Binary(content), len(content),
+                 now, None if ttl is None else now + ttl, now))
+            self.conn.commit()
+            self._size += len(content)
+        self.stats['stored'] += 1
+        if self._size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used responses until the cache is within 90% of `max_size`."""
+        with self._lock:
+            # Other processes write into the cache as well.
+            self._size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            if self._size <= self.max_size:
+                return
+            target = self.max_size * 0.9
+            removed = []
+            for url, size in self.conn.execute('SELECT url, size FROM responses ORDER BY accessed_at'):
+                if self._size <= target:
+                    break
+                removed.append((url, ))
+                self._size -= size
+            self.conn.executemany('DELETE FROM responses WHERE url = ?', removed)
+            self.conn.commit()
+        self.stats['evicted'] += len(removed)
+        logger.info('evicted %d responses from the cache', len(removed))
+
+    def _response(self, url, status, headers, content):
+        resp = requests.models.Response()
+        resp.url = url
+        resp.status_code = status
+        resp.headers = CaseInsensitiveDict(json.loads(headers))
+        resp._content = bytes(content)  # pylint: disable=w0212
+        resp.encoding = requests.utils.get_encoding_from_headers(resp.headers)
+        resp.from_cache = True
+        return resp
+
+    def get(self, url, fetch, **kwargs):
+        """
+        Get a url from the cache, or by `fetch(url, **kwargs)` which returns a
+        `requests.Response`, and keep the response in the cache.
+
+        Raise CacheMiss in offline mode if the url is not cached.
+        """
+        entry = self.__load(url)
+        if entry is not None:
+            status, headers, content, expires_at = entry
+            if self.offline or expires_at is None or expires_at > time.time():
+                self.stats['hits'] += 1
+                self.__touch(url)
+                return self._response(url, status, headers, content)
+        if self.offline:
+            self.stats['misses'] += 1
+            raise CacheMiss('%s is not cached' % url)
+
+        ttl = self.ttl_of(url)
+        if entry is not None:
+            validators = CaseInsensitiveDict(json.loads(entry[1]))
+            request_headers = dict(kwargs.pop('headers', None) or {})
+            if 'etag' in validators:
+                request_headers['If-None-Match'] = validators['etag']
+            if 'last-modified' in validators:
+                request_headers['If-Modified-Since'] = validators['last-modified']
+            kwargs['headers'] = request_headers
+
+        resp = fetch(url, **kwargs)
+        if resp.status_code == 304 and entry is not None:
+            self.stats['revalidated'] += 1
+            self.__touch(url, None if ttl is None else time.time() + ttl)
+            return self._response(url, *entry[:3])
+
+        self.stats['misses'] += 1
+        resp.from_cache = False
+        if resp.status_code == 200 and ttl != 0:
+            self.__store(url, resp, ttl)
+        return resp
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute('DELETE FROM responses')
+            self.conn.commit()
+            self._size = 0
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def default_cache():
+    """Get a cache configured by the environment variables, None if EAST_MONEY_CACHE is not set."""
+    root = os.environ.get('EAST_MONEY_CACHE')
+    if not root:
+        return None
+    return ResponseCache(root, offline=os.environ.get('EAST_MONEY_OFFLINE', '') not in ('', '0'))
@@ -0,0 +1,133 @@
+# encoding='utf-8'
+
+# pylint: disable=c0111,c0325
+
+"""
+Persistent manifest of downloaded notices, kept in a SQLite database.
+
+Notices are keyed by their `INFOCODE` under each stock, as a notice can be
+listed by several stocks, with the notice date, title and the path of the
+saved file. A stock is marked complete once its whole history of index
+pages has been walked, after which an incremental crawl can stop at the
+first index page of known notices only.
+
+Usage::
+
+    >> manifest = Manifest('notices.sqlite')
+    >> manifest.known('000004', ['AN201701030001', 'AN201701030002'])
+    set([u'AN201701030001'])
+    >> manifest.add('000004', info, '000004/000004_xx/2017-01-03_xx.txt', 1024)
+    >> manifest.commit()
+"""
+
+import os
+import sqlite3
+import time
+
+
+default_manifest = 'notices.sqlite'
+
+# SQLite limits the count of variables in a statement, 999 in old versions.
+_MAX_VARIABLES = 500
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS notices (
+    stock_code TEXT NOT NULL,
+    info_code TEXT NOT NULL,
+    notice_date TEXT,
+    title TEXT,
+    path TEXT,
+    size INTEGER,
+    fetched_at TEXT,
+    PRIMARY KEY (stock_code, info_code)
+);
+CREATE TABLE IF NOT EXISTS stocks (
+    stock_code TEXT PRIMARY KEY,
+    complete INTEGER NOT NULL DEFAULT 0,
+    crawled_at TEXT
+);
+'''
+
+
+class Manifest(object):
+    """
+    Manifest of notices in the SQLite database `path`.
+
+    A connection is bound to the thread creating it, so use a manifest in one
+    thread. Processes crawling into the same folder open their own manifests
+    of the same database, writes are serialized by the database lock.
+    """
+
+    def __init__(self, path=default_manifest, timeout=60):
+        self.path = path
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.conn = sqlite3.connect(path, timeout=timeout)
+        # Readers are not blocked by the writer of another process.
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(_SCHEMA)
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def known(self, stock_code, info_codes):
+        """Get the set of info codes of a stock which are in the manifest."""
+        info_codes = list(info_codes)
+        found = set()
+        for i in range(0, len(info_codes), _MAX_VARIABLES):
+            chunk = info_codes[i:i + _MAX_VARIABLES]
+            rows = self.conn.execute(
+                'SELECT info_code FROM notices WHERE stock_code = ? AND info_code IN (%s)'
+                % ','.join('?' * len(chunk)),
+                [stock_code] + chunk,
+            )
+            found.update(row[0] for row in rows)
+        return found
+
+    def get(self, stock_code, info_code):
+        """Get the record of a notice as a dict, None if it is unknown."""
+        cursor = self.conn.execute(
+            'SELECT stock_code, info_code, notice_date, title, path, size, fetched_at '
+            'FROM notices WHERE stock_code = ? AND info_code = ?', (stock_code, info_code))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([d[0] for d in cursor.description], row))
+
+    def add(self, stock_code, info, path, size, notice_date=None):
+        """Record a notice of the index page `info` saved to `path`."""
+        self.conn.execute(
+            'INSERT OR REPLACE INTO notices VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (stock_code, info['INFOCODE'], notice_date or info['NOTICEDATE'][:10],
+             info['NOTICETITLE'], path, size, time.strftime('%Y-%m-%d %H:%M:%S')),
+        )
+
+    def count(self, stock_code=None):
+        if stock_code is None:
+            return self.conn.execute('SELECT COUNT(*) FROM notices').fetchone()[0]
+        return self.conn.execute(
+            'SELECT COUNT(*) FROM notices WHERE stock_code = ?', (stock_code, )).fetchone()[0]
+
+    def is_complete(self, stock_code):
+        """Check whether the whole history of a stock has been crawled."""
+        row = self.conn.execute(
+            'SELECT complete FROM stocks WHERE stock_code = ?', (stock_code, )).fetchone()
+        return bool(row and row[0])
+
+    def set_complete(self, stock_code, complete=True):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO stocks VALUES (?, ?, ?)',
+            (stock_code, int(complete), time.strftime('%Y-%m-%d %H:%M:%S')),
+        )
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,414 @@
+﻿# encoding='utf-8'
+
+# pylint: disable=c0111,c0325
+
+"""
+Inverted full-text index of downloaded notices.
+
+Titles and bodies are tokenized into words of letters and digits, and runs of
+Chinese characters into overlapping bigrams, with the last character of each
+run kept as a unigram, so a query of any characters can be looked up. The
+index is a SQLite database, postings of a term are arrays of document ids
+appended in chunks, one for each indexing batch, so new notices are indexed
+incrementally. `optimize` merges the chunks of each term.
+
+All the terms of a query must be in a notice. Chinese words are matched by
+all of their bigrams, which are not checked to be adjacent.
+
+Usage::
+
+    # index new notices of a download folder or a segment store
+    > python search.py index search.sqlite --folder=notices
+    > python search.py index search.sqlite --store=notices/store
+
+    # search notices
+    > python search.py query search.sqlite 股东大会 决议 --stock=000004 --from=2016-01-01
+    > python search.py query search.sqlite 重组 --section=军工 --limit=50
+
+    > python search.py optimize search.sqlite
+
+Options of query:
+
+    --stock=CODES       stock codes joined by commas
+    --section=NAMES     section names in sections.json joined by commas
+    --sections=FILE     path of sections.json, default the one of the repository
+    --from=DATE         notices of the date or later, in the format of 2016-01-31
+    --to=DATE           notices of the date or earlier
+    --limit=N           count of notices to show, the latest first, default 20
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+import unicodedata
+import zlib
+from array import array
+from bisect import bisect_left
+
+from east_money import SPLIT, parse_options
+from manifest import default_manifest
+from segment_store import SegmentStore
+
+
+logger = logging.getLogger(__name__)
+
+default_index = 'search.sqlite'
+default_sections = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sections.json')
+
+_cjk = u'\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_token_pattern = re.compile(u'([%s]+)|((?:(?![%s])[^\\W_])+)' % (_cjk, _cjk), re.U)
+_MAX_TERM = 32
+# Candidates above it are ordered by scanning notices by date instead.
+_MAX_LOOKUP = 20000
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS docs (
+    doc_id INTEGER PRIMARY KEY,
+    stock_code TEXT NOT NULL,
+    info_code TEXT NOT NULL,
+    notice_date TEXT,
+    title TEXT,
+    path TEXT,
+    UNIQUE (stock_code, info_code)
+);
+CREATE INDEX IF NOT EXISTS docs_date ON docs (notice_date);
+CREATE INDEX IF NOT EXISTS docs_stock ON docs (stock_code, notice_date);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    first_doc INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    docs BLOB NOT NULL,
+    PRIMARY KEY (term, first_doc)
+);
+'''
+
+
+def _doc_array(data=None):
+    docs = array('I')
+    if data:
+        data = zlib.decompress(data)
+        if hasattr(docs, 'frombytes'):
+            docs.frombytes(data)
+        else:
+            docs.fromstring(data)
+    return docs
+
+
+def _doc_blob(docs):
+    data = docs.tobytes() if hasattr(docs, 'tobytes') else docs.tostring()
+    return sqlite3.Binary(zlib.compress(data, 1))
+
+
+def _contains(docs, doc_id):
+    i = bisect_left(docs, doc_id)
+    return i < len(docs) and docs[i] == doc_id
+
+
+def tokenize(text):
+    """Get the set of terms of a text."""
+    text = unicodedata.normalize('NFKC', text).lower()
+    terms = set()
+    for cjk, word in _token_pattern.findall(text):
+        if word:
+            terms.add(word[:_MAX_TERM])
+            continue
+        terms.update(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        terms.add(cjk[-1])
+    return terms
+
+
+def _query_terms(text):
+    """Get the terms of a query, a single Chinese character stands for all the terms beginning with it."""
+    text = unicodedata.normalize('NFKC', text).lower()
+    terms = []
+    for cjk, word in _token_pattern.findall(text):
+        if word:
+            terms.append((word[:_MAX_TERM], False))
+        elif len(cjk) == 1:
+            terms.append((cjk, True))
+        else:
+            terms.extend((cjk[i:i + 2], False) for i in range(len(cjk) - 1))
+    return terms
+
+
+def split_notice(content):
+    """Get (title, body) of the content of a notice file."""
+    text = content.decode('utf-8')
+    parts = text.split(SPLIT, 2)
+    return parts[0], parts[-1]
+
+
+_sections_cache = {}  # in the format of {path: (mtime, sections)}
+
+
+def load_sections(sections_file=default_sections):
+    """Load sections.json, which is cached until the file is changed."""
+    mtime = os.path.getmtime(sections_file)
+    cached = _sections_cache.get(sections_file)
+    if cached is None or cached[0] != mtime:
+        with open(sections_file) as f:
+            cached = _sections_cache[sections_file] = (mtime, json.load(f))
+    return cached[1]
+
+
+def stocks_of_sections(names, sections_file=default_sections):
+    """
+    Get the set of stock codes in any of the sections, by names of any kind
+    like area, notion, trade or others (中小版, 创业版).
+    """
+    names = set(names)
+    sections = load_sections(sections_file)
+    return set(
+        code for code, info in sections.items()
+        if any(names.intersection(value) for key, value in info.items()
+               if key != 'name' and isinstance(value, list))
+    )
+
+
+class SearchIndex(object):
+    """
+    Inverted index of notices in the SQLite database `path`.
+
+    Notices are indexed in batches of `batch_size`, each committed with the
+    postings of it, so an interrupted indexing loses the current batch only.
+    """
+
+    def __init__(self, path=default_index, batch_size=2000):
+        self.path = path
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(_SCHEMA)
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM docs').fetchone()[0]
+
+    def add_notices(self, notices):
+        """
+        Index notices given as (stock_code, info_code, notice_date, path, content),
+        the ones indexed before are skipped. Return the count of notices indexed.
+        """
+        postings = {}  # in the format of {term: array_of_doc_ids}
+        added = 0
+        for stock_code, info_code, notice_date, path, content in notices:
+            title, body = split_notice(content)
+            try:
+                cursor = self.conn.execute(
+                    'INSERT INTO docs (stock_code, info_code, notice_date, title, path) VALUES (?, ?, ?, ?, ?)',
+                    (stock_code, info_code, notice_date, title, path))
+            except sqlite3.IntegrityError:
+                continue
+            doc_id = cursor.lastrowid
+            for term in tokenize(title) | tokenize(body):
+                docs = postings.get(term)
+                if docs is None:
+                    docs = postings[term] = array('I')
+                docs.append(doc_id)
+            added += 1
+            if added % self.batch_size == 0:
+                self.__flush(postings)
+                logger.info('indexed %d notices', added)
+        self.__flush(postings)
+        return added
+
+    def __flush(self, postings):
+        # Documents are numbered in order, so the chunks of a term are
+        # ordered by their first documents.
+        self.conn.executemany(
+            'INSERT INTO postings VALUES (?, ?, ?, ?)',
+            ((term, docs[0], len(docs), _doc_blob(docs)) for term, docs in postings.items()))
+        self.conn.commit()
+        postings.clear()
+
+    def __new_rows(self, source_db, table):
+        """Get rows of notices in an attached database which are not indexed yet."""
+        self.conn.execute('ATTACH DATABASE ? AS source', (source_db, ))
+        try:
+            order = ' ORDER BY n.segment, n.offset' if table == 'store' else ''
+            return self.conn.execute(
+                'SELECT n.stock_code, n.info_code, n.notice_date, n.path FROM source.notices n '
+                'WHERE NOT EXISTS (SELECT 1 FROM docs d '
+                'WHERE d.stock_code = n.stock_code AND d.info_code = n.info_code)' + order).fetchall()
+        finally:
+            self.conn.execute('DETACH DATABASE source')
+
+    def index_folder(self, folder, manifest_file=None):
+        """Index the new notices of a download folder, by the paths in its manifest."""
+        rows = self.__new_rows(manifest_file or os.path.join(folder, default_manifest), 'manifest')
+
+        def _notices():
+            for stock_code, info_code, notice_date, path in rows:
+                filename = os.path.join(folder, path)
+                if os.path.exists(filename):
+                    with open(filename, 'rb') as f:
+                        yield stock_code, info_code, notice_date, path, f.read()
+        return self.add_notices(_notices())
+
+    def index_store(self, store):
+        """Index the new notices of a `SegmentStore`."""
+        rows = self.__new_rows(os.path.join(store.root, 'index.sqlite'), 'store')
+
+        def _notices():
+            for stock_code, info_code, notice_date, path in rows:
+                yield stock_code, info_code, notice_date, path, store.get(stock_code, info_code)
+        return self.add_notices(_notices())
+
+    def postings(self, term, prefix=False):
+        """Get the sorted array of documents of a term, or of all the terms beginning with it."""
+        if not prefix:
+            rows = self.conn.execute(
+                'SELECT docs FROM postings WHERE term = ? ORDER BY first_doc', (term, ))
+            docs = array('I')
+            for data, in rows:
+                docs.extend(_doc_array(data))
+            return docs
+        rows = self.conn.execute(
+            'SELECT docs FROM postings WHERE term >= ? AND term < ?', (term, term + u'\uffff'))
+        docs = set()
+        for data, in rows:
+            docs.update(_doc_array(data))
+        return array('I', sorted(docs))
+
+    def optimize(self):
+        """Merge the chunks of postings of each term into one."""
+        terms = [row[0] for row in self.conn.execute(
+            'SELECT term FROM postings GROUP BY term HAVING COUNT(*) > 1')]
+        for term in terms:
+            docs = self.postings(term)
+            self.conn.execute('DELETE FROM postings WHERE term = ?', (term, ))
+            self.conn.execute('INSERT INTO postings VALUES (?, ?, ?, ?)',
+                              (term, docs[0], len(docs), _doc_blob(docs)))
+        self.conn.commit()
+        self.conn.execute('VACUUM')
+        return len(terms)
+
+    def match(self, query):
+        """Get the sorted list of documents containing all the terms of the query."""
+        terms = _query_terms(query)
+        if not terms:
+            return []
+        # Start from the shortest postings, and look up the others by bisection
+        # if they are much longer, or intersect them as sets.
+        lists = sorted((self.postings(term, prefix) for term, prefix in set(terms)), key=len)
+        candidates = lists[0]
+        for docs in lists[1:]:
+            if len(candidates) * 20 < len(docs):
+                candidates = [d for d in candidates if _contains(docs, d)]
+            else:
+                candidates = set(candidates).intersection(docs)
+            if not candidates:
+                return []
+        return sorted(candidates)
+
+    def search(self, query, stock_codes=None, date_from=None, date_to=None, sections=None,
+               sections_file=default_sections, limit=20):
+        """
+        Search notices with all the terms of the query, the latest first.
+
+        Notices can be filtered by stock codes, names of sections, and a range
+        of dates including both ends. Return a list of dicts of notices.
+        """
+        candidates = self.match(query)
+        if not candidates:
+            return []
+
+        where = []
+        params = []
+        if sections:
+            codes = stocks_of_sections(sections, sections_file)
+            stock_codes = codes if stock_codes is None else codes.intersection(stock_codes)
+        if stock_codes is not None:
+            stock_codes = sorted(stock_codes)
+            if not stock_codes:
+                return []
+            where.append('stock_code IN (%s)' % ','.join('?' * len(stock_codes)))
+            params.extend(stock_codes)
+        if date_from:
+            where.append('notice_date >= ?')
+            params.append(date_from)
+        if date_to:
+            where.append('notice_date <= ?')
+            params.append(date_to)
+
+        columns = 'doc_id, stock_code, info_code, notice_date, title, path'
+        rows = []
+        if len(candidates) <= _MAX_LOOKUP:
+            for i in range(0, len(candidates), 500):
+                chunk = candidates[i:i + 500]
+                sql = 'SELECT %s FROM docs WHERE doc_id IN (%s)' % (columns, ','.join('?' * len(chunk)))
+                rows.extend(self.conn.execute(' AND '.join([sql] + where), chunk + params))
+            rows.sort(key=lambda row: (row[3], row[0]), reverse=True)
+            rows = rows[:limit]
+        else:
+            # Most of the notices match, scanning from the latest finds them soon.
+            candidates = set(candidates)
+            sql = 'SELECT %s FROM docs' % columns
+            if where:
+                sql += ' WHERE ' + ' AND '.join(where)
+            for row in self.conn.execute(sql + ' ORDER BY notice_date DESC, doc_id DESC', params):
+                if row[0] in candidates:
+                    rows.append(row)
+                    if len(rows) >= limit:
+                        break
+
+        keys = ['stock_code', 'info_code', 'notice_date', 'title', 'path']
+        return [dict(zip(keys, row[1:])) for row in rows]
+
+
+def main(argv):
+    # Arguments are bytes in python 2.
+    argv = [arg.decode(sys.stdin.encoding or 'utf-8') if isinstance(arg, bytes) else arg for arg in argv]
+    args = [arg for arg in argv if not arg.startswith('--')]
+    options = parse_options(argv)
+    if len(args) < 2:
+        sys.exit('Usage: search.py index|query|optimize INDEX [QUERY]')
+    command, index_file, words = args[0], args[1], args[2:]
+
+    with SearchIndex(index_file) as index:
+        if command == 'index':
+            start = time.time()
+            added = 0
+            if options.get('folder'):
+                added += index.index_folder(options['folder'])
+            if options.get('store'):
+                with SegmentStore(options['store']) as store:
+                    added += index.index_store(store)
+            print('%d notices indexed in %.1fs, %d in total' % (added, time.time() - start, index.count()))
+        elif command == 'optimize':
+            print('%d terms merged' % index.optimize())
+        elif command == 'query' and words:
+            start = time.time()
+            results = index.search(
+                u' '.join(words),
+                stock_codes=options.get('stock') and options['stock'].split(','),
+                date_from=options.get('from'),
+                date_to=options.get('to'),
+                sections=options.get('section') and options['section'].split(','),
+                sections_file=options.get('sections') or default_sections,
+                limit=int(options.get('limit', 20)),
+            )
+            for r in results:
+                print((u'%s %s %s  %s' % (r['notice_date'], r['stock_code'], r['title'], r['path'])).encode('utf-8'))
+            print('%d notices in %.1fms' % (len(results), (time.time() - start) * 1000))
+        else:
+            sys.exit('Unknown command %s' % command)
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
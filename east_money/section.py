@@ -5,9 +5,11 @@
 import json
 import logging
 import re
+import sys
 from urllib import urlencode
 
-import requests
+from fetcher import Fetcher
+from http_cache import ResponseCache, default_cache
 
 
 console_handler = logging.StreamHandler()
@@ -18,6 +20,16 @@ logger.setLevel(logging.DEBUG)
 logger.addHandler(console_handler)
 
 
+default_fetcher = None
+
+
+def get_fetcher():
+    global default_fetcher
+    if default_fetcher is None:
+        default_fetcher = Fetcher(rate=0, cache=default_cache())
+    return default_fetcher
+
+
 def get_sections():
     # We can get the list of all sections in notion page or area page or trade page.
     #   http://quote.eastmoney.com/center/BKList.html#notion
@@ -25,7 +37,7 @@ def get_sections():
     #   http://quote.eastmoney.com/center/BKList.html#trade
     # Here we do this through notion page.
     notion_url = 'http://quote.eastmoney.com/center/BKList.html#notion'
-    page = requests.get(notion_url)
+    page = get_fetcher().get(notion_url)
     page.encoding = 'gbk'
     html = page.text
 
@@ -53,7 +65,7 @@ def get_stock_list_of_section(cmd_code, section_name):
         'js': '[(x)]',
         'cmd': cmd_code,
     }
-    resp = requests.get(url + urlencode(query))
+    resp = get_fetcher().get(url + urlencode(query))
     if resp.status_code != 200:
         logger.error('get_stock_list_of_section error')
     result = resp.json()
@@ -120,4 +132,8 @@ def export_stock_section_info(use_cache=True):
 
 
 if __name__ == '__main__':
+    # python section.py [--cache=DIR] [--offline]
+    options = dict(arg[2:].partition('=')[::2] for arg in sys.argv[1:] if arg.startswith('--'))
+    if options.get('cache'):
+        default_fetcher = Fetcher(rate=0, cache=ResponseCache(options['cache'], offline='offline' in options))
     export_stock_section_info()
@@ -0,0 +1,362 @@
+# encoding='utf-8'
+
+# pylint: disable=c0111,c0325
+
+"""
+Store of notices packed into compressed segment files.
+
+Notices are appended to segment files as separately compressed records, and
+a SQLite index maps (stock_code, info_code) to the segment, offset and length
+of each one, so any notice is read by a seek. Every store instance appends to
+a segment of its own, so processes can write into the same store at the
+same time.
+
+A notice stored again makes the old record dead. `compact` rewrites the
+segments into full ones ordered by stock and date, dropping dead records and
+records missing from the index. `export` writes the notices back to the
+folder layout of `east_money.load_stock`.
+
+Usage::
+
+    > python segment_store.py notices_store stats
+    > python segment_store.py notices_store compact
+    > python segment_store.py notices_store export notices [000004 000005]
+    > python segment_store.py notices_store import notices
+
+`import` stores the notices in a download folder, by the paths recorded in
+its manifest, notices.sqlite.
+"""
+
+import logging
+import os
+import sqlite3
+import struct
+import sys
+import time
+import zlib
+
+from manifest import default_manifest
+
+
+logger = logging.getLogger(__name__)
+
+# Header of a record: magic, length of the compressed data, crc32 of the raw data.
+_record_header = struct.Struct('<4sII')
+_MAGIC = b'NTC1'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS segments (
+    segment INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS notices (
+    stock_code TEXT NOT NULL,
+    info_code TEXT NOT NULL,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    crc INTEGER NOT NULL,
+    notice_date TEXT,
+    path TEXT,
+    stored_at TEXT,
+    PRIMARY KEY (stock_code, info_code)
+);
+CREATE INDEX IF NOT EXISTS notices_segment ON notices (segment, offset);
+'''
+
+
+class StoreError(Exception):
+    pass
+
+
+def _crc(data):
+    return zlib.crc32(data) & 0xffffffff
+
+
+class SegmentStore(object):
+    """
+    Store of notices in the folder `root`.
+
+    Segments are closed when they reach `segment_size` bytes, and records are
+    compressed by zlib at `compress_level`. The index is committed by `flush`,
+    records appended after the last commit are reclaimed by `compact`.
+    """
+
+    def __init__(self, root, segment_size=64 << 20, compress_level=6, timeout=60):
+        self.root = root
+        self.segment_size = segment_size
+        self.compress_level = compress_level
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        self.conn = sqlite3.connect(os.path.join(root, 'index.sqlite'), timeout=timeout)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(_SCHEMA)
+        self.conn.commit()
+
+        self._segment = None  # the segment being appended to
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def segment_path(self, segment):
+        return os.path.join(self.root, 'seg-%06d.dat' % segment)
+
+    def segments(self):
+        return [row[0] for row in self.conn.execute('SELECT segment FROM segments ORDER BY segment')]
+
+    def __new_segment(self):
+        self.__close_segment()
+        cursor = self.conn.execute(
+            'INSERT INTO segments (created_at) VALUES (?)', (time.strftime('%Y-%m-%d %H:%M:%S'), ))
+        # The segment is taken by this store as soon as it is committed.
+        self.conn.commit()
+        self._segment = cursor.lastrowid
+        self._file = open(self.segment_path(self._segment), 'ab')
+
+    def __close_segment(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._segment = None
+
+    def __write_record(self, record):
+        if self._file is None or self._file.tell() >= self.segment_size:
+            self.__new_segment()
+        offset = self._file.tell()
+        self._file.write(record)
+        return self._segment, offset
+
+    def put(self, stock_code, info_code, data, path=None, notice_date=None):
+        """Store the content of a notice, `path` is its path in the folder layout."""
+        compressed = zlib.compress(data, self.compress_level)
+        record = _record_header.pack(_MAGIC, len(compressed), _crc(data)) + compressed
+        segment, offset = self.__write_record(record)
+        self.conn.execute(
+            'INSERT OR REPLACE INTO notices VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (stock_code, info_code, segment, offset, len(record), len(data), _crc(data),
+             notice_date, path, time.strftime('%Y-%m-%d %H:%M:%S')),
+        )
+
+    def known(self, stock_code, info_codes):
+        """Get the info codes of a stock which are in the store, in the format of {info_code: size}."""
+        found = {}
+        info_codes = list(info_codes)
+        for i in range(0, len(info_codes), 500):
+            chunk = info_codes[i:i + 500]
+            rows = self.conn.execute(
+                'SELECT info_code, size FROM notices WHERE stock_code = ? AND info_code IN (%s)'
+                % ','.join('?' * len(chunk)),
+                [stock_code] + chunk,
+            )
+            found.update(rows)
+        return found
+
+    def has(self, stock_code, info_code):
+        return bool(self.known(stock_code, [info_code]))
+
+    def _read_record(self, f, offset, length):
+        f.seek(offset)
+        record = f.read(length)
+        if len(record) != length:
+            raise StoreError('truncated record at %d of %s' % (offset, f.name))
+        magic, size, _ = _record_header.unpack_from(record)
+        if magic != _MAGIC or size != length - _record_header.size:
+            raise StoreError('broken record at %d of %s' % (offset, f.name))
+        return record
+
+    def _decode(self, record, crc):
+        data = zlib.decompress(record[_record_header.size:])
+        if _crc(data) != crc:
+            raise StoreError('crc mismatch of a record')
+        return data
+
+    def _read(self, f, offset, length, crc):
+        return self._decode(self._read_record(f, offset, length), crc)
+
+    def get(self, stock_code, info_code):
+        """Get the content of a notice, None if it is not in the store."""
+        row = self.conn.execute(
+            'SELECT segment, offset, length, crc FROM notices WHERE stock_code = ? AND info_code = ?',
+            (stock_code, info_code),
+        ).fetchone()
+        if row is None:
+            return None
+        segment, offset, length, crc = row
+        if segment == self._segment:
+            self._file.flush()
+        with open(self.segment_path(segment), 'rb') as f:
+            return self._read(f, offset, length, crc)
+
+    def iter_notices(self, stock_codes=None):
+        """
+        Yield (stock_code, info_code, path, data) of the notices of the given
+        stocks, or all, in the order of segments and offsets.
+        """
+        sql = 'SELECT stock_code, info_code, path, segment, offset, length, crc FROM notices'
+        params = []
+        if stock_codes:
+            stock_codes = list(stock_codes)
+            sql += ' WHERE stock_code IN (%s)' % ','.join('?' * len(stock_codes))
+            params = stock_codes
+        sql += ' ORDER BY segment, offset'
+        if self._file is not None:
+            self._file.flush()
+
+        f = None
+        try:
+            for stock_code, info_code, path, segment, offset, length, crc in self.conn.execute(sql, params).fetchall():
+                if f is None or f.name != self.segment_path(segment):
+                    if f is not None:
+                        f.close()
+                    f = open(self.segment_path(segment), 'rb')
+                yield stock_code, info_code, path, self._read(f, offset, length, crc)
+        finally:
+            if f is not None:
+                f.close()
+
+    def stats(self):
+        """Get counts of notices, segments, and bytes of live records and segment files."""
+        count, live, raw = self.conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(length), 0), COALESCE(SUM(size), 0) FROM notices').fetchone()
+        segments = self.segments()
+        total = sum(os.path.getsize(self.segment_path(s)) for s in segments
+                    if os.path.exists(self.segment_path(s)))
+        return {
+            'notices': count,
+            'segments': len(segments),
+            'raw_bytes': raw,
+            'live_bytes': live,
+            'segment_bytes': total,
+            'dead_bytes': total - live,
+        }
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+        self.conn.commit()
+
+    def close(self):
+        self.flush()
+        self.__close_segment()
+        self.conn.close()
+
+    def compact(self):
+        """
+        Rewrite all the live records into new full segments ordered by stock
+        and notice date, and remove the old segments.
+
+        No other store may write into the same folder while compacting.
+        Return the stats after compaction.
+        """
+        self.flush()
+        self.__close_segment()
+        old_segments = self.segments()
+        rows = self.conn.execute(
+            'SELECT stock_code, info_code, segment, offset, length, crc FROM notices '
+            'ORDER BY stock_code, notice_date, info_code').fetchall()
+
+        files = {}
+        try:
+            for n, (stock_code, info_code, segment, offset, length, crc) in enumerate(rows, 1):
+                if segment not in files:
+                    files[segment] = open(self.segment_path(segment), 'rb')
+                record = self._read_record(files[segment], offset, length)
+                # Broken records are not carried over silently.
+                self._decode(record, crc)
+                new_segment, new_offset = self.__write_record(record)
+                self.conn.execute(
+                    'UPDATE notices SET segment = ?, offset = ? WHERE stock_code = ? AND info_code = ?',
+                    (new_segment, new_offset, stock_code, info_code))
+                if n % 10000 == 0:
+                    logger.info('compacted %d/%d notices', n, len(rows))
+            self.flush()
+            self.__close_segment()
+        finally:
+            for f in files.values():
+                f.close()
+
+        # The index points to new segments only from here.
+        for segment in old_segments:
+            self.conn.execute('DELETE FROM segments WHERE segment = ?', (segment, ))
+        self.conn.commit()
+        for segment in old_segments:
+            if os.path.exists(self.segment_path(segment)):
+                os.remove(self.segment_path(segment))
+        return self.stats()
+
+    def export(self, output_dir, stock_codes=None, overwrite=False):
+        """
+        Write notices to files in `output_dir` by their paths in the folder
+        layout, existing files are kept unless `overwrite`. Return the count
+        of files written.
+        """
+        written = 0
+        for stock_code, info_code, path, data in self.iter_notices(stock_codes):
+            if not path:
+                path = os.path.join(stock_code, '%s.txt' % info_code)
+            filename = os.path.join(output_dir, path)
+            if not overwrite and os.path.exists(filename):
+                continue
+            folder = os.path.dirname(filename)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            with open(filename, 'wb') as f:
+                f.write(data)
+            written += 1
+        return written
+
+    def import_folder(self, folder, manifest_file=None):
+        """
+        Store the notices downloaded into `folder`, by the paths recorded in
+        its manifest. Notices already in the store are skipped. Return the
+        count of notices stored.
+        """
+        manifest_file = manifest_file or os.path.join(folder, default_manifest)
+        conn = sqlite3.connect(manifest_file)
+        try:
+            rows = conn.execute('SELECT stock_code, info_code, notice_date, path FROM notices').fetchall()
+        finally:
+            conn.close()
+
+        stored = 0
+        for stock_code, info_code, notice_date, path in rows:
+            filename = os.path.join(folder, path)
+            if self.has(stock_code, info_code) or not os.path.exists(filename):
+                continue
+            with open(filename, 'rb') as f:
+                self.put(stock_code, info_code, f.read(), path, notice_date)
+            stored += 1
+            if stored % 1000 == 0:
+                self.flush()
+        self.flush()
+        return stored
+
+
+def main(argv):
+    if len(argv) < 2:
+        sys.exit('Usage: segment_store.py STORE stats|compact|export OUT [CODES]|import FOLDER')
+    root, command, args = argv[0], argv[1], argv[2:]
+    with SegmentStore(root) as store:
+        if command == 'stats':
+            pass
+        elif command == 'compact':
+            store.compact()
+        elif command == 'export' and args:
+            print('%d notices exported' % store.export(args[0], args[1:] or None))
+        elif command == 'import' and args:
+            print('%d notices imported' % store.import_folder(args[0]))
+        else:
+            sys.exit('Unknown command %s' % command)
+        for key, value in sorted(store.stats().items()):
+            print('%-14s %d' % (key, value))
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
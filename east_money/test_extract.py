@@ -0,0 +1,74 @@
+﻿# encoding='utf-8'
+
+# pylint: disable=c0111,c0325
+
+"""
+Tests of the fast extractor against the soup one, on snippets of pages.
+
+Usage::
+
+    > python -m unittest discover -s east_money
+"""
+
+import unittest
+
+import extract
+
+
+def page(body):
+    return u'<html><head><title>公告</title></head><body><div class="head">头</div>%s</body></html>' % body
+
+
+# (name, page, whether the fast extractor handles it without soup)
+snippets = [
+    ('plain', page(u'<div class="detail-body"><p>公告内容</p>[点击查看PDF原文]</div>'), True),
+    ('entities', page(u'<div class="detail-body">&amp; &lt;b&gt; &quot;q&quot; &#20844;&#x544A; &nbsp;x</div>'), True),
+    ('amp without semicolon', page(u'<div class="detail-body">AT&amp T &ampx</div>'), False),
+    ('bare ampersand', page(u'<div class="detail-body">1 & 2 &</div>'), True),
+    ('letters after ampersand', page(u'<div class="detail-body">R&D &# 2</div>'), False),
+    ('unknown entity', page(u'<div class="detail-body">a &foo; b</div>'), False),
+    ('latin-1 reference', page(u'<div class="detail-body">caf&#233;</div>'), False),
+    ('whitespace runs', page(u'<div class="detail-body">\n  <p>a</p>\n\n   <p>b</p> \t <p>c</p>\r\n</div>'), True),
+    ('spaces only', page(u'<div class="detail-body"> <br/>\t<br>  </div>'), True),
+    ('nested uppercase div', page(u'<DIV class="detail-body"><div>x<DIV>y</DIV></div>z</DIV><div>after</div>'), True),
+    ('self-closing div', page(u'<div class="detail-body">a<div/>b<div />c</div>'), True),
+    ('quoted > in attributes', page(
+        u'<div class="detail-body" title="a>b"><a href=\'x?a>b\' title="c>d">链接</a>正文</div>'), True),
+    ('many classes', page(u'<div id="x" class="left detail-body clear">正文</div>'), True),
+    ('class mentioned elsewhere', page(
+        u'<div data-x="detail-body">no</div><div class=detail-body>yes</div>'), True),
+    ('not the class', page(u'<div class="detail-bodyx">no</div><div class="detail-body">yes</div>'), True),
+    ('comment', page(u'<div class="detail-body">a<!-- c > d -->b</div>'), False),
+    ('script', page(u'<div class="detail-body"><script>if (a<b) {}</script>text</div>'), False),
+    ('style', page(u'<div class="detail-body"><style>p > a {}</style>text</div>'), False),
+    ('pre', page(u'<div class="detail-body"><pre>  a\n\n  b</pre></div>'), False),
+    ('bare <', page(u'<div class="detail-body">1 < 2</div>'), False),
+    ('not closed', page(u'<div class="detail-body"><p>a</p>'), False),
+    ('pdf link split', page(u'<div class="detail-body">[点击查看<a>PDF</a>原文]</div>'), True),
+]
+
+
+class TestExtract(unittest.TestCase):
+    def test_same_as_soup(self):
+        for name, html, _ in snippets:
+            content = html.encode('gbk')
+            self.assertEqual(extract.extract_fast(content), extract.extract_soup(content), name)
+
+    def test_fast_path(self):
+        for name, html, fast in snippets:
+            self.assertEqual(extract.fast_body(html) is not None, fast, name)
+
+    def test_not_gbk(self):
+        content = page(u'<div class="detail-body">caf\xe9</div>').encode('utf-8')
+        self.assertEqual(extract.extract_fast(content), extract.extract_soup(content))
+
+    def test_detail_bodies_counted(self):
+        for body in (u'<div class="head">no body</div>',
+                     u'<div class="detail-body">a</div><div class="detail-body">b</div>'):
+            content = page(body).encode('gbk')
+            self.assertRaises(extract.ExtractError, extract.extract_soup, content)
+            self.assertRaises(extract.ExtractError, extract.extract_fast, content)
+
+
+if __name__ == '__main__':
+    unittest.main()
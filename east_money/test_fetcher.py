@@ -0,0 +1,212 @@
+# encoding='utf-8'
+
+# pylint: disable=c0111,c0325
+
+"""
+Tests of the fetcher and the crawl of a stock against a local stand-in server.
+
+Usage::
+
+    > python -m unittest discover -s east_money
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from urlparse import parse_qs, urlparse
+
+import east_money
+from fetcher import FetchError, Fetcher
+from manifest import Manifest
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """
+    Server of index and detail pages of east_money, recording the requests.
+
+    `/flaky/<key>` fails with 503 `fail_times[key]` times before it succeeds,
+    `/slow/<n>` takes `delay` seconds, and index pages have `pages` pages of
+    `PageSize` notices of any stock.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.url = 'http://127.0.0.1:%d' % self.server_port
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.pages = 3
+            self.delay = 0.05
+            self.fail_times = {}
+            self.requests = []
+            self.active = 0
+            self.max_active = 0
+
+    def index_pages(self):
+        """Get the page indexes of the index requests, in order."""
+        with self.lock:
+            return [int(parse_qs(urlparse(path).query)['PageIndex'][0]) for path in self.requests
+                    if '/notices/getdata.ashx' in path]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        with server.lock:
+            server.requests.append(self.path)
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            if url.path.startswith('/flaky/'):
+                key = url.path[len('/flaky/'):]
+                with server.lock:
+                    fail = server.fail_times.get(key, 0)
+                    server.fail_times[key] = fail - 1
+                if fail > 0:
+                    return self.send(503, 'busy')
+                return self.send(200, key)
+            if url.path.startswith('/slow/'):
+                time.sleep(server.delay)
+                return self.send(200, 'slow')
+            if url.path == '/notices/getdata.ashx':
+                return self.send(200, self.index_page(parse_qs(url.query)))
+            if url.path.startswith('/notices/detail/'):
+                info_code = url.path.split('/')[-1].split(',')[0]
+                return self.send(200, '<html><body><div class="detail-body"><p>notice %s</p>'
+                                      '</div></body></html>' % info_code)
+            self.send(404, '')
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def index_page(self, query):
+        page_idx, page_size = int(query['PageIndex'][0]), int(query['PageSize'][0])
+        data = []
+        if page_idx <= self.server.pages:
+            for i in range(page_size):
+                n = (page_idx - 1) * page_size + i
+                data.append({
+                    'INFOCODE': 'AN%06d' % n,
+                    'NOTICETITLE': u'notice %d' % n,
+                    'NOTICEDATE': '2016-%02d-%02dT00:00:00' % (n % 12 + 1, n % 28 + 1),
+                    'CDSY_SECUCODES': [{'SECURITYSHORTNAME': u'stock'}],
+                })
+        return 'var idx = %s;' % json.dumps({'data': data})
+
+
+class StandInTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StandInServer()
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.reset()
+        self.fetcher = Fetcher(max_per_host=4, rate=0, retries=3, backoff=0.01, timeout=5)
+
+    def tearDown(self):
+        self.fetcher.close()
+
+
+class TestFetcher(StandInTestCase):
+    def test_retry_on_503(self):
+        self.server.fail_times['a'] = 2
+        resp = self.fetcher.get(self.server.url + '/flaky/a')
+        self.assertEqual((resp.status_code, resp.content), (200, 'a'))
+        self.assertEqual(self.server.requests, ['/flaky/a'] * 3)
+
+    def test_fail_after_retries(self):
+        self.server.fail_times['b'] = 10
+        self.assertRaises(FetchError, self.fetcher.get, self.server.url + '/flaky/b')
+        self.assertEqual(len(self.server.requests), self.fetcher.retries + 1)
+
+    def test_per_host_limit(self):
+        with Fetcher(max_per_host=2, rate=0, workers=8) as fetcher:
+            urls = [self.server.url + '/slow/%d' % i for i in range(12)]
+            statuses = [resp.status_code for resp in fetcher.map(fetcher.get, urls)]
+        self.assertEqual(statuses, [200] * 12)
+        self.assertEqual(self.server.max_active, 2)
+
+
+class TestIndex(StandInTestCase):
+    def setUp(self):
+        super(TestIndex, self).setUp()
+        self.base_url = east_money.base_url
+        east_money.base_url = self.server.url
+        self.folder = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.folder)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+        east_money.base_url = self.base_url
+        super(TestIndex, self).tearDown()
+
+    def test_iter_all_pages(self):
+        pages = list(east_money.iter_index('000004', self.fetcher, page_size=5))
+        self.assertEqual([p['data'][0]['INFOCODE'] for p in pages], ['AN000000', 'AN000005', 'AN000010'])
+        # Reading stops at the first empty page.
+        self.assertEqual(self.server.index_pages(), [1, 2, 3, 4])
+
+    def test_prefetch_is_bounded(self):
+        self.server.pages = 20
+        pages = east_money.iter_index('000004', self.fetcher, prefetch=1, page_size=5)
+        self.assertEqual(next(pages)['data'][0]['INFOCODE'], 'AN000000')
+        time.sleep(0.5)
+        # One page in the queue, and one more read but waiting for room.
+        self.assertEqual(self.server.index_pages(), [1, 2, 3])
+        pages.close()
+        time.sleep(1)
+        self.assertEqual(self.server.index_pages(), [1, 2, 3])
+
+    def test_incremental_crawl_stops_early(self):
+        # The folder of the stock is made by the caller, as crawl does.
+        os.mkdir('000004')
+        manifest = Manifest(os.path.join(self.folder, 'notices.sqlite'))
+        counts = east_money.load_stock('000004', self.fetcher, manifest, page_size=10)
+        self.assertEqual((counts['pages'], counts['downloaded'], counts['failed']), (3, 30, 0))
+        self.assertTrue(manifest.is_complete('000004'))
+
+        self.server.reset()
+        counts = east_money.load_stock('000004', self.fetcher, manifest, page_size=10)
+        self.assertEqual((counts['pages'], counts['downloaded'], counts['skipped']), (1, 0, 10))
+        # At most one page is fetched ahead in an incremental crawl.
+        self.assertLessEqual(max(self.server.index_pages()), 2)
+        self.assertFalse([path for path in self.server.requests if '/notices/detail/' in path])
+
+        counts = east_money.load_stock('000004', self.fetcher, manifest, page_size=10, full=True)
+        self.assertEqual((counts['pages'], counts['downloaded'], counts['skipped']), (3, 0, 30))
+        manifest.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+# encoding='utf-8'
+
+# pylint: disable=c0111,c0325
+
+"""
+Tests of the response cache, without any network.
+
+Usage::
+
+    > python -m unittest discover -s east_money
+"""
+
+import shutil
+import tempfile
+import time
+import unittest
+
+import requests
+
+from fetcher import Fetcher
+from http_cache import CacheMiss, ResponseCache
+
+
+class FakeFetch(object):
+    """
+    Stand-in of `Fetcher.fetch`, answering 200 with an ETag, or 304 when the
+    request has the same ETag in If-None-Match.
+    """
+
+    def __init__(self, size=100):
+        self.size = size
+        self.etag = '"v1"'
+        self.requests = []
+
+    def __call__(self, url, **kwargs):
+        headers = kwargs.get('headers') or {}
+        self.requests.append((url, headers))
+        resp = requests.models.Response()
+        resp.url = url
+        if headers.get('If-None-Match') == self.etag:
+            resp.status_code = 304
+            resp._content = b''  # pylint: disable=w0212
+        else:
+            resp.status_code = 200
+            resp._content = (url + ' ' + self.etag).ljust(self.size)  # pylint: disable=w0212
+            resp.headers['ETag'] = self.etag
+            resp.headers['Content-Type'] = 'text/html; charset=gbk'
+        return resp
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.fetch = FakeFetch()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def cache(self, **kwargs):
+        kwargs.setdefault('ttls', [(r'/stale', -1), (r'/never', 0)])
+        return ResponseCache(self.folder, **kwargs)
+
+    def test_hit(self):
+        with self.cache() as cache:
+            first = cache.get('http://host/page', self.fetch)
+            second = cache.get('http://host/page', self.fetch)
+        self.assertFalse(first.from_cache)
+        self.assertTrue(second.from_cache)
+        self.assertEqual((second.status_code, second.content, second.encoding),
+                         (200, first.content, 'gbk'))
+        self.assertEqual(len(self.fetch.requests), 1)
+
+        # Responses are kept for later runs.
+        with self.cache() as cache:
+            self.assertTrue(cache.get('http://host/page', self.fetch).from_cache)
+            self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(len(self.fetch.requests), 1)
+
+    def test_not_cached(self):
+        with self.cache() as cache:
+            cache.get('http://host/never', self.fetch)
+            cache.get('http://host/never', self.fetch)
+            self.assertEqual(cache.size(), 0)
+        self.assertEqual(len(self.fetch.requests), 2)
+
+    def test_offline(self):
+        with self.cache() as cache:
+            cache.get('http://host/stale', self.fetch)
+        with self.cache(offline=True) as cache:
+            # Stale responses are served too.
+            self.assertTrue(cache.get('http://host/stale', self.fetch).from_cache)
+            self.assertRaises(CacheMiss, cache.get, 'http://host/missing', self.fetch)
+            self.assertEqual((cache.stats['hits'], cache.stats['misses']), (1, 1))
+        self.assertEqual(len(self.fetch.requests), 1)
+
+    def test_offline_fetcher(self):
+        with self.cache() as cache:
+            cache.get('http://127.0.0.1:9/page', self.fetch)
+        # Nothing listens on the discard port, the response comes from the cache.
+        with self.cache(offline=True) as cache:
+            with Fetcher(rate=0, retries=0, cache=cache) as fetcher:
+                self.assertTrue(fetcher.get('http://127.0.0.1:9/page').from_cache)
+                self.assertRaises(CacheMiss, fetcher.get, 'http://127.0.0.1:9/other')
+
+    def test_revalidate(self):
+        with self.cache() as cache:
+            first = cache.get('http://host/stale', self.fetch)
+            second = cache.get('http://host/stale', self.fetch)
+            self.assertEqual(self.fetch.requests[1][1].get('If-None-Match'), '"v1"')
+            self.assertTrue(second.from_cache)
+            self.assertEqual(second.content, first.content)
+            self.assertEqual(cache.stats['revalidated'], 1)
+
+            # A changed response replaces the cached one.
+            self.fetch.etag = '"v2"'
+            third = cache.get('http://host/stale', self.fetch)
+            self.assertFalse(third.from_cache)
+            self.assertNotEqual(third.content, first.content)
+            self.assertEqual(cache.get('http://host/stale', self.fetch).content, third.content)
+
+    def test_expired(self):
+        with self.cache(ttls=[], default_ttl=0.2) as cache:
+            cache.get('http://host/page', self.fetch)
+            self.assertTrue(cache.get('http://host/page', self.fetch).from_cache)
+            time.sleep(0.3)
+            cache.get('http://host/page', self.fetch)
+        self.assertEqual(len(self.fetch.requests), 2)
+        self.assertEqual(self.fetch.requests[1][1].get('If-None-Match'), '"v1"')
+
+    def test_lru_eviction(self):
+        with self.cache(max_size=750) as cache:
+            for i in range(5):
+                cache.get('http://host/%d' % i, self.fetch)
+                time.sleep(0.01)
+            # The oldest one is used again, so it is kept.
+            cache.get('http://host/0', self.fetch)
+            time.sleep(0.01)
+            for i in range(5, 10):
+                cache.get('http://host/%d' % i, self.fetch)
+                time.sleep(0.01)
+            self.assertLessEqual(cache.size(), 750)
+            self.assertGreater(cache.stats['evicted'], 0)
+
+            self.fetch.requests = []
+            for url in ('http://host/0', 'http://host/9'):
+                self.assertTrue(cache.get(url, self.fetch).from_cache)
+            cache.get('http://host/1', self.fetch)
+            self.assertEqual([url for url, _ in self.fetch.requests], ['http://host/1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
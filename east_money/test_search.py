@@ -0,0 +1,186 @@
+﻿# encoding='utf-8'
+
+# pylint: disable=c0111,c0325
+
+"""
+Tests of the full-text index of notices.
+
+Usage::
+
+    > python -m unittest discover -s east_money
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import search
+from east_money import SPLIT
+from manifest import Manifest
+from search import SearchIndex, _query_terms, stocks_of_sections, tokenize
+from segment_store import SegmentStore
+
+
+# (stock_code, info_code, notice_date, title, body)
+NOTICES = [
+    ('000004', 'AN1', '2016-01-05', u'2016年第一次临时股东大会决议公告', u'会议审议通过了重组议案。'),
+    ('000004', 'AN2', '2016-03-10', u'关于重大资产重组的进展公告', u'Annual report of ＡＢＣ Company.'),
+    ('000005', 'AN3', '2016-02-01', u'股东大会通知', u'召开股东大会，审议年度报告。'),
+    ('000099', 'AN4', '2016-04-01', u'军工订单公告', u'公司获得军工订单。'),
+    ('000099', 'AN5', '2015-12-31', u'年度报告', u'股东大会'),
+]
+
+SECTIONS = {
+    '000004': {'name': u'国农科技', 'area': [u'广东板块'], 'notion': [u'重组'], 'trade': [u'医药']},
+    '000005': {'name': u'世纪星源', 'area': [u'广东板块'], 'trade': [u'环保'], 'others': [u'中小版']},
+    '000099': {'name': u'中信海直', 'area': [u'广东板块'], 'notion': [u'军工'], 'others': [u'创业版']},
+}
+
+
+def content(title, body):
+    return (title + SPLIT + body).encode('utf-8')
+
+
+class TestTokenize(unittest.TestCase):
+    def test_tokenize(self):
+        self.assertEqual(tokenize(u'股东大会决议 Annual-Report 2016'),
+                         set([u'股东', u'东大', u'大会', u'会决', u'决议', u'议', u'annual', u'report', u'2016']))
+        # Full-width letters and digits are normalized.
+        self.assertEqual(tokenize(u'ＡＢＣ１２'), set([u'abc12']))
+        self.assertEqual(tokenize(u'重组'), set([u'重组', u'组']))
+        self.assertEqual(tokenize(u'年报a股'), set([u'年报', u'报', u'a', u'股']))
+        self.assertEqual(tokenize(u' ,._ '), set())
+
+    def test_query_terms(self):
+        self.assertEqual(_query_terms(u'股东大会'), [(u'股东', False), (u'东大', False), (u'大会', False)])
+        # A single character stands for all the terms beginning with it.
+        self.assertEqual(_query_terms(u'股 ABC'), [(u'股', True), (u'abc', False)])
+        self.assertEqual(_query_terms(u'-'), [])
+
+
+class SearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.index = SearchIndex(os.path.join(self.folder, 'search.sqlite'), batch_size=2)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.folder)
+
+    def add(self, notices=NOTICES):
+        return self.index.add_notices(
+            (stock_code, info_code, notice_date, '%s/%s.txt' % (stock_code, info_code), content(title, body))
+            for stock_code, info_code, notice_date, title, body in notices)
+
+    def codes(self, query, **kwargs):
+        return [r['info_code'] for r in self.index.search(query, **kwargs)]
+
+
+class TestSearch(SearchTestCase):
+    def setUp(self):
+        super(TestSearch, self).setUp()
+        self.add()
+
+    def test_match(self):
+        # The latest first, in titles and bodies.
+        self.assertEqual(self.codes(u'股东大会'), ['AN3', 'AN1', 'AN5'])
+        self.assertEqual(self.codes(u'重组'), ['AN2', 'AN1'])
+        self.assertEqual(self.codes(u'abc annual'), ['AN2'])
+        self.assertEqual(self.codes(u'股东大会 重组'), ['AN1'])
+        self.assertEqual(self.codes(u'股东大会 军工'), [])
+        self.assertEqual(self.codes(u'nothing'), [])
+        self.assertEqual(self.codes(u'股东大会', limit=2), ['AN3', 'AN1'])
+
+    def test_prefix(self):
+        # Terms beginning with the character, and the last one of a run.
+        self.assertEqual(self.codes(u'订'), ['AN4'])
+        self.assertEqual(self.codes(u'议'), ['AN3', 'AN1'])
+        self.assertEqual(self.codes(u'报 年'), ['AN3', 'AN5'])
+        self.assertEqual(self.codes(u'军 订单'), ['AN4'])
+
+    def test_filters(self):
+        self.assertEqual(self.codes(u'公告', stock_codes=['000004']), ['AN2', 'AN1'])
+        self.assertEqual(self.codes(u'公告', stock_codes=[]), [])
+        self.assertEqual(self.codes(u'股东大会', date_from='2016-01-05', date_to='2016-02-01'), ['AN3', 'AN1'])
+        self.assertEqual(self.codes(u'股东大会', date_to='2015-12-31'), ['AN5'])
+
+    def test_sections(self):
+        sections_file = os.path.join(self.folder, 'sections.json')
+        with open(sections_file, 'w') as f:
+            json.dump(SECTIONS, f)
+        self.assertEqual(stocks_of_sections([u'广东板块'], sections_file), set(SECTIONS))
+        self.assertEqual(stocks_of_sections([u'创业版', u'重组'], sections_file), set(['000004', '000099']))
+        # Names of stocks are not sections.
+        self.assertEqual(stocks_of_sections([u'国农科技'], sections_file), set())
+
+        self.assertEqual(self.codes(u'股东大会', sections=[u'中小版'], sections_file=sections_file), ['AN3'])
+        self.assertEqual(self.codes(u'股东大会', sections=[u'广东板块'], stock_codes=['000099', '000006'],
+                                    sections_file=sections_file), ['AN5'])
+        self.assertEqual(self.codes(u'股东大会', sections=[u'医药'], stock_codes=['000005'],
+                                    sections_file=sections_file), [])
+
+    def test_scan_by_date(self):
+        expected = [self.codes(u'公告'), self.codes(u'股东大会', stock_codes=['000004', '000005'], limit=1)]
+        max_lookup = search._MAX_LOOKUP
+        search._MAX_LOOKUP = 1
+        try:
+            self.assertEqual([self.codes(u'公告'),
+                              self.codes(u'股东大会', stock_codes=['000004', '000005'], limit=1)], expected)
+        finally:
+            search._MAX_LOOKUP = max_lookup
+
+    def test_optimize(self):
+        expected = self.codes(u'股东大会')
+        self.assertGreater(self.index.optimize(), 0)
+        self.assertEqual(self.index.optimize(), 0)
+        self.assertEqual(self.codes(u'股东大会'), expected)
+
+
+class TestIncremental(SearchTestCase):
+    def test_add_notices(self):
+        self.assertEqual(self.add(NOTICES[:3]), 3)
+        self.assertEqual(self.add(NOTICES), 2)
+        self.assertEqual(self.index.count(), 5)
+        self.assertEqual(self.codes(u'股东大会'), ['AN3', 'AN1', 'AN5'])
+
+    def test_index_folder(self):
+        download = os.path.join(self.folder, 'notices')
+        manifest = Manifest(os.path.join(download, 'notices.sqlite'))
+
+        def download_notices(notices):
+            for stock_code, info_code, notice_date, title, body in notices:
+                path = os.path.join(stock_code, '%s.txt' % info_code)
+                if not os.path.isdir(os.path.join(download, stock_code)):
+                    os.makedirs(os.path.join(download, stock_code))
+                with open(os.path.join(download, path), 'wb') as f:
+                    f.write(content(title, body))
+                manifest.add(stock_code, {'INFOCODE': info_code, 'NOTICETITLE': title}, path, 0, notice_date)
+            manifest.commit()
+
+        download_notices(NOTICES[:2])
+        self.assertEqual(self.index.index_folder(download), 2)
+        self.assertEqual(self.index.index_folder(download), 0)
+        download_notices(NOTICES[2:])
+        self.assertEqual(self.index.index_folder(download), 3)
+        manifest.close()
+        self.assertEqual(self.codes(u'股东大会'), ['AN3', 'AN1', 'AN5'])
+        self.assertEqual(self.index.search(u'军工')[0]['path'], os.path.join('000099', 'AN4.txt'))
+
+    def test_index_store(self):
+        with SegmentStore(os.path.join(self.folder, 'store')) as store:
+            for stock_code, info_code, notice_date, title, body in NOTICES[:4]:
+                store.put(stock_code, info_code, content(title, body), notice_date=notice_date)
+            store.flush()
+            self.assertEqual(self.index.index_store(store), 4)
+            self.assertEqual(self.index.index_store(store), 0)
+            stock_code, info_code, notice_date, title, body = NOTICES[4]
+            store.put(stock_code, info_code, content(title, body), notice_date=notice_date)
+            store.flush()
+            self.assertEqual(self.index.index_store(store), 1)
+        self.assertEqual(self.codes(u'股东大会'), ['AN3', 'AN1', 'AN5'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+# encoding='utf-8'
+
+# pylint: disable=c0111,c0325
+
+"""
+Tests of the store of notices in segment files.
+
+Usage::
+
+    > python -m unittest discover -s east_money
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from manifest import Manifest
+from segment_store import SegmentStore
+
+
+def notice(stock_code, info_code, version=1):
+    # Long enough to fill small segments, different for every version.
+    return ('%s %s v%d ' % (stock_code, info_code, version)) * 20
+
+
+class StoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.root = os.path.join(self.folder, 'store')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def store(self, **kwargs):
+        return SegmentStore(self.root, **kwargs)
+
+    def segment_files(self):
+        return sorted(name for name in os.listdir(self.root) if name.startswith('seg-'))
+
+
+class TestPutGet(StoreTestCase):
+    def test_put_get(self):
+        with self.store() as store:
+            store.put('000004', 'AN1', notice('000004', 'AN1'), '000004/AN1.txt', '2016-01-02')
+            store.put('000005', 'AN1', notice('000005', 'AN1'))
+            # Read before the index is committed.
+            self.assertEqual(store.get('000004', 'AN1'), notice('000004', 'AN1'))
+            self.assertIsNone(store.get('000004', 'AN2'))
+            self.assertEqual(store.known('000004', ['AN1', 'AN2']), {'AN1': len(notice('000004', 'AN1'))})
+            self.assertFalse(store.has('000006', 'AN1'))
+
+        with self.store() as store:
+            self.assertEqual(store.get('000005', 'AN1'), notice('000005', 'AN1'))
+            self.assertEqual(store.stats()['notices'], 2)
+
+    def test_replace(self):
+        with self.store() as store:
+            store.put('000004', 'AN1', notice('000004', 'AN1'))
+            store.put('000004', 'AN1', notice('000004', 'AN1', 2))
+            self.assertEqual(store.get('000004', 'AN1'), notice('000004', 'AN1', 2))
+            stats = store.stats()
+            self.assertEqual(stats['notices'], 1)
+            # The old record is still in the segment.
+            self.assertEqual(stats['dead_bytes'], stats['segment_bytes'] - stats['live_bytes'])
+            self.assertGreater(stats['dead_bytes'], 0)
+
+    def test_segments_are_closed_when_full(self):
+        with self.store(segment_size=200) as store:
+            for i in range(10):
+                store.put('000004', 'AN%d' % i, notice('000004', 'AN%d' % i))
+            self.assertEqual(len(store.segments()), len(self.segment_files()))
+            self.assertGreater(len(store.segments()), 1)
+            self.assertEqual([data for _, _, _, data in store.iter_notices()],
+                             [notice('000004', 'AN%d' % i) for i in range(10)])
+
+
+class TestCompact(StoreTestCase):
+    def test_compact(self):
+        expected = {}
+        with self.store(segment_size=300) as store:
+            for version in (1, 2):
+                for i in range(12):
+                    stock_code = '%06d' % (4 + i % 3)
+                    data = notice(stock_code, 'AN%d' % i, version)
+                    if version == 1 or i % 2:
+                        store.put(stock_code, 'AN%d' % i, data, notice_date='2016-01-%02d' % (20 - i))
+                        expected[(stock_code, 'AN%d' % i)] = data
+            store.flush()
+            # A record appended after the last commit is not in the index.
+            store.put('000009', 'AN99', notice('000009', 'AN99'))
+            store.conn.rollback()
+            old_files = self.segment_files()
+            before = store.stats()
+
+            after = store.compact()
+            self.assertEqual(after['notices'], len(expected))
+            self.assertEqual(after['dead_bytes'], 0)
+            self.assertEqual(after['live_bytes'], before['live_bytes'])
+            self.assertLess(after['segment_bytes'], before['segment_bytes'])
+            # Old segments are removed.
+            self.assertFalse(set(old_files) & set(self.segment_files()))
+            self.assertEqual(len(store.segments()), len(self.segment_files()))
+
+            for (stock_code, info_code), data in expected.items():
+                self.assertEqual(store.get(stock_code, info_code), data)
+            self.assertIsNone(store.get('000009', 'AN99'))
+
+            # Records are ordered by stock and notice date.
+            keys = [(stock_code, info_code) for stock_code, info_code, _, _ in store.iter_notices()]
+            dates = dict((('%06d' % (4 + i % 3), 'AN%d' % i), 20 - i) for i in range(12))
+            self.assertEqual(keys, sorted(expected, key=lambda k: (k[0], dates[k])))
+
+            # Stored again after compaction, into a new segment.
+            store.put('000004', 'AN0', notice('000004', 'AN0', 3))
+            self.assertEqual(store.get('000004', 'AN0'), notice('000004', 'AN0', 3))
+
+        with self.store() as store:
+            self.assertEqual(store.get('000005', 'AN1'), expected[('000005', 'AN1')])
+
+
+class TestFolders(StoreTestCase):
+    def test_export(self):
+        with self.store() as store:
+            store.put('000004', 'AN1', notice('000004', 'AN1'), os.path.join('000004', '2016-01-02_AN1.txt'))
+            store.put('000005', 'AN2', notice('000005', 'AN2'))
+            output = os.path.join(self.folder, 'notices')
+            self.assertEqual(store.export(output, ['000004']), 1)
+            self.assertEqual(os.listdir(output), ['000004'])
+
+            self.assertEqual(store.export(output), 1)
+            with open(os.path.join(output, '000004', '2016-01-02_AN1.txt'), 'rb') as f:
+                self.assertEqual(f.read(), notice('000004', 'AN1'))
+            # Notices without a path are named by the info code.
+            with open(os.path.join(output, '000005', 'AN2.txt'), 'rb') as f:
+                self.assertEqual(f.read(), notice('000005', 'AN2'))
+
+            # Existing files are kept unless overwritten.
+            store.put('000005', 'AN2', notice('000005', 'AN2', 2))
+            self.assertEqual(store.export(output), 0)
+            self.assertEqual(store.export(output, overwrite=True), 2)
+            with open(os.path.join(output, '000005', 'AN2.txt'), 'rb') as f:
+                self.assertEqual(f.read(), notice('000005', 'AN2', 2))
+
+    def test_import_folder(self):
+        download = os.path.join(self.folder, 'download')
+        os.makedirs(os.path.join(download, '000004'))
+        manifest = Manifest(os.path.join(download, 'notices.sqlite'))
+        for i in range(5):
+            path = os.path.join('000004', 'AN%d.txt' % i)
+            if i != 3:
+                with open(os.path.join(download, path), 'wb') as f:
+                    f.write(notice('000004', 'AN%d' % i))
+            info = {'INFOCODE': 'AN%d' % i, 'NOTICETITLE': u'notice', 'NOTICEDATE': '2016-01-0%dT00:00:00' % (i + 1)}
+            manifest.add('000004', info, path, len(notice('000004', 'AN%d' % i)))
+        manifest.close()
+
+        with self.store() as store:
+            # The file of AN3 is missing.
+            self.assertEqual(store.import_folder(download), 4)
+            self.assertEqual(store.import_folder(download), 0)
+            self.assertEqual(store.get('000004', 'AN2'), notice('000004', 'AN2'))
+            self.assertIsNone(store.get('000004', 'AN3'))
+
+            # Exported back to the same layout.
+            output = os.path.join(self.folder, 'notices')
+            self.assertEqual(store.export(output), 4)
+            self.assertEqual(sorted(os.listdir(os.path.join(output, '000004'))),
+                             ['AN0.txt', 'AN1.txt', 'AN2.txt', 'AN4.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
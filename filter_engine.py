@@ -0,0 +1,298 @@
+"""Typed filter conditions evaluated over whole columns."""
+import operator
+import re
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from six import string_types
+
+import alph_to_num
+
+__all__ = ['Condition', 'parse_condition', 'column_index', 'column_indexes', 'is_equality', 'is_ordering', 'infer_type',
+           'infer_types', 'condition_mask', 'mask_and', 'mask_or', 'mask_count', 'format_condition', 'group_mask_rows', 'group_mask_table']
+
+# Operators supported by filter conditions, longer ones must be matched first.
+#   =  !=          compare as string
+#   <  <=  >  >=   compare as number if the column is numeric, or as string
+#   ~              search the regular expression in the cell
+#   in {a,b,c}     the cell is one of the values
+# Columns are given as excel letters, indexes or names in the header.
+condition_pattern = re.compile(
+    r'^\s*([^\s=!<>~][^=!<>~]*?)\s*(?:(!=|<=|>=|=|<|>|~)(.*)|\s+in\s*\{(.*)\}\s*)$',
+    re.S
+)
+
+_compare = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+_ordering = ('<', '<=', '>', '>=')
+
+numeric_types = ('int', 'float')
+# Count of non-empty cells checked to infer the type of a column.
+infer_sample_size = 1000
+
+Condition = namedtuple('Condition', ['col', 'op', 'value'])
+
+
+def column_index(col, header=None):
+    """
+    Convert a column marking to the column index.
+
+    Names in the header are looked up first, so a column named `id` is not
+    taken as the excel column ID. Otherwise digits are treated as the index
+    directly, alphabets are converted with the same algorithm to excel column
+    display (A=0, B=1, AA=26).
+
+    Raise ValueError if `col` is neither a name in the header nor a marking.
+    """
+    if isinstance(col, int):
+        return col
+    col = col.strip()
+    if header and col in header:
+        return header.index(col)
+    if col.isdigit():
+        return int(col)
+    if not col.isalpha() or not col.isascii():
+        raise ValueError('`{}` is not a column of the header.'.format(col))
+    # Convert result begins with 1 (A=1, B=2),
+    # so decrease the result by 1.
+    return alph_to_num.convert(col.upper()) - 1
+
+
+def column_indexes(spec, header=None):
+    """
+    Resolve a column spec to a tuple of column indexes.
+
+    The spec is a list of column markings, or a string of them joined by
+    commas, and each one can be a range of columns like `A:F` or `price:qty`,
+    which includes both ends.
+
+    Usage::
+
+        >> column_indexes('A:C,price', header=['id', 'name', 'qty', 'price'])
+        (0, 1, 2, 3)
+    """
+    if isinstance(spec, string_types):
+        if header and spec.strip() in header:
+            return (header.index(spec.strip()), )
+        spec = spec.split(',')
+
+    indexes = []
+    for col in spec:
+        if isinstance(col, string_types) and ':' in col and not (header and col.strip() in header):
+            first, last = [column_index(c, header) for c in col.split(':', 1)]
+            step = 1 if last >= first else -1
+            indexes.extend(range(first, last + step, step))
+        else:
+            indexes.append(column_index(col, header))
+    return tuple(indexes)
+
+
+def parse_condition(s, header=None):
+    """
+    Parse a filter condition like "AA=Shanghai", "C>=10" or "N in {Jack,Mary}".
+
+    The column can be a name in the header, as `column_index()` resolves it.
+    Raise ValueError if `s` is not a valid filter condition.
+    """
+    m = condition_pattern.match(s)
+    if not m:
+        raise ValueError('`{}` is not a valid filter condition.'.format(s))
+    col, op, value, members = m.groups()
+    col = column_index(col, header)
+    if op is None:
+        return Condition(col, 'in', frozenset(v.strip() for v in members.split(',')))
+    if op == '~':
+        # Validate the pattern early.
+        re.compile(value)
+    return Condition(col, op, value)
+
+
+def is_equality(condition):
+    return condition.op == '='
+
+
+def is_ordering(condition):
+    return condition.op in _ordering
+
+
+def _to_number(s):
+    try:
+        return float(s)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def infer_type(cells):
+    """
+    Infer the type of a column as 'int', 'float' or 'str' from a sample of its cells.
+
+    The column is numeric if most of the non-empty cells are numbers, and
+    'float' if any of them is not an integer. A few cells like 'n/a' don't
+    turn it into text, they are compared cell by cell and never match.
+    """
+    ints, floats, others = 0, 0, 0
+    for cell in cells:
+        if not cell:
+            continue
+        try:
+            int(cell)
+            ints += 1
+        except ValueError:
+            try:
+                float(cell)
+                floats += 1
+            except ValueError:
+                others += 1
+        if ints + floats + others >= infer_sample_size:
+            break
+    if ints + floats <= others:
+        return 'str'
+    return 'float' if floats else 'int'
+
+
+def _to_mask(bools):
+    if np is not None:
+        return np.fromiter(bools, dtype=bool)
+    return list(bools)
+
+
+def mask_and(a, b):
+    if np is not None:
+        return a & b
+    return [x and y for x, y in zip(a, b)]
+
+
+def mask_count(mask):
+    if np is not None:
+        return int(np.count_nonzero(mask))
+    return sum(mask)
+
+
+def format_condition(condition):
+    """Format a condition back to the text form, with the column given as index."""
+    if condition.op == 'in':
+        return '%d in {%s}' % (condition.col, ','.join(sorted(condition.value)))
+    return '%d%s%s' % condition
+
+
+def mask_or(a, b):
+    if np is not None:
+        return a | b
+    return [x or y for x, y in zip(a, b)]
+
+
+def condition_mask(condition, cells, col_type='str'):
+    """
+    Check a condition against a column of cells, return a mask of booleans.
+
+    Ordering operators on numeric columns compare the cells as numbers, cells
+    which are not numbers never match. Cells are None for rows too short to
+    have the column, which never match.
+    The mask is a NumPy array if NumPy is available, otherwise a list.
+    """
+    op, value = condition.op, condition.value
+
+    if op in _ordering and col_type in numeric_types:
+        target = _to_number(value)
+        if target == target:
+            fn = _compare[op]
+            if np is not None:
+                numbers = np.fromiter((_to_number(c) for c in cells), dtype=float)
+                # Comparisons with NaN are always false.
+                return fn(numbers, target)
+            return _to_mask(fn(n, target) for n in map(_to_number, cells))
+
+    if op in _compare:
+        fn = _compare[op]
+        return _to_mask(c is not None and fn(c, value) for c in cells)
+    if op == 'in':
+        return _to_mask(c in value for c in cells)
+    if op == '~':
+        search = re.compile(value).search
+        return _to_mask(c is not None and search(c) is not None for c in cells)
+    raise ValueError('`{}` is not a supported operator.'.format(op))
+
+
+def _get_type(types, col, cells):
+    """Get the declared type of column, or infer it once and remember it."""
+    if col not in types:
+        types[col] = infer_type(cells)
+    return types[col]
+
+
+def infer_types(groups, rows, types):
+    """
+    Infer the types of the numeric compared columns of the filter groups
+    from a sample of rows, and save them in `types` if they are not declared.
+
+    So the types can be resolved once before rows are split into batches
+    checked separately, which would infer them from their own cells.
+    """
+    for group in groups:
+        for condition in group:
+            col = condition.col
+            if is_ordering(condition) and col not in types:
+                types[col] = infer_type(row[col] for row in rows if col < len(row))
+    return types
+
+
+def group_mask_rows(group, rows, types):
+    """
+    Check a group of conditions joined by `and` against a batch of rows.
+
+    `types` is a dict of {col_index: type}, types of numeric compared columns
+    are inferred from the batch and saved in it if they are not declared.
+    """
+    mask = None
+    columns = {}
+    for condition in group:
+        col = condition.col
+        if col not in columns:
+            columns[col] = [row[col] if col < len(row) else None for row in rows]
+        cells = columns[col]
+        col_type = 'str'
+        if condition.op in _ordering:
+            col_type = _get_type(types, col, cells)
+        m = condition_mask(condition, cells, col_type)
+        mask = m if mask is None else mask_and(mask, m)
+    return mask
+
+
+def group_mask_table(group, table, types):
+    """
+    Check a group of conditions joined by `and` against a `ColumnTable`.
+
+    Conditions are checked once for each distinct value of the column, and
+    then the matched codes are looked up in the code array of the column.
+    """
+    size = len(table)
+    mask = None
+    for condition in group:
+        col = condition.col
+        if col >= len(table.columns):
+            m = _to_mask(False for _ in range(size))
+        else:
+            values = table.values[col]
+            col_type = 'str'
+            if condition.op in _ordering:
+                col_type = _get_type(types, col, values[1:])
+            matched = [code for code, ok in enumerate(condition_mask(condition, values, col_type)) if ok]
+            codes = table.columns[col]
+            if np is not None:
+                m = np.isin(np.frombuffer(codes, dtype=codes.typecode), matched)
+                m &= np.frombuffer(table.widths, dtype=table.widths.typecode) > col
+            else:
+                matched = set(matched)
+                m = [c in matched and col < w for c, w in zip(codes, table.widths)]
+        mask = m if mask is None else mask_and(mask, m)
+    return mask
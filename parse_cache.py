@@ -0,0 +1,84 @@
+"""Sidecar cache of parsed csv files, saved in the pickle binary format."""
+import os
+import pickle
+
+__all__ = ['cache_path', 'cache_key', 'load', 'save', 'remove']
+
+# Increase it when the format of cached objects is changed.
+cache_version = 1
+cache_suffix = '.subcache'
+
+
+def cache_path(csv_file, kind='rows'):
+    """
+    Get the path of the sidecar cache file, next to the csv file.
+
+    Different kinds of parse results of the same file are cached separately.
+    """
+    return '%s.%s%s' % (csv_file, kind, cache_suffix)
+
+
+def cache_key(csv_file, encoding, **options):
+    """
+    Create the key identifying the parse result of a csv file.
+
+    The key consists of the absolute path, size and modified time of the file,
+    the encoding, and any other options affecting the parse result, so a cache
+    becomes stale as soon as the file is changed.
+    """
+    stat = os.stat(csv_file)
+    key = {
+        'version': cache_version,
+        'path': os.path.abspath(csv_file),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'encoding': encoding,
+    }
+    key.update(options)
+    return key
+
+
+def load(csv_file, key, kind='rows'):
+    """
+    Load the cached object of the csv file.
+
+    Return None if there is no cache or the cache is stale, a stale cache is
+    removed. Only load caches created by yourself, unpickling is not safe
+    against files from untrusted sources.
+    """
+    path = cache_path(csv_file, kind)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, 'rb') as f:
+            unpickler = pickle.Unpickler(f)
+            # The key is stored ahead, so a stale cache is not loaded entirely.
+            if unpickler.load() == key:
+                return unpickler.load()
+    except Exception:
+        pass
+
+    remove(csv_file, kind)
+    return None
+
+
+def save(csv_file, key, obj, kind='rows'):
+    """Save the object as the cache of the csv file, replacing the old one atomically."""
+    path = cache_path(csv_file, kind)
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as f:
+            pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+            pickler.dump(key)
+            pickler.dump(obj)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def remove(csv_file, kind='rows'):
+    path = cache_path(csv_file, kind)
+    if os.path.exists(path):
+        os.remove(path)
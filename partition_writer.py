@@ -0,0 +1,128 @@
+"""Write rows into many csv files with bounded open files and buffered rows."""
+import csv
+import io
+import os
+import re
+from collections import OrderedDict
+
+from compression import compression_extension, open_text
+
+__all__ = ['PartitionWriter', 'validate_filename']
+
+
+def validate_filename(name):
+    """Remove characters which are not allowed in file names, '/\\:*?"<>|'."""
+    name = re.sub(r'[\/\\\:\*\?\"\<\>\|\r\n\t]', '', name).strip()
+    return name or '_empty_'
+
+
+class PartitionWriter():
+    """
+    Write rows into one csv file for each partition key.
+
+    Rows are buffered for each key and flushed to its file when the buffer is
+    full or too many rows are buffered in total. At most `max_open_files` files
+    are opened at the same time, the least recently written one is closed when
+    another file is needed, and it is reopened for appending later. So it works
+    for thousands of keys as well.
+
+    If `compression` is given, files are compressed in it, and reopened files
+    get new compressed streams appended.
+
+    Usage::
+
+        >> with PartitionWriter('path/to/output', header=['name', 'sex']) as pw:
+        ..     pw.write('Jack', ['Jack', 'M'])
+        >> pw.counts
+        {'Jack': 1}
+    """
+
+    def __init__(self, output_dir, header=None, encoding='utf-8', max_open_files=64,
+                 buffer_rows=1000, max_buffered_rows=100000, compression=None,
+                 compress_level=None):
+        self.output_dir = output_dir
+        self.header = header
+        self.encoding = encoding
+        self.max_open_files = max_open_files
+        self.buffer_rows = buffer_rows
+        self.max_buffered_rows = max_buffered_rows
+        self.compression = compression
+        self.compress_level = compress_level
+
+        self.paths = {}  # in the format of {key: file_path}
+        self.counts = {}  # in the format of {key: count_of_rows}
+        self._buffers = {}
+        self._buffered = 0
+        self._files = OrderedDict()  # in the format of {key: (file, csv_writer)}
+
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def path_of(self, key):
+        """Get the file path of a key, file names are made unique among keys."""
+        if key not in self.paths:
+            name = validate_filename(key)
+            extension = '.csv' + compression_extension(self.compression)
+            used = set(self.paths.values())
+            path = os.path.join(self.output_dir, name + extension)
+            n = 1
+            while path in used:
+                n += 1
+                path = os.path.join(self.output_dir, '%s_%d%s' % (name, n, extension))
+            self.paths[key] = path
+            self.counts[key] = 0
+        return self.paths[key]
+
+    def __writer(self, key):
+        if key in self._files:
+            self._files.move_to_end(key)
+            return self._files[key][1]
+
+        while len(self._files) >= self.max_open_files:
+            _, (f, _) = self._files.popitem(last=False)
+            f.close()
+
+        path = self.path_of(key)
+        # Nothing is written to the file yet.
+        is_new = not self.counts[key]
+        f = open_text(path, 'w' if is_new else 'a', self.encoding, self.compression,
+                      self.compress_level, io.DEFAULT_BUFFER_SIZE)
+        cw = csv.writer(f)
+        if is_new and self.header:
+            cw.writerow(self.header)
+        self._files[key] = (f, cw)
+        return cw
+
+    def __flush(self, key):
+        rows = self._buffers.get(key)
+        if rows:
+            self.__writer(key).writerows(rows)
+            self.counts[key] += len(rows)
+            self._buffered -= len(rows)
+            self._buffers[key] = []
+
+    def write(self, key, row):
+        self.path_of(key)
+        buffer = self._buffers.setdefault(key, [])
+        buffer.append(row)
+        self._buffered += 1
+        if len(buffer) >= self.buffer_rows:
+            self.__flush(key)
+        elif self._buffered >= self.max_buffered_rows:
+            self.flush()
+
+    def flush(self):
+        for key in list(self._buffers):
+            self.__flush(key)
+
+    def close(self):
+        self.flush()
+        for f, _ in self._files.values():
+            f.close()
+        self._files.clear()
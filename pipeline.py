@@ -0,0 +1,180 @@
+"""Overlap reading, processing and writing of batches in background threads."""
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+__all__ = ['Pipeline', 'StageQueue']
+
+# Marks the end of batches in a queue.
+_end = object()
+# Seconds between checks of the stop event while blocked on a queue.
+_poll_interval = 0.1
+
+
+class _Stopped(Exception):
+    pass
+
+
+class StageQueue():
+    """
+    Bounded queue between two stages, recording the back-pressure of it.
+
+    A producer blocked by a full queue means the consumer is the bottleneck,
+    and a consumer blocked by an empty queue means the producer is.
+    """
+
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self.queue = queue.Queue(maxsize)
+        self.items = 0
+        self.put_blocked = 0
+        self.put_wait = 0.0
+        self.get_blocked = 0
+        self.get_wait = 0.0
+        self.max_depth = 0
+        self._depth_sum = 0
+
+    def put(self, item, stop):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.put_blocked += 1
+            start = time.perf_counter()
+            while True:
+                if stop.is_set():
+                    raise _Stopped()
+                try:
+                    self.queue.put(item, timeout=_poll_interval)
+                    break
+                except queue.Full:
+                    pass
+            self.put_wait += time.perf_counter() - start
+        depth = self.queue.qsize()
+        self.items += 1
+        self._depth_sum += depth
+        self.max_depth = max(self.max_depth, depth)
+
+    def get(self, stop):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            self.get_blocked += 1
+            start = time.perf_counter()
+            while True:
+                if stop.is_set():
+                    raise _Stopped()
+                try:
+                    item = self.queue.get(timeout=_poll_interval)
+                    break
+                except queue.Empty:
+                    pass
+            self.get_wait += time.perf_counter() - start
+            return item
+
+    def as_dict(self):
+        return OrderedDict([
+            ('maxsize', self.maxsize),
+            ('items', self.items),
+            ('put_blocked', self.put_blocked),
+            ('put_wait', round(self.put_wait, 6)),
+            ('get_blocked', self.get_blocked),
+            ('get_wait', round(self.get_wait, 6)),
+            ('max_depth', self.max_depth),
+            ('mean_depth', self.items and round(self._depth_sum / self.items, 2)),
+        ])
+
+
+class Pipeline():
+    """
+    Read items in a reader thread, transform them into batches in the calling
+    thread, and write the batches in a writer thread, with bounded queues of
+    `queue_size` items between the stages.
+
+    Reading, decompressing and writing files release the GIL, so they overlap
+    with the processing even on one core, as long as the reader thread does
+    little besides them. If any stage fails, the other stages are stopped and
+    the error is raised by `run()`.
+
+    Usage::
+
+        >> pipeline = Pipeline(queue_size=8)
+        >> pipeline.run(iter_blocks(f), lambda blocks: iter_batches(parse(blocks)), cw.writerows)
+        >> pipeline.read_queue.as_dict()
+    """
+
+    def __init__(self, queue_size=8):
+        self.read_queue = StageQueue('read', queue_size)
+        self.write_queue = StageQueue('write', queue_size)
+        self.queues = [self.read_queue, self.write_queue]
+        self._stop = threading.Event()
+        self._error = None
+
+    def __fail(self, ex):
+        if self._error is None:
+            self._error = ex
+        self._stop.set()
+
+    def __read(self, items):
+        try:
+            for item in items:
+                self.read_queue.put(item, self._stop)
+            self.read_queue.put(_end, self._stop)
+        except _Stopped:
+            pass
+        except BaseException as ex:
+            self.__fail(ex)
+        finally:
+            close = getattr(items, 'close', None)
+            if close is not None:
+                close()
+
+    def __iter_read_queue(self):
+        while True:
+            item = self.read_queue.get(self._stop)
+            if item is _end:
+                return
+            yield item
+
+    def __write(self, write):
+        try:
+            while True:
+                batch = self.write_queue.get(self._stop)
+                if batch is _end:
+                    return
+                write(batch)
+        except _Stopped:
+            pass
+        except BaseException as ex:
+            self.__fail(ex)
+
+    def run(self, items, transform, write):
+        """
+        Run the pipeline until all the batches are written.
+
+        `items` is an iterator consumed in the reader thread. `transform` is
+        called with an iterator of the items read, and returns an iterator of
+        batches to write, empty ones are skipped. `write(batch)` is called in
+        the writer thread in order.
+        """
+        reader = threading.Thread(target=self.__read, args=(items,))
+        writer = threading.Thread(target=self.__write, args=(write,))
+        reader.daemon = writer.daemon = True
+        reader.start()
+        writer.start()
+        try:
+            for batch in transform(self.__iter_read_queue()):
+                if batch:
+                    self.write_queue.put(batch, self._stop)
+            self.write_queue.put(_end, self._stop)
+        except _Stopped:
+            pass
+        except BaseException as ex:
+            self.__fail(ex)
+        finally:
+            reader.join()
+            writer.join()
+
+        if self._error is not None:
+            raise self._error
@@ -1,6 +1,8 @@
 """Utilities for calling eval() safely."""
 import random
 
+import safe_expression
+
 class SafeEval:
     def __init__(self, globals, safe_list):
         self.globals = globals
@@ -14,13 +16,15 @@ class SafeEval:
         def _get_safe_object(name):
             if globals.get(name, None):
                 return globals[name]
-            elif hasattr(builtins_module, name)
+            elif hasattr(builtins_module, name):
                 return getattr(builtins_module, name)
+            elif isinstance(builtins_module, dict) and name in builtins_module:
+                return builtins_module[name]
             else:
                 return None
 
-        return dict([(k, _get_safe_object(k)) for k in safe_list])
+        return dict([(k, v) for k, v in [(k, _get_safe_object(k)) for k in safe_list]
+                     if v is not None])
 
     def eval(self, expression):
-        # return eval(expression, {'__builtins__': {}}, self.get_safe_object())
-        return eval(expression)
\ No newline at end of file
+        return safe_expression.safe_eval(expression, self.get_safe_object())
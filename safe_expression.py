@@ -0,0 +1,136 @@
+"""Compile expressions of converters and filters, allowing safe names and syntax only."""
+import ast
+import random
+from functools import lru_cache
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+__all__ = ['safe_list', 'get_safe_names', 'validate', 'compile_expression', 'safe_eval']
+
+# Names allowed in expressions besides the arguments of lambdas.
+safe_list = ['random', 'abs', 'int', 'ss']
+
+# Count of compiled expressions kept in the cache.
+cache_size = 256
+
+# Objects which can be allowed by `safe_list` besides the builtins.
+_extra_objects = {
+    'random': random.random,
+}
+
+_allowed_nodes = tuple(getattr(ast, name) for name in [
+    'Expression', 'Lambda', 'arguments', 'arg', 'Name', 'Load', 'Attribute',
+    'Call', 'keyword', 'Subscript', 'Index', 'Slice',
+    'Constant', 'Num', 'Str', 'Bytes', 'NameConstant', 'JoinedStr', 'FormattedValue',
+    'Tuple', 'List', 'Dict', 'Set',
+    'BoolOp', 'And', 'Or', 'UnaryOp', 'Not', 'USub', 'UAdd', 'Invert',
+    'BinOp', 'Add', 'Sub', 'Mult', 'Div', 'FloorDiv', 'Mod', 'Pow',
+    'LShift', 'RShift', 'BitOr', 'BitXor', 'BitAnd',
+    'Compare', 'Eq', 'NotEq', 'Lt', 'LtE', 'Gt', 'GtE', 'In', 'NotIn', 'Is', 'IsNot',
+    'IfExp',
+] if hasattr(ast, name))
+
+# Attributes which reach other objects without underscore, like the fields of
+# format strings '{0.__class__}'.
+_denied_attributes = frozenset([
+    'format', 'format_map', 'mro', 'gi_frame', 'gi_code', 'cr_frame', 'f_globals',
+    'f_locals', 'f_back', 'f_builtins', 'tb_frame', 'func_globals', 'func_code',
+])
+
+_safe_names = None
+_safe_names_key = None
+
+
+def _is_safe_object(obj):
+    # Builtin functions and classes other than exceptions, as `eval` or `open`
+    # are builtin functions as well, only the names in `safe_list` are taken.
+    return callable(obj) and not (isinstance(obj, type) and issubclass(obj, BaseException))
+
+
+def get_safe_names():
+    """
+    Get the dict of objects allowed by `safe_list`, names not found are left out.
+
+    The dict is built at the first time it is needed, and built again after
+    `safe_list` is changed.
+    """
+    global _safe_names, _safe_names_key
+    key = tuple(safe_list)
+    if _safe_names_key != key:
+        names = {}
+        for name in safe_list:
+            obj = _extra_objects.get(name, getattr(builtins, name, None))
+            if obj is not None and _is_safe_object(obj):
+                names[name] = obj
+        _safe_names, _safe_names_key = names, key
+    return _safe_names
+
+
+def validate(tree, names):
+    """
+    Check the syntax tree of an expression against the whitelist.
+
+    Only literals, operators, comparisons, conditional expressions, lambdas,
+    calls, subscripts and attributes are allowed. Names should be arguments of
+    lambdas or in `names`, and attributes should not begin with underscore
+    or reach other objects.
+    Raise ValueError if anything else is found.
+    """
+    arguments = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Lambda):
+            arguments.update(a.arg if hasattr(a, 'arg') else a.id for a in node.args.args)
+
+    for node in ast.walk(tree):
+        if not isinstance(node, _allowed_nodes):
+            raise ValueError('`{}` is not allowed in expressions.'.format(type(node).__name__))
+        if isinstance(node, ast.Name) and node.id not in arguments and node.id not in names \
+                and node.id not in ('True', 'False', 'None'):
+            raise ValueError('Name `{}` is not allowed in expressions.'.format(node.id))
+        if isinstance(node, ast.Attribute) and (node.attr.startswith('_')
+                                                or node.attr in _denied_attributes):
+            raise ValueError('Attribute `{}` is not allowed in expressions.'.format(node.attr))
+
+
+@lru_cache(maxsize=cache_size)
+def _compile(source, names):
+    tree = ast.parse(source.strip(), mode='eval')
+    validate(tree, names)
+    return compile(tree, '<expression>', 'eval')
+
+
+def compile_expression(source, names=None):
+    """
+    Parse, validate and compile an expression into a code object.
+
+    Code objects are cached by the source and the allowed names, so the same
+    expression is compiled only once. Raise SyntaxError if the source can't be
+    parsed, and ValueError if it is not allowed.
+    """
+    if names is None:
+        names = get_safe_names()
+    return _compile(source, frozenset(names))
+
+
+def safe_eval(source, names=None):
+    """
+    Eval an expression without builtins, with the objects in `names` only.
+
+    `names` is a dict of allowed objects, the ones given by `get_safe_names()`
+    are used if it is None.
+
+    Usage::
+
+        >> fn = safe_eval('lambda s: abs(int(s))')
+        >> fn('-10')
+        10
+    """
+    if names is None:
+        names = get_safe_names()
+    code = compile_expression(source, names)
+    env = {'__builtins__': {}}
+    env.update(names)
+    return eval(code, env)
@@ -0,0 +1,207 @@
+"""Timing and throughput statistics of the stages of SubCsv."""
+import io
+import json
+import sys
+import time
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+__all__ = ['Stats', 'StageStats', 'peak_memory']
+
+
+def peak_memory():
+    """Get the peak resident memory of current process in bytes, None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on linux while in bytes on macOS.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StageStats():
+    """Statistics of a single stage, accumulated over all the batches."""
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.calls = 0
+        self.rows_in = 0
+        self.rows_out = 0
+        self.bytes = 0
+
+    def as_dict(self, seconds=None):
+        if seconds is None:
+            seconds = self.seconds
+        return OrderedDict([
+            ('seconds', round(seconds, 6)),
+            ('calls', self.calls),
+            ('rows_in', self.rows_in),
+            ('rows_out', self.rows_out),
+            ('bytes', self.bytes),
+            ('rows_per_second', seconds and round(max(self.rows_in, self.rows_out) / seconds, 1)),
+            ('bytes_per_second', seconds and round(self.bytes / seconds, 1)),
+        ])
+
+
+class _Timing():
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self.stage
+
+    def __exit__(self, *args):
+        stage = self.stage
+        stage.seconds += time.perf_counter() - self.start
+        stage.calls += 1
+
+
+class _NullTiming():
+    """Shared timing context used when stats are disabled, which records nothing."""
+
+    def __init__(self):
+        self.stage = StageStats('null')
+
+    def __enter__(self):
+        return self.stage
+
+    def __exit__(self, *args):
+        pass
+
+_null_timing = _NullTiming()
+
+
+class _TimedReader(io.RawIOBase):
+    """Raw file reader which records the time and bytes of reading into a stage."""
+
+    def __init__(self, raw, stage):
+        self.raw = raw
+        self.stage = stage
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        start = time.perf_counter()
+        n = self.raw.readinto(b)
+        self.stage.seconds += time.perf_counter() - start
+        self.stage.calls += 1
+        self.stage.bytes += n or 0
+        return n
+
+    def close(self):
+        self.raw.close()
+        super(_TimedReader, self).close()
+
+
+class Stats():
+    """
+    Statistics of reading, parsing, filtering, converting and writing.
+
+    Each stage records wall time, rows in and out and bytes. Hits of each
+    filter group and calls and time of each converter are recorded as well,
+    so are the waits of queues between stages in pipelined mode. The peak
+    memory is of the whole process, it is given once by `as_dict()`, along
+    with the largest one of worker processes in parallel mode.
+
+    Stages are timed batch by batch. When stats are disabled, `timing()` gives
+    a shared context doing nothing, so the cost is a method call per batch.
+
+    The `parse` stage is timed around reading rows from the csv reader, the
+    time of the `read` stage spent in it is excluded in `as_dict()`, unless
+    it is read in another thread or before parsing (`read_in_parse`).
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = OrderedDict()  # in the format of {name: StageStats}
+        self.group_hits = OrderedDict()  # in the format of {group: hits}
+        self.converters = OrderedDict()  # in the format of {col_index: {'calls': n, 'seconds': s}}
+        self.queues = OrderedDict()  # in the format of {name: queue_stats_dict}
+        # Whether the `read` stage is timed within the `parse` stage.
+        self.read_in_parse = True
+        # Peak memory of the process, set before stats are sent to another
+        # process, otherwise measured by `as_dict()`.
+        self.peak_memory = None
+        self.worker_peak_memory = None
+
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = StageStats(name)
+        return self.stages[name]
+
+    def timing(self, name):
+        """Get a context to time a stage, the stage statistics is given by `with` statement."""
+        if not self.enabled:
+            return _null_timing
+        return _Timing(self.stage(name))
+
+    def open_csv(self, raw, encoding, buffer_size=io.DEFAULT_BUFFER_SIZE):
+        """
+        Open a csv file to read from a raw binary file, with the time and bytes
+        of reading recorded to stage `read`. For a compressed file, that is the
+        time of decompressing and the decompressed bytes.
+        """
+        raw = _TimedReader(raw, self.stage('read'))
+        return io.TextIOWrapper(io.BufferedReader(raw, buffer_size), encoding=encoding, newline='')
+
+    def add_group_hits(self, group, hits):
+        self.group_hits[group] = self.group_hits.get(group, 0) + hits
+
+    def add_converter_call(self, col, calls, seconds):
+        converter = self.converters.setdefault(col, {'calls': 0, 'seconds': 0.0})
+        converter['calls'] += calls
+        converter['seconds'] += seconds
+
+    def merge(self, other):
+        """
+        Add up the statistics recorded by another instance, like the ones of
+        worker processes. Times of stages are summed over the instances, and
+        the peak memory of workers is the largest one.
+        """
+        for name, other_stage in other.stages.items():
+            stage = self.stage(name)
+            stage.seconds += other_stage.seconds
+            stage.calls += other_stage.calls
+            stage.rows_in += other_stage.rows_in
+            stage.rows_out += other_stage.rows_out
+            stage.bytes += other_stage.bytes
+        for group, hits in other.group_hits.items():
+            self.add_group_hits(group, hits)
+        for col, converter in other.converters.items():
+            self.add_converter_call(col, converter['calls'], converter['seconds'])
+        if not other.read_in_parse:
+            self.read_in_parse = False
+        for peak in (other.peak_memory, other.worker_peak_memory):
+            if peak is not None:
+                self.worker_peak_memory = max(self.worker_peak_memory or 0, peak)
+
+    def add_queue(self, name, queue_stats):
+        """Record the back-pressure statistics of a queue between stages."""
+        self.queues[name] = queue_stats
+
+    def as_dict(self):
+        stages = OrderedDict((name, stage.as_dict()) for name, stage in self.stages.items())
+        # Reading is done in another thread in pipelined mode.
+        if 'parse' in stages and 'read' in stages and 'read' not in self.queues and self.read_in_parse:
+            parse, read = self.stages['parse'], self.stages['read']
+            stages['parse'] = parse.as_dict(max(parse.seconds - read.seconds, 0.0))
+        return OrderedDict([
+            ('stages', stages),
+            ('groups', [OrderedDict([('group', g), ('hits', h)]) for g, h in self.group_hits.items()]),
+            ('converters', OrderedDict(
+                (str(col), OrderedDict([('calls', c['calls']), ('seconds', round(c['seconds'], 6))]))
+                for col, c in self.converters.items()
+            )),
+            ('queues', self.queues),
+            ('peak_memory', peak_memory() if self.peak_memory is None else self.peak_memory),
+            ('worker_peak_memory', self.worker_peak_memory),
+        ])
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.as_dict(), **kwargs)
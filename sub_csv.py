@@ -3,21 +3,37 @@ import sys
 import os
 import datetime
 import codecs
-
-from functools import reduce
+import time
+import io
+import mmap
+import multiprocessing
+import re
+
+from itertools import islice
+from operator import itemgetter
 import inspect
-from random import random
 
 from six import string_types, integer_types
 
-import alph_to_num
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import checkpoint
+import filter_engine
+import parse_cache
+from column_table import ColumnTable
+from compression import compression_extension, compression_of_name, detect_compression, open_binary, open_text
+from partition_writer import PartitionWriter
+from pipeline import Pipeline
+from safe_expression import safe_eval, safe_list
+from stats import Stats, peak_memory
 
 DEBUG = False
 
 default_encoding = 'utf-8_sig'
-safe_list = ['random', 'abs', 'int', 'ss']
 
-filter_operator = '='
 convert_operator = '::'
 
 
@@ -26,42 +42,84 @@ def debug_info(value):
         print(value)
 
 
-def get_safe_object():
-    all_builtin = {
-        name: obj for name, obj in inspect.getmembers(__builtins__)
-                  if inspect.isbuiltin(obj) or (inspect.isclass(obj) and not issubclass(obj, Exception))
-    }
+def batch_converter(fn):
+    """
+    Mark a convert function as a batch converter.
 
-    all_global = {
-        name: obj for name, obj in globals().items()
-                  if inspect.isbuiltin(obj) or (inspect.isclass(obj) and not issubclass(obj, Exception))
-    }
+    A batch converter is called with a list of cells of one column and should
+    return a list of new cells in the same order, instead of being called once
+    for each cell.
+    """
+    fn.batch = True
+    return fn
 
-    def _get_safe_object(name):
-        try:
-            if name in all_global:
-                debug_info('get `{}` from global.'.format(name))
-                return all_global[name]
-            elif name in all_builtin:
-                debug_info('get `{}` from builtin.'.format(name))
-                return all_builtin[name]
-            else:
-                debug_info("can't find allowed object for `{}`.".format(name))
-                return None
-        except Exception as ex:
-            debug_info(ex)
+
+# Integers computed by NumPy within this bound can't have wrapped around.
+_int64_safe = 1 << 62
+
+
+def _apply_array(fn, numbers, integral):
+    """
+    Call `fn` once with an array of the numbers, return the list of results.
+
+    NumPy integers wrap around silently on overflow, so None is returned if
+    integral inputs or results are out of the safe range of int64, they
+    should be computed number by number instead.
+    """
+    array = np.array(numbers)
+    values = np.broadcast_to(fn(array), len(numbers))
+    if integral and array.dtype != object:
+        if array.dtype.kind != 'i':
+            # Integers beyond int64 are kept as uint64.
             return None
+        if values.dtype.kind in 'iu':
+            # Compare the magnitude computed in floats, which never wrap.
+            with np.errstate(all='ignore'):
+                check = np.abs(np.broadcast_to(fn(array.astype(float)), len(numbers)))
+            if not (check < _int64_safe).all():
+                return None
+    return values.tolist()
 
-    return dict([(k, _get_safe_object(k)) for k in safe_list])
 
-safe_objects = get_safe_object()
+def digit_converter(fn):
+    """
+    Wrap a function of numbers into a batch converter of a column of strings.
+
+    Cells of the column are parsed to numbers once, as integers if all of them
+    are integers, otherwise as floats. If NumPy is available `fn` is called
+    once with an array of all the numbers, so arithmetic is vectorized,
+    otherwise, or if `fn` does not support arrays, or integers may overflow
+    int64, it is called for each number. Cells which are not numbers are kept
+    unchanged.
+    """
+    @batch_converter
+    def convert_column(cells):
+        try:
+            numbers = [int(c) for c in cells]
+            valid = None
+        except ValueError:
+            numbers = []
+            for c in cells:
+                try:
+                    numbers.append(float(c))
+                except ValueError:
+                    numbers.append(float('nan'))
+            valid = [n == n for n in numbers]
+
+        values = None
+        if np is not None:
+            try:
+                values = _apply_array(fn, numbers, valid is None)
+            except (TypeError, ValueError, OverflowError):
+                values = None
+        if values is None:
+            values = [fn(n) if valid is None or valid[i] else None for i, n in enumerate(numbers)]
 
+        if valid is None:
+            return [str(v) for v in values]
+        return [str(v) if ok else c for c, v, ok in zip(cells, values, valid)]
 
-def safe_eval(expression):
-    """Eval an expression safely under specified restriction."""
-    no_builtin_dict = {'__builtins__': {}}
-    no_builtin_dict.update(safe_objects)
-    return eval(expression, no_builtin_dict)
+    return convert_column
 
 
 # TODO: add features to support more patterns.
@@ -74,9 +132,10 @@ def get_lambda_string(lambda_content):
 
            s is treated as string. 
 
-        2) d: d + 100       -->     lambda d: ast.literal(d) + 100
+        2) d: d + 100       -->     lambda d: d + 100
 
-           d is treated as a digit.
+           d is treated as a digit, the lambda will be wrapped by
+           `digit_converter()` to convert a whole column at once.
         
         2) random()         -->     lambda s: random()
 
@@ -90,7 +149,6 @@ def get_lambda_string(lambda_content):
         return 'lambda {}'.format(lambda_content)
 
     if lambda_content.startswith('d:'):
-        # TODO: add support for digit.
         return 'lambda {}'.format(lambda_content)
 
     splited = lambda_content.split(':')
@@ -100,6 +158,200 @@ def get_lambda_string(lambda_content):
     return 'lambda x: {}'.format(lambda_content)
 
 
+def iter_batches(rows, size):
+    """Iterate lists of at most `size` rows."""
+    rows = iter(rows)
+    batch = list(islice(rows, size))
+    while batch:
+        yield batch
+        batch = list(islice(rows, size))
+
+
+def keep_columns(rows, columns):
+    """
+    Replace cells out of `columns` with '' and cut rows after the last of them.
+
+    The shared empty string takes no memory, while the indexes of the kept
+    columns stay valid. Short rows keep their length.
+    """
+    columns = sorted(columns)
+    width = columns[-1] + 1 if columns else 0
+    template = [''] * width
+    for row in rows:
+        if len(row) < width:
+            kept = template[:len(row)]
+            for i in columns:
+                if i < len(row):
+                    kept[i] = row[i]
+        else:
+            kept = template[:]
+            for i in columns:
+                kept[i] = row[i]
+        yield kept
+
+
+class QuoteParityError(ValueError):
+    """
+    Rows of the csv file can't be located by the parity of quote characters.
+
+    It happens when a field has quote characters but is not quoted, like
+    `5" screen`, which `csv.reader` accepts as it is.
+    """
+
+
+# A line appended to csv text to see where `csv.reader` stops, no row of csv
+# text ending a row can be parsed as it.
+_end_mark = '\x1fend of text\x1f'
+
+
+def iter_checked_rows(text, ends):
+    """
+    Iterate rows parsed from csv text, then append to the list `ends` whether
+    the text ends a row as `csv.reader` parses it, not inside a quoted field.
+
+    Text cut by the parity of quote characters ends inside a quoted field if
+    any of its unquoted fields has quote characters.
+    """
+    if text and not text.endswith('\n'):
+        text += '\n'
+    last = None
+    for row in csv.reader(io.StringIO(text + _end_mark, newline='')):
+        if last is not None:
+            yield last
+        last = row
+    ends.append(last == [_end_mark])
+
+
+def find_row_boundaries(csv_file, offsets, block_size=1 << 20):
+    """
+    Find the first row beginning after each of the byte offsets in the csv file.
+
+    `offsets` should be sorted. A row begins right after a line break which is
+    out of any quoted field, so a quoted field containing line breaks will never
+    be cut. Quote characters are counted from the beginning of the file, which
+    works for fields quoted in the excel dialect ("" as an escaped quote).
+    Quote characters in unquoted fields break the count, rows parsed from a
+    boundary should be checked by `iter_checked_rows()`.
+
+    The size of file is given for offsets with no row beginning after them.
+    """
+    offsets = list(offsets)
+    boundaries = []
+    with open(csv_file, 'rb') as f:
+        pos, quoted = 0, 0
+        while offsets:
+            block = f.read(block_size)
+            if not block:
+                break
+            i = 0
+            while offsets:
+                j = max(offsets[0] - pos, i)
+                if j >= len(block):
+                    break
+                nl = block.find(b'\n', j)
+                if nl == -1:
+                    break
+                quoted ^= block.count(b'"', i, nl) & 1
+                i = nl + 1
+                if not quoted:
+                    boundary = pos + i
+                    while offsets and offsets[0] < boundary:
+                        offsets.pop(0)
+                        boundaries.append(boundary)
+            quoted ^= block.count(b'"', i) & 1
+            pos += len(block)
+    return boundaries + [os.path.getsize(csv_file)] * len(offsets)
+
+
+def last_row_end(buf):
+    """
+    Get the offset right after the last line break out of quoted fields in buf.
+
+    buf should begin at a row. Return 0 if there is no complete row in it.
+    Quote characters are counted as `find_row_boundaries()` does.
+    """
+    if b'"' not in buf:
+        return buf.rfind(b'\n') + 1
+
+    end, quoted, i = 0, 0, 0
+    while True:
+        nl = buf.find(b'\n', i)
+        if nl == -1:
+            return end
+        quoted ^= buf.count(b'"', i, nl) & 1
+        i = nl + 1
+        if not quoted:
+            end = i
+
+
+def iter_row_blocks(csv_file, start=0, block_size=1 << 20):
+    """
+    Iterate blocks of complete rows of the csv file from byte offset `start`.
+
+    `start` should be at the beginning of a row. Each block ends with a line
+    break out of any quoted field and is given as (end_offset, bytes). Bytes
+    after the last such line break belong to a row not completely written
+    yet, they are left for later.
+    """
+    with open(csv_file, 'rb') as f:
+        f.seek(start)
+        pos = start
+        pending = b''
+        while True:
+            block = f.read(block_size)
+            if not block:
+                return
+            pending += block
+            end = last_row_end(pending)
+            if end:
+                pos += end
+                yield pos, pending[:end]
+                pending = pending[end:]
+
+
+def count_quotes(buf, start, end, block_size=1 << 24):
+    """Count the quote characters of buf[start:end] without copying it at once."""
+    count = 0
+    for i in range(start, end, block_size):
+        count += buf[i:min(i + block_size, end)].count(b'"')
+    return count
+
+
+def _process_chunk(args):
+    """
+    Parse, filter and convert a byte range of the csv file in a worker process.
+
+    Return the count of rows, the csv text of them, the `Stats` of the work
+    and whether the range ends a row as `csv.reader` parses it.
+    """
+    csv_file, encoding, start, end, filter_groups, column_types, convert_sources, projection, stats = args
+    sc = SubCsv(csv_file, ensure_header=False, encoding=encoding, stats=stats)
+    # The range is read before it is parsed.
+    sc.stats.read_in_parse = False
+    with sc.stats.timing('read') as st:
+        with open(csv_file, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+        st.bytes += len(data)
+    text = data.decode(encoding)
+
+    sc._filter_groups = list(filter_groups)
+    sc.column_types = dict(column_types)
+    sc.convert_all(convert_sources)
+    sc._projection = projection
+
+    output = io.StringIO()
+    cw = csv.writer(output)
+    count = 0
+    ends = []
+    for row in sc.process_rows(iter_checked_rows(text, ends)):
+        cw.writerow(row)
+        count += 1
+    if stats:
+        sc.stats.peak_memory = peak_memory()
+    return count, output.getvalue(), sc.stats, ends[0]
+
+
 class SubCsv():
     """
     Create sub csv by filter or convert the content of original csv file.
@@ -115,11 +367,73 @@ class SubCsv():
     # content of column A will be set to '76KG'
     > python sub_csv.py path/to/your/original/file.csv N=Jack AA=72KG A::x:'76KG'
     2 filter result saved. path/to/your/original/2016-06-28 10-30-41.csv
+
+    # parse, filter and convert the file with 8 worker processes
+    > python sub_csv.py path/to/your/original/file.csv N=Jack --workers=8
+    39 filter result saved. path/to/your/original/2016-06-28 10-30-41.csv
+
+    # search the raw bytes for `Jack` and only parse rows containing it
+    > python sub_csv.py path/to/your/original/file.csv N=Jack --mmap
+    39 filter result saved. path/to/your/original/2016-06-28 10-30-41.csv
+
+    # filter with other operators, W is compared as float numbers
+    > python sub_csv.py path/to/your/original/file.csv "N in {Jack,Mary}" "W>=60" --type=W:float
+    12 filter result saved. path/to/your/original/2016-06-28 10-30-41.csv
+
+    # load the whole file into memory as a compact columnar table
+    > python sub_csv.py path/to/your/original/file.csv N=Jack --columnar
+    39 filter result saved. path/to/your/original/2016-06-28 10-30-41.csv
+
+    # save the parsed file to a sidecar cache, later runs load it without parsing
+    > python sub_csv.py path/to/your/original/file.csv N=Jack --cache
+    39 filter result saved. path/to/your/original/2016-06-28 10-30-41.csv
+
+    # write one file for each value of column S in one pass
+    > python sub_csv.py path/to/your/original/file.csv --partition=S
+    20 filter result saved. path/to/your/original/2016-06-28 10-30-41/F.csv
+    19 filter result saved. path/to/your/original/2016-06-28 10-30-41/M.csv
+
+    # print time, rows and bytes of each stage as json
+    > python sub_csv.py path/to/your/original/file.csv N=Jack --stats
+
+    # process rows appended since the last run, and append the results to the output file
+    > python sub_csv.py path/to/your/original/file.csv N=Jack --incremental=path/to/output.csv
+    3 filter result saved. path/to/output.csv
+
+    # keep processing rows as they are appended, checking every 5 seconds
+    > python sub_csv.py path/to/your/original/file.csv N=Jack --incremental=path/to/output.csv --follow --interval=5
+
+    # read a compressed file, the output file is compressed at level 1 in the same way
+    > python sub_csv.py path/to/your/original/file.csv.gz N=Jack --compress-level=1
+    39 filter result saved. path/to/your/original/2016-06-28 10-30-41.csv.gz
+
+    # filter by names in the header, and write the selected columns only
+    > python sub_csv.py path/to/your/original/file.csv name=Jack --ensure-header --select=name,price:qty
+    39 filter result saved. path/to/your/original/2016-06-28 10-30-41.csv
+
+    # read, process and write in overlapped threads, with queue stats printed
+    > python sub_csv.py path/to/your/original/file.csv N=Jack --pipeline --stats
+    39 filter result saved. path/to/your/original/2016-06-28 10-30-41.csv
+
+    # load the whole file into memory instead of streaming through it
+    > python sub_csv.py path/to/your/original/file.csv N=Jack --no-stream
+    39 filter result saved. path/to/your/original/2016-06-28 10-30-41.csv
     """
     encoding = default_encoding
     converter_repo = {}
-
-    def __init__(self, csv_file, ensure_header=True, encoding=None):
+    converter_sources = {}  # function or string content of the registered converters
+    # Count of rows written at a time in streaming mode.
+    batch_size = 1000
+    # Size in bytes of the ranges processed by worker processes in parallel mode.
+    chunk_size = 16 << 20
+    # Size in bytes of the buffers of reading and writing files.
+    buffer_size = 1 << 20
+    # Count of batches waiting between two stages in pipelined mode.
+    queue_size = 8
+
+    def __init__(self, csv_file, ensure_header=True, encoding=None, streaming=False, workers=1,
+                 use_mmap=False, columnar=False, use_cache=False, stats=False,
+                 compress_level=None, buffer_size=None, pipelined=False):
         """
         Constructor for SubCsv, with sensible defaults.
 
@@ -127,47 +441,448 @@ class SubCsv():
 
         If ensure_header is true, first line of csv content will be treated as
         the header columns, it will be stacked and exported to sub csv file.
+
+        If streaming is true, the csv file will never be loaded as a whole,
+        rows are read, filtered, converted and written one batch at a time
+        when `write_all()` is called, so memory usage will not grow with the
+        size of the file.
+
+        If workers is greater than 1, the csv file will be split into byte ranges
+        on row boundaries, which are parsed, filtered and converted by a pool of
+        worker processes, and the results are written back in the original order.
+        Only encodings compatible with ascii are supported in this mode, and
+        converter functions must be picklable (defined at module level).
+        Boundaries are found by the parity of quote characters, if any field
+        has quote characters but is not quoted, like `5" screen`, it is found
+        out while the ranges are parsed, and the file is streamed instead.
+
+        If use_mmap is true, streaming mode reads the csv file through mmap, and
+        when all filter conditions are equality tests, the raw bytes are searched
+        for the filter values first, only rows containing them are parsed.
+
+        If columnar is true, the matrix is loaded as a `ColumnTable`, which
+        keeps each distinct value of a column only once and the cells as integer
+        codes, so filters compare codes and rows are decoded only when written.
+
+        If use_cache is true, the parsed header and matrix are saved to a sidecar
+        file next to the csv file after it is loaded at the first time, and loaded
+        from it by later runs without parsing the csv file again. The cache is
+        keyed by path, size, modified time and encoding of the file, and
+        rebuilt automatically once it is stale.
+
+        If stats is true, time, rows and bytes of each stage, hits of each
+        filter group and time of each converter are recorded in the `Stats`
+        object `self.stats`, besides the peak memory of the process. In
+        parallel mode, the statistics of worker processes are added up, besides
+        the time waiting for them in `process`. Group hits are counted apart
+        from filtering, so rows are filtered in the same way with stats.
+
+        Csv files compressed in gzip, bz2 or xz are detected by the extension
+        or the magic bytes, and decompressed while they are read. Parallel and
+        mmap modes need the raw bytes, so they fall back to streaming for them.
+        Output files are compressed by their extension, `.gz`, `.bz2` or `.xz`,
+        at `compress_level`, and the default output file takes the compression
+        of the csv file. Files are read and written through buffers of
+        `buffer_size` bytes.
+
+        If pipelined is true, streaming mode reads and decompresses blocks of
+        text in a reader thread, parses, filters and converts rows in the
+        current thread, and writes them in a writer thread, so reading and
+        writing files overlap with the processing. It pays off with slow disks
+        or compressed files, while the overhead of threads is more than the
+        gain for plain files in the page cache. Stages are connected by queues
+        of at most `queue_size` items, the back-pressure of them is recorded
+        in stats. Not used with use_mmap.
         """
         self.csv_file = csv_file
         self.ensure_header = ensure_header
+        self.streaming = streaming
+        self.workers = workers
+        self.use_mmap = use_mmap
+        self.columnar = columnar
+        self.use_cache = use_cache
+        self.stats = Stats(enabled=stats)
+        self.compression = detect_compression(csv_file)
+        self.compress_level = compress_level
+        self.pipelined = pipelined
         if encoding:
             self.encoding = encoding
+        if buffer_size:
+            self.buffer_size = buffer_size
 
         self._header = None
         self._matrix = None
-        # If `_sub_matrices` is None, whole original matrix will be exported to sub
-        # csv file.
-        # It will be initialized to an empty list in method `self.sub()`, and then
-        # the filter result matrix will be exported to sub csv file.
-        self._sub_matrices = None
+        self._indexes = {}  # in the format of {col_index: {value: [row_positions]}}
+        # If `_filter_groups` is empty, whole original matrix will be exported
+        # to sub csv file.
+        # Each calling of method `self.sub()` stacks a group of (col_index, value)
+        # conditions, and all the groups are compiled into `_predicate` once.
+        self._filter_groups = []
+        self._predicate = None
+        # Types of columns compared by numeric operators, in the format of
+        # {col_index: 'int' | 'float' | 'str'}, inferred when not declared.
+        self.column_types = {}
+        self._declared_types = {}
 
         self.convert_strategy = {}  # in the format of {col_index: convert_function}
+        # Converters as they are given, sent to worker processes in parallel mode.
+        self._convert_sources = {}
+
+        # Tuple of column indexes written to sub csv file, all if it is None.
+        self._projection = None
+        # Columns kept in the loaded matrix, cells of other columns are dropped.
+        self._kept_columns = None
 
     def get_matrix(self):
         """
         Create the matrix object from the csv file.
 
         If the matrix is already created it will be return directly.
+
+        In columnar mode a `ColumnTable` is created instead of a list of rows.
+        If use_cache is true, the matrix is loaded from the sidecar cache when
+        it is not stale, or saved to it after parsing the csv file. Errors of
+        reading or writing the cache file are ignored.
         """
         if not self._matrix:
-            try:
-                with open(self.csv_file, 'r', encoding=self.encoding) as f:
-                    self._matrix = [line for line in csv.reader(f)]
-
-                if self.ensure_header:
-                    self._header = self._matrix and self._matrix[0] or []
-                    self._matrix = self._matrix[1:]
-            except Exception as ex:
-                raise ex
+            kept = self.get_used_columns()
+            cached = None
+            if self.use_cache:
+                key = self.__cache_key(kept)
+                try:
+                    cached = parse_cache.load(self.csv_file, key, self.__cache_kind())
+                except OSError as ex:
+                    debug_info('can not load the cache: {}'.format(ex))
+
+            if cached is not None:
+                self._header, matrix = cached
+                self.set_matrix(matrix)
+                self._kept_columns = kept
+            else:
+                self.__parse_matrix(kept)
+                if self.use_cache:
+                    # The cache is optional, carry on without it if it can't be written.
+                    try:
+                        parse_cache.save(self.csv_file, key, (self._header, self._matrix),
+                                         self.__cache_kind())
+                    except OSError as ex:
+                        debug_info('can not save the cache: {}'.format(ex))
         return self._matrix
 
+    def __parse_matrix(self, kept=None):
+        try:
+            if self.columnar:
+                rows = self.iter_rows()
+                if kept is not None:
+                    rows = keep_columns(rows, kept)
+                self.set_matrix(ColumnTable(rows))
+            else:
+                with self.__open_csv() as f:
+                    rows = csv.reader(f)
+                    if self.ensure_header:
+                        self._header = next(rows, [])
+                    if kept is not None:
+                        rows = keep_columns(rows, kept)
+                    matrix = [line for line in rows]
+                self.set_matrix(matrix)
+            self._kept_columns = kept
+        except Exception as ex:
+            raise ex
+
+    def __open_csv(self):
+        if self.stats.enabled:
+            raw = open_binary(self.csv_file, 'rb', self.compression)
+            return self.stats.open_csv(raw, self.encoding, self.buffer_size)
+        return open_text(self.csv_file, 'r', self.encoding, self.compression,
+                         buffer_size=self.buffer_size)
+
+    def __open_output(self, csv_file):
+        return open_text(csv_file, 'w', self.encoding, compression_of_name(csv_file),
+                         self.compress_level, self.buffer_size)
+
+    def __cache_kind(self):
+        return self.columnar and 'columnar' or 'rows'
+
+    def __cache_key(self, kept=None):
+        return parse_cache.cache_key(self.csv_file, self.encoding, ensure_header=self.ensure_header,
+                                     columns=kept)
+
+    def set_matrix(self, matrix):
+        """Replace the matrix object, cached column indexes are dropped."""
+        self._matrix = matrix
+        self._indexes = {}
+
+    def share_matrix(self, other):
+        """
+        Use the header, matrix and column indexes loaded by another instance.
+
+        Nothing is copied, indexes built by either instance are shared too.
+        """
+        self._matrix = other.get_matrix()
+        self._header = other._header
+        self._indexes = other._indexes
+        self._kept_columns = other._kept_columns
+
+    def get_header(self):
+        """
+        Get the header, which is read from the csv file if it is not loaded yet.
+
+        Return None if ensure_header is false.
+        """
+        if self._header is None and self.ensure_header:
+            with open_text(self.csv_file, 'r', self.encoding, self.compression,
+                           buffer_size=io.DEFAULT_BUFFER_SIZE) as f:
+                self._header = next(csv.reader(f), [])
+        return self._header
+
+    def select(self, columns):
+        """
+        Write only the given columns of rows, in the given order.
+
+        `columns` is a spec like 'A:F', 'price,qty' or 'A,C:E,total', or a
+        list of column markings, names in the header are supported as in
+        `sub()`. It is resolved to column indexes at once. Missing cells of
+        short rows are written as ''.
+
+        If it is called before the matrix is loaded, cells of columns never
+        filtered, converted or written are not kept in the matrix.
+
+        Usage::
+
+            >> sc = SubCsv('path/to/file.csv')
+            >> sc.select('name,price:qty')
+            >> sc.write_all('path/to/output/file.csv')
+        """
+        projection = filter_engine.column_indexes(columns, self.get_header())
+        self.__check_kept(projection)
+        self._projection = projection
+        return projection
+
+    def get_used_columns(self):
+        """
+        Get the sorted tuple of columns filtered, converted or written.
+
+        Return None if no projection is selected, since all columns are written.
+        """
+        if self._projection is None:
+            return None
+        columns = set(self._projection) | set(self.convert_strategy)
+        columns.update(c.col for group in self._filter_groups for c in group)
+        return tuple(sorted(columns))
+
+    def __check_kept(self, columns):
+        if self._kept_columns is not None:
+            dropped = sorted(set(columns) - set(self._kept_columns))
+            if dropped:
+                raise ValueError('Columns {} are dropped from the loaded matrix, '
+                                 'use them before it is loaded.'.format(dropped))
+
+    def project_batch(self, rows):
+        """Pick the selected columns of a list of rows, or return them as they are."""
+        projection = self._projection
+        if projection is None:
+            return rows
+        width = max(projection) + 1 if projection else 0
+        if len(projection) == 1:
+            i = projection[0]
+            return [[row[i] if i < len(row) else ''] for row in rows]
+
+        getter = itemgetter(*projection)
+        try:
+            return [getter(row) for row in rows]
+        except IndexError:
+            return [getter(row) if len(row) >= width else getter(row + [''] * (width - len(row)))
+                    for row in rows]
+
+    def get_output_header(self):
+        """Get the header to write, with the selected columns only."""
+        header = self._header
+        if header and self._projection is not None:
+            return [header[i] if i < len(header) else '' for i in self._projection]
+        return header
+
+    def get_index(self, col):
+        """
+        Get the index of column `col` in the format of {value: [row_positions]}.
+
+        The index is built at the first time the column is filtered and cached
+        until the matrix is changed.
+        """
+        index = self._indexes.get(col)
+        if index is None:
+            matrix = self.get_matrix()
+            if isinstance(matrix, ColumnTable):
+                # Group by codes without decoding the cells.
+                index = matrix.index(col)
+            else:
+                index = {}
+                for pos, row in enumerate(matrix):
+                    if col < len(row):
+                        index.setdefault(row[col], []).append(pos)
+            self._indexes[col] = index
+        return index
+
+    def iter_text_blocks(self):
+        """Iterate blocks of about `buffer_size` characters of the csv file, each ends a line."""
+        with self.__open_csv() as f:
+            while True:
+                block = f.read(self.buffer_size)
+                if not block:
+                    return
+                yield block + f.readline()
+
+    def iter_rows_of_blocks(self, blocks):
+        """
+        Iterate rows parsed from blocks of text given by `iter_text_blocks()`.
+
+        If ensure_header is true, the first line is consumed and kept as header.
+        """
+        lines = (line for block in blocks for line in io.StringIO(block, newline=''))
+        reader = csv.reader(lines)
+        if self.ensure_header:
+            self._header = next(reader, [])
+        for row in reader:
+            yield row
+
+    def iter_rows(self):
+        """
+        Iterate rows of the csv file without creating the matrix object.
+
+        If ensure_header is true, the first line is consumed and kept as header.
+        """
+        with self.__open_csv() as f:
+            reader = csv.reader(f)
+            if self.ensure_header:
+                self._header = next(reader, [])
+            for row in reader:
+                yield row
+
+    def read_raw_header(self):
+        """
+        Read the header from raw bytes of the csv file if ensure_header is true.
+
+        Return the byte offset where the data rows begin. Raise
+        `QuoteParityError` if it is not found by the parity of quote characters.
+        """
+        if not self.ensure_header:
+            return 0
+        start = find_row_boundaries(self.csv_file, [0])[0]
+        with open(self.csv_file, 'rb') as f:
+            header = f.read(start).decode(self.encoding)
+        ends = []
+        rows = list(iter_checked_rows(header, ends))
+        self._header = rows[0] if rows else []
+        if not ends[0]:
+            raise QuoteParityError('The header of `{}` has quote characters in unquoted fields.'
+                                   .format(self.csv_file))
+        return start
+
+    def get_byte_pattern(self):
+        """
+        Compile a regular expression of bytes matching any value of the filter groups.
+
+        One value of equality conditions is taken from each group, since a row
+        matched by the group must contain all of them. Return None if the rows
+        can't be prefiltered in this way: no filter group stacked, any group has
+        no equality condition, or any value is empty or contains quote or line
+        break characters.
+        """
+        if not self._filter_groups:
+            return None
+
+        encoding = codecs.lookup(self.encoding).name
+        # Do not search for the byte order mark.
+        if encoding == 'utf-8-sig':
+            encoding = 'utf-8'
+
+        literals = set()
+        for group in self._filter_groups:
+            values = [c.value for c in group if filter_engine.is_equality(c)]
+            if not values:
+                return None
+            value = max(values, key=len)
+            if not value or any(c in value for c in '"\r\n'):
+                return None
+            literals.add(re.escape(value.encode(encoding)))
+        return re.compile(b'|'.join(sorted(literals)))
+
+    def iter_candidate_rows(self):
+        """
+        Iterate rows of the csv file which contain any value of the filter groups.
+
+        The file is memory-mapped and searched with the pattern given by
+        `get_byte_pattern()`. For each hit the enclosing row is located by the
+        parity of quote characters, so it can be a row with quoted line breaks,
+        and only that row is decoded and parsed. Candidates still need to be
+        checked by the filter predicate. All rows are iterated through
+        `iter_rows()` if the filter groups can't be searched as bytes.
+
+        `QuoteParityError` is raised if a located row is not parsed as one
+        complete row, as fields with quote characters but not quoted break
+        the parity.
+        """
+        pattern = self.get_byte_pattern()
+        if pattern is None or self.compression or os.path.getsize(self.csv_file) == 0:
+            for row in self.iter_rows():
+                yield row
+            return
+
+        start = self.read_raw_header()
+        with open(self.csv_file, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                # `pos` is always at the beginning of a row.
+                pos = start
+                for hit in pattern.finditer(mm, start):
+                    h = hit.start()
+                    if h < pos:
+                        continue
+                    # Step back to the line break which ends the previous row.
+                    quoted = count_quotes(mm, pos, h) & 1
+                    row_start = h
+                    while True:
+                        nl = mm.rfind(b'\n', pos, row_start)
+                        if nl == -1:
+                            row_start = pos
+                            break
+                        quoted ^= count_quotes(mm, nl + 1, row_start) & 1
+                        row_start = nl
+                        if not quoted:
+                            row_start = nl + 1
+                            break
+                    # Step forward to the line break which ends this row.
+                    quoted = count_quotes(mm, row_start, h) & 1
+                    row_end = h
+                    while True:
+                        nl = mm.find(b'\n', row_end)
+                        if nl == -1:
+                            row_end = len(mm)
+                            break
+                        quoted ^= count_quotes(mm, row_end, nl) & 1
+                        row_end = nl + 1
+                        if not quoted:
+                            break
+                    pos = row_end
+
+                    text = mm[row_start:row_end].decode(self.encoding)
+                    ends = []
+                    rows = list(iter_checked_rows(text, ends))
+                    if len(rows) != 1 or not ends[0]:
+                        raise QuoteParityError('Rows of `{}` can not be located by quote characters, '
+                                               'process it without `--mmap`.'.format(self.csv_file))
+                    yield rows[0]
+            finally:
+                mm.close()
+
     def sub(self, filter_arr):
         """
-        Get a sub matrix from the matrix of current instance.
+        Stack a group of filter conditions, return it as a tuple of `Condition`.
 
-        Once this method is called, the result will be push into 
-        stack `_sub_matrices`, and the stack can be written to
-        a csv file by calling the method `write_all()`.
+        Once this method is called, the filter condition(s) will be
+        push into stack `_filter_groups`, and all the stacked groups
+        will be checked in one pass over the matrix when the method
+        `get_sub_matrix()` or `write_all()` is called. None is returned
+        if `filter_arr` is empty.
         
         Filter condition(s) given by argument `filter_arr` should be
         in the format like [""AA=Shanghai", "12=Mary", "ZZX=12345"].
@@ -175,11 +890,21 @@ class SubCsv():
         "AA, 12, ZZX" mean the column numbers of the csv matrix.
         With the same algorithm to excel column display,
         "AA" will be converted to 27 while "ZZX" to 18276.
+        Names in the header like "city=Shanghai" are supported as well,
+        they are looked up before excel columns.
+
+        Besides `=`, operators below are supported:
+            "C!=10"             not equal to, as string
+            "C<10", "C>=10"     compare as numbers if the column is numeric,
+                                see `declare_types()`, otherwise as strings
+            "N~^Ja"             search the regular expression in the cell
+            "N in {Jack,Mary}"  one of the values
         
         Filter condition given by parameter `filter_arr` will be
         processed as a `and` operation, and filter conditions given
         by multi callings of function `Sub()` will be processed as
-        an `or` operation.
+        an `or` operation. A row matched by more than one group is
+        exported only once, in its original order.
         
         Usage::
         
@@ -197,29 +922,158 @@ class SubCsv():
         if not filter_arr:
             return None
 
-        matrix = self.get_matrix()
-        def combine_param(s):
-            k, v = s.split(filter_operator)
+        header = self.get_header()
+        group = tuple(filter_engine.parse_condition(s, header) for s in filter_arr)
+        self.__check_kept(c.col for c in group)
+        if group not in self._filter_groups:
+            self._filter_groups.append(group)
+            self._predicate = None
+        return group
+
+    def get_predicate(self):
+        """
+        Compile all the stacked filter groups into one filter function.
+
+        Return None if no filter group is stacked, or any condition is not an
+        equality test, which is checked in batches by `filter_engine` instead.
+        """
+        if self._predicate is None and self.is_equality_only():
+            expression = 'lambda x: %s' % ' or '.join([
+                '(%s)' % ' and '.join(['len(x)>%d and x[%d]==%r' % (c.col, c.col, c.value)
+                                      for c in group])
+                for group in self._filter_groups
+            ])
+            debug_info('begin eval: `{}`.'.format(expression))
+            # Rows too short to have a column never match, as in `group_mask_rows()`.
+            self._predicate = safe_eval(expression, {'len': len})
+        return self._predicate
+
+    def is_equality_only(self):
+        """Check whether filter groups are stacked and all conditions are equality tests."""
+        return bool(self._filter_groups) and all(
+            filter_engine.is_equality(c) for group in self._filter_groups for c in group
+        )
+
+    def declare_types(self, mapping, **kwargs):
+        """
+        Declare types of columns compared by numeric operators like `<` or `>=`.
+
+        Types can be 'int', 'float' or 'str', columns not declared are inferred
+        by `resolve_types()` before rows are filtered. Cells of numeric columns
+        which are not numbers never match numeric operators.
+        """
+        if type(mapping) is dict:
+            kwargs.update(mapping)
+
+        header = self.get_header()
+        for col, col_type in kwargs.items():
+            if isinstance(col, string_types):
+                col = filter_engine.column_index(col, header)
+            self.column_types[col] = col_type
+            self._declared_types[col] = col_type
 
-            # Convert alphabet to column number.
-            if not k.isdigit():
-                # Convert result begins with 1 (A=1, B=2),
-                # so decrease the result by 1.
-                k = alph_to_num.convert(k.upper()) - 1
-            
-            return '=='.join(['x[%s]' % k, '"%s"' % v])
+    def resolve_types(self, groups=None):
+        """
+        Infer the types of columns compared by numeric operators in the filter
+        groups, `_filter_groups` if not given, unless they are declared.
+
+        Types are inferred once from the first `batch_size` rows of the csv
+        file, or of the loaded matrix, which are the same rows. So every mode
+        compares a column in the same way, whatever rows it checks at a time.
+        """
+        groups = self._filter_groups if groups is None else groups
+        if all(c.col in self.column_types for group in groups for c in group
+               if filter_engine.is_ordering(c)):
+            return self.column_types
+
+        if self._matrix:
+            sample = [self._matrix[pos] for pos in range(min(len(self._matrix), self.batch_size))]
+        else:
+            with open_text(self.csv_file, 'r', self.encoding, self.compression,
+                           buffer_size=io.DEFAULT_BUFFER_SIZE) as f:
+                rows = csv.reader(f)
+                if self.ensure_header:
+                    next(rows, None)
+                sample = list(islice(rows, self.batch_size))
+        return filter_engine.infer_types(groups, sample, self.column_types)
+
+    def filter_batch(self, rows):
+        """Get the rows matched by any of the filter groups from a list of rows."""
+        predicate = self.get_predicate()
+        if predicate is not None:
+            return list(filter(predicate, rows))
+
+        mask = None
+        for group in self._filter_groups:
+            m = filter_engine.group_mask_rows(group, rows, self.column_types)
+            mask = m if mask is None else filter_engine.mask_or(mask, m)
+        return [row for row, ok in zip(rows, mask) if ok]
+
+    def count_group_hits(self, rows):
+        """
+        Count the rows matched by each filter group into stats, apart from
+        `filter_batch()`, so the rows are filtered in the same way with stats.
+        """
+        for group in self._filter_groups:
+            m = filter_engine.group_mask_rows(group, rows, self.column_types)
+            self.__add_group_hits(group, filter_engine.mask_count(m))
 
-        # Generate the filter lambda function.
-        filter_str = ' and '.join(list(map(combine_param, filter_arr)))
-        expression = 'lambda x: %s' % filter_str
-        debug_info('begin eval: `{}`.'.format(expression))
-        filter_fun = safe_eval(expression)
+    def __add_group_hits(self, group, hits):
+        self.stats.add_group_hits(' and '.join(map(filter_engine.format_condition, group)), hits)
 
-        if self._sub_matrices is None:
-            self._sub_matrices = []
+    def get_sub_matrix(self):
+        """
+        Get the rows matched by any of the stacked filter groups.
+
+        If no filter group is stacked, the whole matrix will be returned.
+
+        Equality conditions are looked up in the column indexes instead of
+        scanning the matrix, `and` conditions become set intersections while
+        groups are combined as a set union. Other conditions are checked
+        column by column by `filter_engine`, for the rows found by equality
+        conditions of the group, or for the whole matrix.
+        """
+        matrix = self.get_matrix()
+        if not self._filter_groups:
+            return matrix
+
+        self.resolve_types()
+        positions = set()
+        for group in self._filter_groups:
+            matched = self.__lookup_group(group)
+            if self.stats.enabled:
+                self.__add_group_hits(group, len(matched))
+            positions.update(matched)
+        return [matrix[pos] for pos in sorted(positions)]
+
+    def __lookup_group(self, group):
+        """Get positions of rows matched by all the conditions in `group`."""
+        equalities = [c for c in group if filter_engine.is_equality(c)]
+        others = tuple(c for c in group if not filter_engine.is_equality(c))
+        matrix = self.get_matrix()
 
-        self._sub_matrices.append(list(filter(filter_fun, matrix)))
-        return self._sub_matrices[-1]
+        if not equalities:
+            if isinstance(matrix, ColumnTable):
+                mask = filter_engine.group_mask_table(others, matrix, self.column_types)
+            else:
+                mask = filter_engine.group_mask_rows(others, matrix, self.column_types)
+            return set(pos for pos, ok in enumerate(mask) if ok)
+
+        matched = [self.get_index(c.col).get(c.value, ()) for c in equalities]
+        # Intersect from the most selective condition.
+        matched.sort(key=len)
+        positions = set(matched[0])
+        for m in matched[1:]:
+            if not positions:
+                break
+            positions.intersection_update(m)
+
+        if others and positions:
+            candidates = sorted(positions)
+            mask = filter_engine.group_mask_rows(
+                others, [matrix[pos] for pos in candidates], self.column_types)
+            positions = set(pos for pos, ok in zip(candidates, mask) if ok)
+        return positions
 
     @staticmethod
     def register_converter(name, converter):
@@ -231,7 +1085,8 @@ class SubCsv():
         `safe_eval()` to generate a convert function.
 
         Attention:
-            `eval()` may be called and this could be a risk.
+            The content is parsed and checked against a whitelist of syntax
+            before it is compiled, see `safe_expression.validate()`.
 
             Config the global setting `safe_list` to allow objects that can be used
             in generating functions.
@@ -242,9 +1097,15 @@ class SubCsv():
             try:
                 expression = get_lambda_string(converter)
                 debug_info('begin eval: `{}`.'.format(expression))
-                SubCsv.converter_repo.update({name: safe_eval(expression)})
+                fn = safe_eval(expression)
+                if converter.startswith('d:'):
+                    fn = digit_converter(fn)
+                SubCsv.converter_repo.update({name: fn})
             except Exception as ex:
-                raise SyntaxError('`{}` is not valid converter function content.'.format(converter))
+                raise SyntaxError('`{}` is not valid converter function content: {}'.format(converter, ex))
+        else:
+            return
+        SubCsv.converter_sources.update({name: converter})
 
     def convert(self, col, converter):
         """
@@ -254,24 +1115,23 @@ class SubCsv():
         if isinstance(col, integer_types):
             col_num = col
         elif isinstance(col, string_types):
-            try:
-                # Convert result begins with 1 (A=1, B=2),
-                # so decrease the result by 1.
-                col_num = alph_to_num.convert(col) - 1
-            except ValueError as ex:
-                raise ex
+            # Name in the header, or excel column like A=0, B=1.
+            col_num = filter_engine.column_index(col, self.get_header())
         else:
             raise TypeError('`{}` is not a valid column marking.'.format(col))
+        self.__check_kept([col_num])
         
         # Directly use the converter function 
         #  or: find it in static repository
         #  or: generate and save it.
         if inspect.isfunction(converter):
             self.convert_strategy.update({col_num: converter})
+            self._convert_sources.update({col_num: converter})
         elif isinstance(converter, string_types):
             if converter not in SubCsv.converter_repo:
                 SubCsv.register_converter(converter, converter)
             self.convert_strategy.update({col_num: SubCsv.converter_repo[converter]})
+            self._convert_sources.update({col_num: SubCsv.converter_sources[converter]})
         else:
             raise TypeError('`{}` is not a valid converter marking.'.format(type(converter)))
 
@@ -283,82 +1143,681 @@ class SubCsv():
         for col, converter in kwargs.items():
             self.convert(col, converter)
 
-    def __apply_strategy_for_row(self, row):
-        """Convert each cell value in single row into new value by preseted convert mappings."""
+    def apply_strategy_for_batch(self, rows):
+        """
+        Convert cells of a batch of rows into new values by preseted convert mappings.
+
+        Batch converters are called once for each column, other converters once
+        for each cell. Rows too short to have the column are skipped. Rows are
+        changed in place.
+        """
         for k, v in self.convert_strategy.items():
-            debug_info('{col} is {val}'.format(col=k, val=row[k]))
-            row[k] = v(row[k])
-        return row
+            if DEBUG:
+                debug_info('convert column {col} of {count} rows'.format(col=k, count=len(rows)))
+            targets = [row for row in rows if k < len(row)]
+            if self.stats.enabled:
+                start = time.perf_counter()
+            if getattr(v, 'batch', False):
+                cells = v([row[k] for row in targets])
+                for row, cell in zip(targets, cells):
+                    row[k] = cell
+            else:
+                for row in targets:
+                    row[k] = v(row[k])
+            if self.stats.enabled:
+                calls = 1 if getattr(v, 'batch', False) else len(targets)
+                self.stats.add_converter_call(k, calls, time.perf_counter() - start)
+        return rows
+
+    def filter_rows(self, rows):
+        """Filter the given rows lazily by the stacked filter groups."""
+        if not self._filter_groups:
+            return rows
+        return (row for batch in iter_batches(rows, self.batch_size)
+                for row in self.filter_batch(batch))
+
+    def iter_processed_batches(self, rows):
+        """Filter and convert the given rows batch by batch, each stage is timed in stats."""
+        stats = self.stats
+        batches = iter_batches(rows, self.batch_size)
+        while True:
+            with stats.timing('parse') as st:
+                batch = next(batches, None)
+            if batch is None:
+                return
+            st.rows_out += len(batch)
+
+            if self._filter_groups:
+                if stats.enabled:
+                    self.count_group_hits(batch)
+                with stats.timing('filter') as st:
+                    st.rows_in += len(batch)
+                    batch = self.filter_batch(batch)
+                    st.rows_out += len(batch)
+
+            if self.convert_strategy and batch:
+                with stats.timing('convert') as st:
+                    st.rows_in += len(batch)
+                    batch = self.apply_strategy_for_batch(batch)
+                    st.rows_out += len(batch)
+
+            if batch:
+                yield self.project_batch(batch)
+
+    def process_rows(self, rows):
+        """Filter and convert the given rows lazily."""
+        return (row for batch in self.iter_processed_batches(rows) for row in batch)
+
+    def __output_path(self, csv_file=None, folder=False):
+        """
+        Get the path to write, a new file named by current time in the original
+        folder if csv_file is not given, or a new folder if `folder` is true.
+
+        The new file or folder is created at once in exclusive mode, so jobs
+        finished in the same second never write to the same one, a counter is
+        added to the name of later ones instead.
+        """
+        if csv_file:
+            # Use the given file name to write back.
+            return csv_file
+
+        name = os.path.join(os.path.dirname(self.csv_file),
+                            datetime.datetime.now().strftime('%Y-%m-%d %H-%M-%S'))
+        extension = '' if folder else '.csv' + compression_extension(self.compression)
+        n = 0
+        while True:
+            path = name + (' (%d)' % n if n else '') + extension
+            try:
+                if folder:
+                    os.mkdir(path)
+                else:
+                    open(path, 'x').close()
+                return path
+            except FileExistsError:
+                n += 1
+
+    @staticmethod
+    def __discard_output(csv_file):
+        """Remove the output file partly written by a failed run, if it is created."""
+        if os.path.exists(csv_file):
+            os.remove(csv_file)
 
     def __write(self, matrix, csv_file=None, ensure_header=True):
         if len(matrix) == 0:
             return 0, "The csv matrix is empty."
 
-        if not csv_file:
-            # Create a new file in the original folder.
-            csv_file = datetime.datetime.now().strftime('%Y-%m-%d %H-%M-%S') + '.csv'
-            csv_file = os.path.join(os.path.dirname(self.csv_file), csv_file)
-        else:
-            # Use the given file name to write back.
-            csv_file = csv_file
-
         if self.convert_strategy:
-            matrix = [self.__apply_strategy_for_row(row) for row in matrix]
+            with self.stats.timing('convert') as st:
+                # Convert copies of rows so the matrix and its indexes stay untouched.
+                matrix = self.apply_strategy_for_batch([list(row) for row in matrix])
+                st.rows_in += len(matrix)
+                st.rows_out += len(matrix)
+        matrix = self.project_batch(matrix)
+        csv_file = self.__output_path(csv_file)
 
         try:
-            with open(csv_file, 'w', encoding=self.encoding, newline='') as f:
-                cw = csv.writer(f)
-                if ensure_header and self._header:
-                    cw.writerow(self._header)
-                cw.writerows(matrix)
+            with self.stats.timing('write') as st:
+                with self.__open_output(csv_file) as f:
+                    cw = csv.writer(f)
+                    if ensure_header and self._header:
+                        cw.writerow(self.get_output_header())
+                    cw.writerows(matrix)
+                st.rows_in += len(matrix)
+                st.bytes += os.path.getsize(csv_file)
         except Exception as ex:
             return 0, ex
 
         return len(matrix), csv_file
 
+    def __write_stream(self, csv_file=None, ensure_header=True):
+        """Read, filter, convert and write rows batch by batch."""
+        csv_file = self.__output_path(csv_file)
+
+        if self.pipelined and not self.use_mmap:
+            return self.__write_pipelined(csv_file, ensure_header)
+        rows = self.iter_candidate_rows() if self.use_mmap else self.iter_rows()
+        batches = self.iter_processed_batches(rows)
+
+        count = 0
+        try:
+            with self.__open_output(csv_file) as f:
+                cw = csv.writer(f)
+                # Header is read along with the first batch.
+                batch = next(batches, [])
+                if ensure_header and self._header:
+                    cw.writerow(self.get_output_header())
+                while batch:
+                    with self.stats.timing('write') as st:
+                        cw.writerows(batch)
+                        st.rows_in += len(batch)
+                    count += len(batch)
+                    batch = next(batches, [])
+            self.stats.stage('write').bytes += os.path.getsize(csv_file)
+        except Exception:
+            self.__discard_output(csv_file)
+            raise
+
+        if count == 0:
+            os.remove(csv_file)
+            return 0, "The csv matrix is empty."
+
+        return count, csv_file
+
+    def __write_pipelined(self, csv_file, ensure_header=True):
+        """Read, process and write rows in overlapped threads."""
+        pipeline = Pipeline(self.queue_size)
+        counts = [0]
+        try:
+            with self.__open_output(csv_file) as f:
+                cw = csv.writer(f)
+
+                def write(batch):
+                    # Header is read before the first batch.
+                    if not counts[0] and ensure_header and self._header:
+                        cw.writerow(self.get_output_header())
+                    with self.stats.timing('write') as st:
+                        cw.writerows(batch)
+                        st.rows_in += len(batch)
+                    counts[0] += len(batch)
+
+                pipeline.run(
+                    self.iter_text_blocks(),
+                    lambda blocks: self.iter_processed_batches(self.iter_rows_of_blocks(blocks)),
+                    write
+                )
+            self.stats.stage('write').bytes += os.path.getsize(csv_file)
+        except Exception:
+            self.__discard_output(csv_file)
+            raise
+        finally:
+            if self.stats.enabled:
+                # Waiting for the reader thread is not parsing.
+                self.stats.stage('parse').seconds -= pipeline.read_queue.get_wait
+                for q in pipeline.queues:
+                    self.stats.add_queue(q.name, q.as_dict())
+
+        if counts[0] == 0:
+            os.remove(csv_file)
+            return 0, "The csv matrix is empty."
+
+        return counts[0], csv_file
+
+    def __write_parallel(self, csv_file=None, ensure_header=True):
+        """Process byte ranges of the csv file in worker processes and merge them in order."""
+        start = self.read_raw_header()
+        size = os.path.getsize(self.csv_file)
+        count = max(self.workers, (size - start) // self.chunk_size)
+        offsets = [start + (size - start) * i // count for i in range(1, count)]
+        boundaries = [start] + find_row_boundaries(self.csv_file, offsets) + [size]
+        tasks = [
+            (self.csv_file, self.encoding, b, e, self._filter_groups, self.column_types,
+             self._convert_sources, self._projection, self.stats.enabled)
+            for b, e in zip(boundaries, boundaries[1:]) if e > b
+        ]
+
+        csv_file = self.__output_path(csv_file)
+        total = 0
+        pool = multiprocessing.Pool(self.workers)
+        try:
+            with self.__open_output(csv_file) as f:
+                if ensure_header and self._header:
+                    csv.writer(f).writerow(self.get_output_header())
+                # `imap` yields results in the order of the tasks.
+                results = pool.imap(_process_chunk, tasks)
+                for i in range(len(tasks)):
+                    # Waiting for workers to parse, filter and convert.
+                    with self.stats.timing('process') as st:
+                        n, text, stats, ends_row = next(results)
+                    if not ends_row and i < len(tasks) - 1:
+                        # The next range doesn't begin at a row.
+                        raise QuoteParityError('Rows of `{}` can not be split by quote characters.'
+                                               .format(self.csv_file))
+                    st.rows_out += n
+                    if self.stats.enabled:
+                        self.stats.merge(stats)
+                    with self.stats.timing('write') as st:
+                        f.write(text)
+                        st.rows_in += n
+                    total += n
+            self.stats.stage('write').bytes += os.path.getsize(csv_file)
+            pool.close()
+            pool.join()
+        except Exception:
+            pool.terminate()
+            self.__discard_output(csv_file)
+            raise
+
+        if total == 0:
+            os.remove(csv_file)
+            return 0, "The csv matrix is empty."
+
+        return total, csv_file
+
+    def partition(self, by=None, groups=None, output_dir=None, ensure_header=True,
+                  max_open_files=64):
+        """
+        Write rows into many sub csv files in one pass over the csv file.
+
+        If `by` is given, rows are split by the value of column `by`, and each
+        value gets its own file named after it. Otherwise `groups` should be a
+        dict of {name: filter_arr}, where filter_arr is in the same format as
+        the argument of `sub()`, and rows matched by each group are written to
+        a file named after the group, so a row may be written to many files.
+
+        Stacked filter groups, convert strategies and the selected columns are
+        applied as the method `write_all()` does, rows are split before they
+        are converted.
+
+        Files are written into `output_dir`, which is a new folder named by
+        current time in the original folder if not given. At most
+        `max_open_files` files are opened at the same time. Files are
+        compressed in the same way as the csv file.
+
+        Return a dict in the format of {value_or_name: (count, file_path)}.
+
+        Usage::
+
+            >> sc = SubCsv('path/to/file.csv')
+            >> sc.partition(by='C')
+            >> sc.partition(groups={'jack': ['N=Jack'], 'adult': ['A>=18']})
+        """
+        if by is None and not groups:
+            raise ValueError('Either `by` or `groups` should be given to partition.')
+
+        header = self.get_header()
+        if isinstance(by, string_types):
+            by = filter_engine.column_index(by, header)
+        named_groups = [
+            (name, tuple(filter_engine.parse_condition(s, header) for s in filter_arr))
+            for name, filter_arr in (groups or {}).items()
+        ]
+        self.resolve_types(self._filter_groups + [group for _, group in named_groups])
+        created = not output_dir
+        if created:
+            output_dir = self.__output_path(folder=True)
+
+        writer = None
+        for batch in iter_batches(self.filter_rows(self.iter_rows()), self.batch_size):
+            if writer is None:
+                # Header is read along with the first batch.
+                header = ensure_header and self.get_output_header() or None
+                writer = PartitionWriter(output_dir, header=header, encoding=self.encoding,
+                                         compression=self.compression,
+                                         compress_level=self.compress_level,
+                                         max_open_files=max_open_files)
+
+            if by is not None:
+                keys = [row[by] if by < len(row) else '' for row in batch]
+                masks = None
+            else:
+                masks = [(name, filter_engine.group_mask_rows(group, batch, self.column_types))
+                         for name, group in named_groups]
+
+            if self.convert_strategy:
+                batch = self.apply_strategy_for_batch(batch)
+            batch = self.project_batch(batch)
+
+            if masks is None:
+                for key, row in zip(keys, batch):
+                    writer.write(key, row)
+            else:
+                for name, mask in masks:
+                    for row, ok in zip(batch, mask):
+                        if ok:
+                            writer.write(name, row)
+
+        if writer is None:
+            if created:
+                os.rmdir(output_dir)
+            return {}
+        writer.close()
+        return dict((key, (writer.counts[key], path)) for key, path in writer.paths.items())
+
+    def get_compared_types(self):
+        """Get the types of columns compared by numeric operators, which are resolved."""
+        columns = set(c.col for group in self._filter_groups for c in group
+                      if filter_engine.is_ordering(c))
+        return dict((col, self.column_types[col]) for col in columns if col in self.column_types)
+
+    def get_signature(self):
+        """
+        Describe the filter groups, types of compared columns, converters and
+        selected columns, which decide the results.
+        """
+        groups = sorted(' & '.join(map(filter_engine.format_condition, group))
+                        for group in self._filter_groups)
+        groups += ['type %d:%s' % item for item in sorted(self.get_compared_types().items())]
+        converters = sorted(
+            '%d%s%s' % (col, convert_operator,
+                        source if isinstance(source, string_types) else source.__name__)
+            for col, source in self._convert_sources.items()
+        )
+        projection = []
+        if self._projection is not None:
+            projection = ['select %s' % ','.join(map(str, self._projection))]
+        return '\n'.join(groups + converters + projection)
+
+    def write_incremental(self, csv_file, ensure_header=True):
+        """
+        Process rows appended to the csv file since the last run, and append
+        the results to the output file `csv_file`.
+
+        After each block of rows is written, the byte offset reached in the csv
+        file is saved in a checkpoint next to the output file, along with the
+        checksums of the header and of the bytes before the offset, the size of
+        the output file, and the filter groups, types of compared columns and
+        converters. The next run truncates the output file to the saved size,
+        so nothing is written twice after an interruption, and goes on from the
+        saved offset. Types of compared columns which are not declared are
+        taken from the checkpoint, so appended rows are filtered in the same
+        way as the rows before them.
+
+        The whole file is processed again and the output file is rewritten if
+        the checkpoint doesn't match: the header, the filters, declared types
+        or converters are changed, or the csv file is truncated or replaced.
+
+        A row is processed only when the line break ending it is written, so
+        rows being written by another process are left for the next run. Only
+        encodings compatible with ascii are supported, as the parallel mode.
+        Rows are located by the parity of quote characters as well,
+        `QuoteParityError` is raised if any field has quote characters but is
+        not quoted.
+
+        Compressed csv files and output files are not supported, since byte
+        offsets are needed in both of them.
+
+        Return (count_of_rows_written, csv_file).
+        """
+        if self.compression or compression_of_name(csv_file):
+            raise ValueError('Compressed files are not supported in incremental mode.')
+
+        source = os.path.abspath(self.csv_file)
+        size = os.path.getsize(self.csv_file)
+        start = self.read_raw_header()
+        with open(self.csv_file, 'rb') as f:
+            header_sum = checkpoint.checksum(f.read(start))
+
+        state = checkpoint.load(csv_file)
+        self.column_types = dict(self._declared_types)
+        if state is not None:
+            # Compare appended rows with the types resolved by the first run.
+            for col, col_type in state.get('types', {}).items():
+                self.column_types.setdefault(int(col), col_type)
+        self.resolve_types()
+        resume = (
+            state is not None and os.path.exists(csv_file)
+            and state['source'] == source
+            and state['header'] == header_sum
+            and state['signature'] == self.get_signature()
+            and start <= state['offset'] <= size
+            and os.path.getsize(csv_file) >= state['output_size']
+        )
+        if resume:
+            with open(self.csv_file, 'rb') as f:
+                f.seek(max(state['offset'] - 1024, 0))
+                resume = checkpoint.checksum(f.read(min(state['offset'], 1024))) == state['tail']
+
+        if not resume:
+            self.column_types = dict(self._declared_types)
+            self.resolve_types()
+        elif state['offset'] == size:
+            return 0, csv_file
+
+        offset = state['offset'] if resume else start
+        count = 0
+        if resume:
+            with open(csv_file, 'r+b') as f:
+                f.truncate(state['output_size'])
+        with open(csv_file, 'a' if resume else 'w', encoding=self.encoding, newline='') as f:
+            cw = csv.writer(f)
+            if not resume and ensure_header and self._header:
+                cw.writerow(self.get_output_header())
+
+            for end, block in iter_row_blocks(self.csv_file, offset, self.chunk_size):
+                ends = []
+                rows = iter_checked_rows(block.decode(self.encoding), ends)
+                for batch in self.iter_processed_batches(rows):
+                    with self.stats.timing('write') as st:
+                        cw.writerows(batch)
+                        st.rows_in += len(batch)
+                    count += len(batch)
+                if not ends[0]:
+                    # Rows after the checkpoint are dropped by the next run.
+                    raise QuoteParityError('Rows of `{}` can not be split by quote characters, '
+                                           'process it without `--incremental`.'.format(self.csv_file))
+                f.flush()
+                offset = end
+                self.__save_checkpoint(csv_file, source, header_sum, offset, f.buffer.tell(), block)
+
+            if not resume and offset == start:
+                # Nothing to process yet, start from here next time.
+                f.flush()
+                self.__save_checkpoint(csv_file, source, header_sum, offset, f.buffer.tell(), b'')
+
+        return count, csv_file
+
+    def __save_checkpoint(self, csv_file, source, header_sum, offset, output_size, block):
+        if len(block) < 1024 and offset > len(block):
+            with open(self.csv_file, 'rb') as f:
+                f.seek(max(offset - 1024, 0))
+                block = f.read(offset - f.tell())
+        checkpoint.save(csv_file, {
+            'source': source,
+            'header': header_sum,
+            'signature': self.get_signature(),
+            'types': dict((str(col), col_type) for col, col_type in self.get_compared_types().items()),
+            'offset': offset,
+            'tail': checkpoint.checksum(block[-1024:]),
+            'output_size': output_size,
+        })
+
+    def follow(self, csv_file, ensure_header=True, interval=1.0):
+        """
+        Keep processing rows appended to the csv file as they arrive.
+
+        The csv file is checked every `interval` seconds, new rows are
+        processed by `write_incremental()`. Yield (count, csv_file) for each
+        run writing any row, until the caller stops iterating.
+
+        Usage::
+
+            >> for count, path in sc.follow('path/to/output.csv'):
+            ..     print(count)
+        """
+        while True:
+            count, path = self.write_incremental(csv_file, ensure_header)
+            if count:
+                yield count, path
+            time.sleep(interval)
+
     def write_all(self, csv_file=None, ensure_header=True):
-        """Combine all sub matrixes in the stack and write back to the specific file."""
-        if self._sub_matrices is None:
-            sub_matrix = self.get_matrix()
-        else:
-            sub_matrix = reduce(lambda x, y: x + y, self._sub_matrices)
+        """Write rows matched by the stacked filter groups back to the specific file."""
+        self.resolve_types()
+        if self.workers > 1 and not self.compression:
+            try:
+                return self.__write_parallel(csv_file, ensure_header)
+            except QuoteParityError as ex:
+                debug_info('{} Streaming instead.'.format(ex))
+                self.stats = Stats(enabled=self.stats.enabled)
+                return self.__write_stream(csv_file, ensure_header)
+        if self.streaming:
+            return self.__write_stream(csv_file, ensure_header)
+
+        with self.stats.timing('parse') as st:
+            st.rows_out += len(self.get_matrix())
+        with self.stats.timing('filter') as st:
+            sub_matrix = self.get_sub_matrix()
+            st.rows_in += len(self.get_matrix())
+            st.rows_out += len(sub_matrix)
         return self.__write(sub_matrix, csv_file, ensure_header)
 
 
-def execute_command():
-    if len(sys.argv) < 3:
-        sys.exit('Not enough parameters to continue.')
+def parse_command(args):
+    """
+    Parse the command arguments, which are the file path and action commands,
+    into a dict of options for `create_sub_csv()` and `run_command()`.
+    """
+    file_path = args[0]
+    all_action_cmd = args[1:]
+
+    # DEBUG = '--debug' in all_action_cmd
+
+    def split_sub_and_convert_command():
+        # get all convert action commands into a dict
+        fn = lambda x: x.split(convert_operator)
+        convert_cmd = dict([fn(cmd) for cmd in all_action_cmd if len(fn(cmd)) == 2])
+        # get all sub action commands into a list
+        sub_cmd = [cmd for cmd in all_action_cmd
+                   if not cmd.startswith('--') and convert_operator not in cmd
+                   and filter_engine.condition_pattern.match(cmd)]
+
+        return sub_cmd, convert_cmd
+
+    sub, convert = split_sub_and_convert_command()
+
+    ensure_header = '--ensure-header' in all_action_cmd
+    # Stream through the file unless the whole matrix is asked to be loaded.
+    streaming = '--no-stream' not in all_action_cmd
+    workers = [int(cmd.split('=')[1]) for cmd in all_action_cmd if cmd.startswith('--workers=')]
+    workers = workers and workers[-1] or 1
+
+    use_mmap = '--mmap' in all_action_cmd
+
+    columnar = '--columnar' in all_action_cmd
+    use_cache = '--cache' in all_action_cmd
+    # A columnar table or cached matrix is loaded in memory, it can't be streamed.
+    streaming = streaming and not (columnar or use_cache)
+
+    # column types are declared like `--type=C:float`
+    types = dict([cmd[len('--type='):].split(':') for cmd in all_action_cmd
+                  if cmd.startswith('--type=')])
+
+    stats = '--stats' in all_action_cmd
+
+    # partition by a column like `--partition=C`,
+    # or by named filter groups like `--group=jack:N=Jack&S=M`
+    by = [cmd[len('--partition='):] for cmd in all_action_cmd if cmd.startswith('--partition=')]
+    groups = dict([
+        (name, conditions.split('&')) for name, conditions in
+        [cmd[len('--group='):].split(':', 1) for cmd in all_action_cmd if cmd.startswith('--group=')]
+    ])
+
+    # process rows appended since the last run like `--incremental=path/to/output.csv`,
+    # and keep processing new rows with `--follow`, checking every `--interval=1` seconds
+    incremental = [cmd[len('--incremental='):] for cmd in all_action_cmd
+                   if cmd.startswith('--incremental=')]
+    follow = '--follow' in all_action_cmd
+    interval = [float(cmd[len('--interval='):]) for cmd in all_action_cmd
+                if cmd.startswith('--interval=')]
+
+    # compression level of output files like `--compress-level=6`,
+    # buffer size in bytes of reading and writing like `--buffer-size=4194304`
+    compress_level = [int(cmd[len('--compress-level='):]) for cmd in all_action_cmd
+                      if cmd.startswith('--compress-level=')]
+    buffer_size = [int(cmd[len('--buffer-size='):]) for cmd in all_action_cmd
+                   if cmd.startswith('--buffer-size=')]
+
+    pipelined = '--pipeline' in all_action_cmd
+
+    # write the selected columns only like `--select=A:F` or `--select=price,qty`
+    select = [cmd[len('--select='):] for cmd in all_action_cmd if cmd.startswith('--select=')]
+
+    return {
+        'file_path': file_path,
+        'sub': sub,
+        'convert': convert,
+        'ensure_header': ensure_header,
+        'streaming': streaming,
+        'workers': workers,
+        'use_mmap': use_mmap,
+        'columnar': columnar,
+        'use_cache': use_cache,
+        'types': types,
+        'stats': stats,
+        'by': by and by[-1] or None,
+        'groups': groups,
+        'incremental': incremental and incremental[-1] or None,
+        'follow': follow,
+        'interval': interval and interval[-1] or 1.0,
+        'compress_level': compress_level[-1] if compress_level else None,
+        'buffer_size': buffer_size and buffer_size[-1] or None,
+        'pipelined': pipelined,
+        'select': select and select[-1] or None,
+    }
 
-    debug_info(' '.join(sys.argv))
 
+def create_sub_csv(options):
+    """Create a SubCsv instance by the options given by `parse_command()`."""
+    return SubCsv(options['file_path'], ensure_header=options['ensure_header'],
+                  streaming=options['streaming'], workers=options['workers'],
+                  use_mmap=options['use_mmap'], columnar=options['columnar'],
+                  use_cache=options['use_cache'], stats=options['stats'],
+                  compress_level=options['compress_level'], buffer_size=options['buffer_size'],
+                  pipelined=options['pipelined'])
+
+
+def run_command(sc, options):
+    """Run the actions of the options on a SubCsv instance, return the lines of result."""
+    sc.declare_types(options['types'])
+    sc.sub(options['sub'])
+    sc.convert_all(options['convert'])
+    if options['select']:
+        sc.select(options['select'])
+
+    lines = []
+    if options['incremental']:
+        result = sc.write_incremental(options['incremental'], ensure_header=options['ensure_header'])
+        lines.append('%d filter result saved. %s' % result)
+    elif options['by'] or options['groups']:
+        results = sc.partition(by=options['by'], groups=options['groups'],
+                               ensure_header=options['ensure_header'])
+        for key in sorted(results):
+            lines.append('%d filter result saved. %s' % results[key])
+    else:
+        result = sc.write_all(ensure_header=options['ensure_header'])
+        lines.append('%d filter result saved. %s' % result)
+
+    if options['stats']:
+        lines.append(sc.stats.to_json(indent=2))
+    return lines
+
+
+def follow_command(sc, options):
+    """Keep processing new rows of the csv file and print the results, until interrupted."""
+    if not options['incremental']:
+        raise ValueError('`--follow` should be used with `--incremental=path/to/output.csv`.')
+    sc.declare_types(options['types'])
+    sc.sub(options['sub'])
+    sc.convert_all(options['convert'])
+    if options['select']:
+        sc.select(options['select'])
     try:
-        file_path = sys.argv[1]
-        all_action_cmd = sys.argv[2:]
-        
-        # DEBUG = '--debug' in all_action_cmd
+        for result in sc.follow(options['incremental'], ensure_header=options['ensure_header'],
+                                interval=options['interval']):
+            print('%d filter result saved. %s' % result)
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
 
-        def split_sub_and_convert_command():
-            # get all sub action commands into a list
-            sub_cmd = [cmd for cmd in all_action_cmd if len(cmd.split(filter_operator)) ==2]
-            # get all convert action commands into a dict
-            fn = lambda x: x.split(convert_operator)
-            convert_cmd = dict([fn(cmd) for cmd in all_action_cmd if len(fn(cmd)) == 2])
 
-            return sub_cmd, convert_cmd
-        
-        sub, convert = split_sub_and_convert_command()
+def execute_command():
+    if len(sys.argv) < 3:
+        sys.exit('Not enough parameters to continue.')
 
-        ensure_header = '--ensure-header' in all_action_cmd
+    debug_info(' '.join(sys.argv))
 
-        sc = SubCsv(file_path, ensure_header=ensure_header)
-        sc.sub(sub)
-        sc.convert_all(convert)
-        result = sc.write_all(ensure_header=ensure_header)
+    try:
+        options = parse_command(sys.argv[1:])
+        if options['follow']:
+            follow_command(create_sub_csv(options), options)
+            return
+        lines = run_command(create_sub_csv(options), options)
     except Exception as ex:
         debug_info(ex)
         sys.exit(ex)
 
-    print('%d filter result saved. %s' % result)
+    for line in lines:
+        print(line)
 
 
 #----------------------------------------------------------------------
@@ -380,6 +1839,7 @@ class TestSubCsv(unittest.TestCase):
         SubCsv.register_converter('plus_one', 'x: random()')
         SubCsv.register_converter('prefix', prefix)
 
+        sc = SubCsv(__file__, ensure_header=False)
         sc.convert(1, 'plus_one')
         sc.convert('p', 'prefix')
         sc.convert('f', 'x: random()')
@@ -0,0 +1,250 @@
+"""
+Benchmarks of sub_csv on synthetic csv files.
+
+Usage::
+
+> python sub_csv_bench.py --rows=1000000
+> python sub_csv_bench.py --rows=1000000 --cols=20 --cardinality=1000 --quoting=newlines
+> python sub_csv_bench.py --rows=10000000 --save-baseline=bench_baseline.json
+> python sub_csv_bench.py --rows=10000000 --baseline=bench_baseline.json --tolerance=0.1
+
+Each case runs in a new process, so the peak resident memory of it is not
+affected by the other cases. Options:
+
+    --rows=N            count of rows, default 1000000
+    --cols=N            count of columns, default 10
+    --cardinality=N     count of distinct values of text columns, default 100
+    --quoting=Q         minimal, all, or newlines (quoted fields with line
+                        breaks and quotes), default minimal
+    --encoding=E        encoding of the file, default utf-8_sig
+    --repeat=N          run each case N times and take the fastest, default 1
+    --cases=a,b         run the given cases only
+    --data-dir=D        folder of generated files, default temp folder
+    --save-baseline=F   save the result as baseline to file F
+    --baseline=F        compare with the baseline in file F, the exit code
+                        is 1 if any case is slower than the baseline
+    --tolerance=T       allowed slow down ratio against baseline, default 0.1
+"""
+import csv
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+from stats import peak_memory
+from sub_csv import SubCsv
+
+
+def generate_csv(path, rows, cols, cardinality, quoting='minimal', encoding='utf-8_sig', seed=0):
+    """
+    Generate a csv file with a header and `rows` rows of `cols` columns.
+
+    Even columns hold text values chosen from `cardinality` distinct values,
+    odd columns hold integers from 0 to 999. With quoting `newlines`, one in
+    every ten text values contains a line break, a comma and a quote.
+    """
+    rnd = random.Random(seed)
+    values = ['v%d' % i for i in range(cardinality)]
+    if quoting == 'newlines':
+        values = [v if i % 10 else '%s\n"x",y' % v for i, v in enumerate(values)]
+
+    csv_quoting = csv.QUOTE_ALL if quoting == 'all' else csv.QUOTE_MINIMAL
+    with open(path, 'w', encoding=encoding, newline='') as f:
+        cw = csv.writer(f, quoting=csv_quoting)
+        cw.writerow(['c%d' % i for i in range(cols)])
+        for _ in range(rows):
+            cw.writerow([
+                rnd.choice(values) if i % 2 == 0 else str(rnd.randrange(1000))
+                for i in range(cols)
+            ])
+
+
+# Every case is a function of the csv file, returning the seconds measured.
+# Loading is excluded from the cases named after a single method, while the
+# pipeline cases are timed as a whole.
+
+def case_get_matrix(path):
+    sc = SubCsv(path)
+    start = time.perf_counter()
+    sc.get_matrix()
+    return time.perf_counter() - start
+
+
+def case_sub(path):
+    sc = SubCsv(path)
+    sc.get_matrix()
+    start = time.perf_counter()
+    sc.sub(['A=v1'])
+    sc.sub(['C=v2', 'B<500'])
+    sc.get_sub_matrix()
+    return time.perf_counter() - start
+
+
+def case_convert_all(path):
+    sc = SubCsv(path)
+    rows = [list(row) for row in sc.get_matrix()]
+    start = time.perf_counter()
+    sc.convert_all({'A': 's: s + "!"', 'B': 'd: d * 2 + 1'})
+    sc.apply_strategy_for_batch(rows)
+    return time.perf_counter() - start
+
+
+def case_write_all(path):
+    sc = SubCsv(path)
+    sc.get_matrix()
+    start = time.perf_counter()
+    sc.write_all(path + '.out.csv')
+    return time.perf_counter() - start
+
+
+def _pipeline(path, **kwargs):
+    start = time.perf_counter()
+    sc = SubCsv(path, **kwargs)
+    sc.sub(['A=v1'])
+    sc.sub(['C=v2', 'B<500'])
+    sc.convert_all({'A': 's: s + "!"', 'B': 'd: d * 2 + 1'})
+    sc.write_all(path + '.out.csv')
+    return time.perf_counter() - start
+
+
+def case_pipeline_memory(path):
+    return _pipeline(path)
+
+
+def case_pipeline_stream(path):
+    return _pipeline(path, streaming=True)
+
+
+def case_pipeline_threaded(path):
+    return _pipeline(path, streaming=True, pipelined=True)
+
+
+def case_pipeline_columnar(path):
+    return _pipeline(path, columnar=True)
+
+
+def case_pipeline_mmap(path):
+    return _pipeline(path, streaming=True, use_mmap=True)
+
+
+def case_pipeline_parallel(path):
+    return _pipeline(path, streaming=True, workers=max(multiprocessing.cpu_count(), 2))
+
+
+cases = [
+    ('get_matrix', case_get_matrix),
+    ('sub', case_sub),
+    ('convert_all', case_convert_all),
+    ('write_all', case_write_all),
+    ('pipeline_memory', case_pipeline_memory),
+    ('pipeline_stream', case_pipeline_stream),
+    ('pipeline_threaded', case_pipeline_threaded),
+    ('pipeline_columnar', case_pipeline_columnar),
+    ('pipeline_mmap', case_pipeline_mmap),
+    ('pipeline_parallel', case_pipeline_parallel),
+]
+
+
+def _run_case(name, path, conn):
+    seconds = dict(cases)[name](path)
+    conn.send((seconds, peak_memory()))
+    conn.close()
+
+
+def run_case(name, path, rows, repeat=1):
+    """Run a case on a file of `rows` rows in new processes, return the fastest result."""
+    best = None
+    for _ in range(repeat):
+        # Each run gets its own process and peak memory, which is not a daemon
+        # so the parallel case can start worker processes.
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_run_case, args=(name, path, sender))
+        process.start()
+        sender.close()
+        try:
+            seconds, peak = receiver.recv()
+        except EOFError:
+            raise RuntimeError('case `{}` failed.'.format(name))
+        finally:
+            process.join()
+        if best is None or seconds < best['seconds']:
+            best = {
+                'seconds': round(seconds, 4),
+                'rows': rows,
+                'rows_per_second': round(rows / seconds, 1) if seconds else None,
+                'bytes_per_second': round(os.path.getsize(path) / seconds, 1) if seconds else None,
+                'peak_rss': peak,
+            }
+    return best
+
+
+def compare(results, baseline, tolerance):
+    """Get names of cases slower than the baseline by more than `tolerance`."""
+    return [
+        name for name, result in results.items()
+        if name in baseline and result['seconds'] > baseline[name]['seconds'] * (1 + tolerance)
+    ]
+
+
+def parse_options(argv):
+    options = {}
+    for arg in argv:
+        if arg.startswith('--'):
+            key, _, value = arg[2:].partition('=')
+            options[key] = value
+    return options
+
+
+def main(argv):
+    options = parse_options(argv)
+    rows = int(options.get('rows', 1000000))
+    cols = int(options.get('cols', 10))
+    cardinality = int(options.get('cardinality', 100))
+    quoting = options.get('quoting', 'minimal')
+    encoding = options.get('encoding', 'utf-8_sig')
+    repeat = int(options.get('repeat', 1))
+    tolerance = float(options.get('tolerance', 0.1))
+    data_dir = options.get('data-dir') or tempfile.gettempdir()
+    names = options.get('cases') and options['cases'].split(',') or [n for n, _ in cases]
+
+    path = os.path.join(data_dir, 'sub_csv_bench_%d_%d_%d_%s_%s.csv' % (
+        rows, cols, cardinality, quoting, encoding))
+    if not os.path.exists(path):
+        print('generating %s' % path)
+        generate_csv(path, rows, cols, cardinality, quoting, encoding)
+
+    results = {}
+    for name in names:
+        results[name] = run_case(name, path, rows, repeat)
+        r = results[name]
+        print('%-20s %10.4fs %14s rows/s %8.1f MB/s %8s MB peak' % (
+            name, r['seconds'], r['rows_per_second'], (r['bytes_per_second'] or 0) / 1e6,
+            r['peak_rss'] and r['peak_rss'] // (1 << 20)))
+
+    output = path + '.out.csv'
+    if os.path.exists(output):
+        os.remove(output)
+
+    if options.get('save-baseline'):
+        with open(options['save-baseline'], 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('baseline saved. %s' % options['save-baseline'])
+
+    if options.get('baseline'):
+        with open(options['baseline']) as f:
+            baseline = json.load(f)
+        slower = compare(results, baseline, tolerance)
+        for name in slower:
+            print('REGRESSION %s: %.4fs, baseline %.4fs' % (
+                name, results[name]['seconds'], baseline[name]['seconds']))
+        if slower:
+            return 1
+        print('no regression against %s' % options['baseline'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
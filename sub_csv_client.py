@@ -0,0 +1,81 @@
+"""
+Thin client of sub_csv_server, taking the same arguments as sub_csv.py.
+
+Only the standard library is imported here, so the client starts quickly.
+
+Usage::
+
+> python sub_csv_client.py path/to/your/original/file.csv N=Jack
+39 filter result saved. path/to/your/original/2016-06-28 10-30-41.csv
+
+# use another socket than the default one
+> python sub_csv_client.py path/to/your/original/file.csv N=Jack --socket=/tmp/my.sock
+
+# stop the server
+> python sub_csv_client.py --shutdown
+"""
+import json
+import os
+import socket
+import sys
+import tempfile
+
+default_socket = os.path.join(tempfile.gettempdir(), 'sub_csv.sock')
+# Options given a file path, which is resolved by the client.
+path_options = ('--incremental=', )
+
+
+def send_request(request, socket_path=default_socket):
+    """Send a request as a line of json and return the response line parsed."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        f = client.makefile('rb')
+        line = f.readline()
+        f.close()
+    finally:
+        client.close()
+    return json.loads(line.decode('utf-8'))
+
+
+def absolute_path_option(arg):
+    """Make the path of a path-valued option like `--incremental=out.csv` absolute."""
+    for option in path_options:
+        if arg.startswith(option):
+            return option + os.path.abspath(arg[len(option):])
+    return arg
+
+
+def execute_command(argv):
+    socket_path = default_socket
+    args = []
+    for arg in argv:
+        if arg.startswith('--socket='):
+            socket_path = arg[len('--socket='):]
+        else:
+            args.append(arg)
+
+    if args == ['--shutdown']:
+        send_request({'shutdown': True}, socket_path)
+        return
+
+    if len(args) < 2:
+        sys.exit('Not enough parameters to continue.')
+
+    # The server may run in another working directory.
+    args[0] = os.path.abspath(args[0])
+    args[1:] = [absolute_path_option(arg) for arg in args[1:]]
+    try:
+        response = send_request({'args': args}, socket_path)
+    except socket.error as ex:
+        sys.exit('Can not connect to server at {}: {}'.format(socket_path, ex))
+
+    if response.get('error'):
+        sys.exit(response['error'])
+    for line in response['lines']:
+        print(line)
+
+
+if __name__ == '__main__':
+    execute_command(sys.argv[1:])
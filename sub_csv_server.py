@@ -0,0 +1,160 @@
+"""
+Long-running server which keeps parsed csv files in memory for SubCsv jobs.
+
+Jobs are sent over a local Unix socket by `sub_csv_client.py`, with the same
+arguments as `sub_csv.py`. A file is parsed by the first job on it, and later
+jobs reuse the matrix and the column indexes built on it. Least recently used
+files are dropped when the estimated memory of them exceeds the budget, and a
+file changed on disk is parsed again.
+
+Usage::
+
+> python sub_csv_server.py --memory=4096
+> python sub_csv_client.py path/to/your/original/file.csv N=Jack
+
+Options:
+
+    --socket=PATH       path of the Unix socket, default sub_csv.sock in the
+                        temp folder
+    --memory=MB         memory budget of the parsed files, default 1024
+"""
+import json
+import os
+import socketserver
+import sys
+import threading
+from collections import OrderedDict
+
+import sub_csv
+from column_table import ColumnTable
+from sub_csv_client import default_socket
+
+
+def estimate_size(matrix, sample_size=1000):
+    """Estimate the memory used by a matrix in bytes, from a sample of its rows."""
+    if isinstance(matrix, ColumnTable):
+        size = sum(codes.itemsize * len(codes) for codes in matrix.columns)
+        size += matrix.widths.itemsize * len(matrix.widths)
+        size += sum(sys.getsizeof(values) + sum(map(sys.getsizeof, values))
+                    for values in matrix.values)
+        return size
+
+    if not matrix:
+        return sys.getsizeof(matrix)
+    step = max(len(matrix) // sample_size, 1)
+    sample = matrix[::step]
+    row_size = sum(sys.getsizeof(row) + sum(map(sys.getsizeof, row)) for row in sample)
+    return sys.getsizeof(matrix) + row_size * len(matrix) // len(sample)
+
+
+class MatrixCache():
+    """
+    LRU cache of loaded SubCsv instances under a memory budget in bytes.
+
+    Instances are keyed by the file path and the options affecting parsing,
+    and checked against the size and modified time of the file.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self._entries = OrderedDict()  # in the format of {key: entry_dict}
+
+    def __evict(self, key):
+        entry = self._entries.pop(key)
+        self.size -= entry['size']
+        sub_csv.debug_info('evict `{}`, {} bytes.'.format(key[0], entry['size']))
+
+    def get(self, options):
+        """Create a SubCsv instance for the options, sharing the matrix loaded before."""
+        path = os.path.abspath(options['file_path'])
+        stat = os.stat(path)
+        key = (path, options['ensure_header'], options['columnar'])
+        stamp = (stat.st_size, stat.st_mtime_ns)
+
+        entry = self._entries.get(key)
+        if entry is not None and entry['stamp'] != stamp:
+            self.__evict(key)
+            entry = None
+
+        # The matrix is in memory, so jobs run on it instead of streaming.
+        options = dict(options, file_path=path, streaming=False, workers=1, use_mmap=False)
+        sc = sub_csv.create_sub_csv(options)
+
+        if entry is None:
+            base = sub_csv.create_sub_csv(dict(options, stats=False))
+            entry = {
+                'stamp': stamp,
+                'base': base,
+                'size': estimate_size(base.get_matrix()),
+            }
+            self._entries[key] = entry
+            self.size += entry['size']
+            while self.size > self.budget and len(self._entries) > 1:
+                self.__evict(next(iter(self._entries)))
+        else:
+            self._entries.move_to_end(key)
+
+        sc.share_matrix(entry['base'])
+        return sc
+
+
+class SubCsvHandler(socketserver.StreamRequestHandler):
+    """Handle a request in a line of json, and respond in a line of json."""
+
+    def handle(self):
+        response = {}
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            if request.get('shutdown'):
+                # Shut down from another thread, or it waits for this request forever.
+                threading.Thread(target=self.server.shutdown).start()
+                response['lines'] = []
+            else:
+                options = sub_csv.parse_command(request['args'])
+                if options['follow']:
+                    raise ValueError('`--follow` is not supported by the server.')
+                sc = self.server.cache.get(options)
+                response['lines'] = sub_csv.run_command(sc, options)
+        except Exception as ex:
+            sub_csv.debug_info(ex)
+            response['error'] = str(ex) or repr(ex)
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class SubCsvServer(socketserver.UnixStreamServer):
+    """Unix socket server running SubCsv jobs one by one on the cached matrices."""
+
+    def __init__(self, socket_path=default_socket, budget=1 << 30):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path, SubCsvHandler)
+        self.cache = MatrixCache(budget)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def serve(argv):
+    socket_path = default_socket
+    budget = 1024
+    for arg in argv:
+        if arg.startswith('--socket='):
+            socket_path = arg[len('--socket='):]
+        elif arg.startswith('--memory='):
+            budget = int(arg[len('--memory='):])
+
+    server = SubCsvServer(socket_path, budget << 20)
+    print('serving on %s' % socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    serve(sys.argv[1:])
@@ -0,0 +1,86 @@
+"""Tests of the whitelist of expressions compiled for converters and filters."""
+import ast
+import unittest
+
+import safe_expression
+from safe_expression import compile_expression, get_safe_names, safe_eval, validate
+from sub_csv import SubCsv, get_lambda_string
+
+
+class TestValidate(unittest.TestCase):
+    def assert_rejected(self, source, names=('random', 'abs', 'int')):
+        self.assertRaises(ValueError, validate, ast.parse(source, mode='eval'), frozenset(names))
+        self.assertRaises(ValueError, safe_eval, source)
+
+    def test_dunder_attributes(self):
+        for source in ('lambda s: s.__class__', 'lambda s: s.__class__.__mro__[1].__subclasses__()',
+                       'lambda s: (1).__add__(s)', 'lambda s: s._private'):
+            self.assert_rejected(source)
+
+    def test_denied_attributes(self):
+        for source in ('lambda s: s.format', 'lambda s: "{0.__class__}".format(s)',
+                       'lambda s: "{x}".format_map(s)', 'lambda s: int.mro()',
+                       'lambda g: g.gi_frame.f_globals'):
+            self.assert_rejected(source)
+
+    def test_comprehensions(self):
+        for source in ('lambda s: [c for c in s]', 'lambda s: {c for c in s}',
+                       'lambda s: {c: c for c in s}', 'lambda s: list(c for c in s)'):
+            self.assert_rejected(source)
+
+    def test_unknown_names(self):
+        for source in ('lambda s: open(s)', 'lambda s: eval(s)', '__import__("os")',
+                       'lambda s: globals()', 'lambda s: t + s'):
+            self.assert_rejected(source)
+
+    def test_other_syntax(self):
+        for source in ('lambda s: (yield s)', 'lambda s: (t := s)', 'lambda *a: a', 'lambda s=open: s'):
+            self.assertRaises((ValueError, SyntaxError), safe_eval, source)
+
+    def test_allowed(self):
+        fn = safe_eval('lambda s: s.upper() + "KG" if s else -abs(int(s or 0)) // 2')
+        self.assertEqual((fn('a'), fn('')), ('AKG', 0))
+        self.assertEqual(safe_eval('lambda x: x[1:] in {"bc", "cd"} and x[0] != "z"')('abc'), True)
+
+    def test_safe_list(self):
+        self.assertIn('random', get_safe_names())
+        self.assertNotIn('len', get_safe_names())
+        safe_list = list(safe_expression.safe_list)
+        # Exceptions and names not found are left out.
+        safe_expression.safe_list.extend(['len', 'ValueError', 'not_a_builtin'])
+        try:
+            self.assertEqual(safe_eval('lambda s: len(s)')('abc'), 3)
+            self.assertNotIn('ValueError', get_safe_names())
+            self.assertNotIn('not_a_builtin', get_safe_names())
+        finally:
+            safe_expression.safe_list[:] = safe_list
+        self.assertRaises(ValueError, safe_eval, 'lambda s: len(s)')
+
+    def test_compiled_once(self):
+        self.assertIs(compile_expression('lambda s: s + "KG"'), compile_expression('lambda s: s + "KG"'))
+
+
+class TestConverters(unittest.TestCase):
+    def test_converter_forms(self):
+        for content, cell, expected in (
+                ("s: s + 'KG'", '72', '72KG'),
+                ('d: d + 100', 72, 172),
+                ("'Shanghai'", '72', 'Shanghai'),
+                ('x: x[::-1]', '72', '27')):
+            self.assertEqual(safe_eval(get_lambda_string(content))(cell), expected)
+        self.assertLess(safe_eval(get_lambda_string('random()'))('72'), 1)
+
+    def test_register_converter(self):
+        for content in ("s: s + 'KG'", 'd: d + 100', 'random()', "'Shanghai'"):
+            SubCsv.register_converter(content, content)
+            self.assertIn(content, SubCsv.converter_repo)
+        self.assertEqual(SubCsv.converter_repo['d: d + 100'](['1', '2.5', 'x']), ['101.0', '102.5', 'x'])
+
+        for content in ('s: s.__class__', "s: '{0.__class__}'.format(s)", 's: [c for c in s]',
+                        's: open(s)'):
+            self.assertRaises(SyntaxError, SubCsv.register_converter, content, content)
+            self.assertNotIn(content, SubCsv.converter_repo)
+
+
+if __name__ == '__main__':
+    unittest.main()
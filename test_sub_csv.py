@@ -0,0 +1,483 @@
+"""Tests of the byte-offset logic of SubCsv and the results of its modes."""
+import csv
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import checkpoint
+import parse_cache
+from sub_csv import (QuoteParityError, SubCsv, count_quotes, find_row_boundaries, iter_checked_rows,
+                     iter_row_blocks, last_row_end)
+
+# Cells with separators, quotes and line breaks, so quoted fields span lines.
+tricky_cells = ['Jack', 'Mary', 'a,b', 'say "hi"', 'two\nlines', 'cr\r\nlf', '"', '""', '\n', '', ' ']
+
+
+def csv_bytes(rows):
+    """Write rows as csv, return the bytes and the offsets where the rows begin."""
+    data = b''
+    starts = []
+    for row in rows:
+        starts.append(len(data))
+        f = io.StringIO(newline='')
+        csv.writer(f).writerow(row)
+        data += f.getvalue().encode('utf-8')
+    return data, starts
+
+
+def fail_on_mary(cell):
+    # Module level, so worker processes can unpickle it.
+    if cell == 'Mary':
+        raise ValueError('no Mary')
+    return cell
+
+
+# Cells with the searched values after quoted line breaks and quotes.
+hit_cells = ['Jack', 'x\nJack', '"Jack"\n', 'a\n"b"\nMary,Jack', 'Jackson']
+
+
+def random_rows(count, seed=0, cells=tricky_cells):
+    rnd = random.Random(seed)
+    return [[str(i), rnd.choice(cells), rnd.choice(cells), str(rnd.randint(0, 20))]
+            for i in range(count)]
+
+
+class CsvFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_file(self, name, data):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def read_file(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+class TestRowBoundaries(CsvFileTestCase):
+    def test_every_offset(self):
+        data, starts = csv_bytes(random_rows(300))
+        path = self.write_file('rows.csv', data)
+        offsets = list(range(len(data)))
+        expected = [min([s for s in starts if s > o] + [len(data)]) for o in offsets]
+        # Small blocks so quoted fields and escaped quotes cross them.
+        for block_size in (1, 2, 7, 64, 1 << 20):
+            self.assertEqual(find_row_boundaries(path, offsets, block_size), expected)
+
+    def test_quoted_line_breaks_are_not_boundaries(self):
+        path = self.write_file('rows.csv', b'a,"1\n2\n3"\nb,"x""\n""y"\nc,z\n')
+        self.assertEqual(find_row_boundaries(path, [0, 3, 6, 11, 15, 23], block_size=4),
+                         [10, 10, 10, 22, 22, 26])
+
+    def test_offsets_after_last_row(self):
+        path = self.write_file('rows.csv', b'a,b\nc,"d\n')
+        self.assertEqual(find_row_boundaries(path, [2, 5, 8]), [4, 9, 9])
+
+
+class TestParallel(CsvFileTestCase):
+    def run_mode(self, path, filters, output, **options):
+        sc = SubCsv(path, **options)
+        sc.chunk_size = 97
+        for filter_arr in filters:
+            sc.sub(filter_arr)
+        count, result = sc.write_all(os.path.join(self.folder, output))
+        self.assertEqual(result, os.path.join(self.folder, output))
+        return count, self.read_file(result)
+
+    def test_chunks_cut_on_row_boundaries(self):
+        data, _ = csv_bytes([['id', 'a', 'b', 'n']] + random_rows(500))
+        path = self.write_file('rows.csv', data)
+        for filters in ([], [['B=two\nlines']], [['B=Jack'], ['C=say "hi"']]):
+            expected = self.run_mode(path, filters, 'streaming.csv', streaming=True)
+            self.assertEqual(self.run_mode(path, filters, 'parallel.csv', workers=3), expected)
+
+    def test_quotes_in_unquoted_fields(self):
+        # csv.reader takes `5" screen` as it is, which breaks the parity of quotes.
+        rnd = random.Random(3)
+        data = b'id,a,b\n' + b''.join(
+            rnd.choice([b'%d,Jack,5" screen\n', b'%d,"multi\nline",Mary\n']) % i for i in range(200))
+        path = self.write_file('rows.csv', data)
+        filters = [['B=Jack'], ['C=Mary']]
+        expected = self.run_mode(path, filters, 'streaming.csv', streaming=True)
+        self.assertEqual(expected[0], 200)
+        self.assertEqual(self.run_mode(path, filters, 'parallel.csv', workers=3), expected)
+        self.assertEqual(self.run_mode(path, [], 'parallel.csv', workers=3),
+                         self.run_mode(path, [], 'streaming.csv', streaming=True))
+        # Modes which can't stream instead find it out.
+        self.assertRaises(QuoteParityError, self.run_mode, path, filters, 'mmap.csv',
+                          streaming=True, use_mmap=True)
+        sc = SubCsv(path)
+        sc.chunk_size = 97
+        self.assertRaises(QuoteParityError, sc.write_incremental, os.path.join(self.folder, 'output.csv'))
+
+    def test_checked_rows(self):
+        for text, rows, ends_row in (
+                ('a,b\r\nc,"d\ne"\n', [['a', 'b'], ['c', 'd\ne']], True),
+                ('a,b\nc', [['a', 'b'], ['c']], True),
+                ('', [], True),
+                ('a,5" x\n', [['a', '5" x']], True),
+                ('a,"b\nc\n', None, False),
+                ('line"\nb\n', [['line"'], ['b']], True)):
+            ends = []
+            parsed = list(iter_checked_rows(text, ends))
+            self.assertEqual(ends, [ends_row])
+            if rows is not None:
+                self.assertEqual(parsed, rows)
+
+    def test_types_are_inferred_once(self):
+        # D is numeric in the first batch, while some chunks start with n/a.
+        rows = [[str(i), 'x', 'y', 'n/a' if i % 50 == 0 and i > 1000 else str(i % 20)] for i in range(2000)]
+        path = self.write_file('rows.csv', csv_bytes([['id', 'a', 'b', 'n']] + rows)[0])
+        expected = self.run_mode(path, [['D>=9']], 'memory.csv')
+        self.assertEqual(expected[0], sum(1 for row in rows if row[3] != 'n/a' and int(row[3]) >= 9))
+        self.assertEqual(self.run_mode(path, [['D>=9']], 'parallel.csv', workers=4), expected)
+
+
+class TestMmap(CsvFileTestCase):
+    def candidates(self, path, filters, ensure_header=True):
+        sc = SubCsv(path, ensure_header=ensure_header, streaming=True, use_mmap=True)
+        for filter_arr in filters:
+            sc.sub(filter_arr)
+        self.assertIsNotNone(sc.get_byte_pattern())
+        return sc, list(sc.iter_candidate_rows())
+
+    def test_hits_locate_whole_rows(self):
+        rows = random_rows(400, cells=tricky_cells + hit_cells)
+        path = self.write_file('rows.csv', csv_bytes([['id', 'Jack', 'b', 'n']] + rows)[0])
+        for filters in ([['B=Jack']], [['C=Mary'], ['B=Jackson']], [['B=Jack', 'C=Jack']]):
+            sc, candidates = self.candidates(path, filters)
+            # Every candidate is a row of the file, in order, and none is missed.
+            positions = [int(row[0]) for row in candidates]
+            self.assertEqual(positions, sorted(set(positions)))
+            self.assertEqual(candidates, [rows[i] for i in positions])
+            self.assertEqual(sc.filter_batch(candidates), sc.filter_batch(rows))
+            self.assertEqual(sc._header, ['id', 'Jack', 'b', 'n'])
+
+    def test_hits_at_both_ends(self):
+        path = self.write_file('rows.csv', b'Jack,"1\n2"\nMary,3\n"x\nJack",4')
+        sc, candidates = self.candidates(path, [['A=Jack'], ['B=Jack']], ensure_header=False)
+        self.assertEqual(candidates, [['Jack', '1\n2'], ['x\nJack', '4']])
+
+    def test_count_quotes_in_blocks(self):
+        buf = b'"a""b",\n"' * 50
+        for start, end in ((0, len(buf)), (3, 77), (10, 10)):
+            for block_size in (1, 3, 1 << 24):
+                self.assertEqual(count_quotes(buf, start, end, block_size), buf[start:end].count(b'"'))
+
+
+class TestModes(CsvFileTestCase):
+    modes = {
+        'memory': {'streaming': False},
+        'streaming': {'streaming': True},
+        'mmap': {'streaming': True, 'use_mmap': True},
+        'columnar': {'columnar': True},
+        'parallel': {'workers': 3},
+        'pipelined': {'streaming': True, 'pipelined': True, 'buffer_size': 64},
+    }
+
+    def run_modes(self, path, filters=(), converters=None, select=None):
+        results = {}
+        for name, options in self.modes.items():
+            sc = SubCsv(path, **options)
+            sc.chunk_size = 97
+            for filter_arr in filters:
+                sc.sub(filter_arr)
+            sc.convert_all(converters or {})
+            if select:
+                sc.select(select)
+            count, result = sc.write_all(os.path.join(self.folder, name + '.csv'))
+            results[name] = (count, self.read_file(result) if count else result)
+        return results
+
+    def assert_same_results(self, results):
+        expected = results['memory']
+        for name, result in results.items():
+            self.assertEqual(result, expected, name)
+        return expected
+
+    def test_same_output(self):
+        rows = random_rows(300, cells=tricky_cells + hit_cells)
+        path = self.write_file('rows.csv', csv_bytes([['id', 'a', 'b', 'n']] + rows)[0])
+        cases = [
+            ([], None, None),
+            ([['B=Jack']], None, None),
+            ([['B=Jack'], ['C=two\nlines']], {'D': 'd: d + 1'}, None),
+            ([['D>=9', 'B!=Mary']], None, 'n,a'),
+            ([['B in {Jack,""}'], ['C~^x']], {'b': 's: s.upper()'}, 'b:n'),
+        ]
+        for filters, converters, select in cases:
+            count, _ = self.assert_same_results(self.run_modes(path, filters, converters, select))
+            self.assertGreater(count, 0)
+
+    def test_types_resolved_once(self):
+        # D is numeric with a few other cells, in the first batch and later.
+        rnd = random.Random(1)
+        rows = [[str(i), rnd.choice(['Jack', 'Mary']), 'x', rnd.choice(['n/a', ''] + [str(n) for n in range(20)])]
+                for i in range(2500)]
+        path = self.write_file('rows.csv', csv_bytes([['id', 'a', 'b', 'n']] + rows)[0])
+        numbers = [row for row in rows if row[3] not in ('n/a', '')]
+        for filters, expected in (
+                ([['B=Jack', 'D>=9']], [row for row in numbers if row[1] == 'Jack' and int(row[3]) >= 9]),
+                ([['D<5'], ['B=Mary', 'D>15']], [row for row in numbers if int(row[3]) < 5
+                                                 or row[1] == 'Mary' and int(row[3]) > 15])):
+            count, _ = self.assert_same_results(self.run_modes(path, filters))
+            self.assertEqual(count, len(expected))
+
+    def test_short_rows(self):
+        # Blank lines and ragged rows never match conditions on their missing columns.
+        rnd = random.Random(2)
+        rows = [[rnd.choice(['Jack', 'Mary']), 'y', 'x'][:rnd.randint(0, 3)] for _ in range(1500)]
+        path = self.write_file('rows.csv', csv_bytes([['a', 'b', 'c']] + rows)[0])
+        expected = [row for row in rows if row[:1] == ['Jack'] or row[2:] == ['x']]
+        count, _ = self.assert_same_results(self.run_modes(path, [['A=Jack'], ['C=x']]))
+        self.assertEqual(count, len(expected))
+
+        sc = SubCsv(path)
+        sc.sub(['A=Jack'])
+        sc.sub(['C=x'])
+        self.assertEqual(list(filter(sc.get_predicate(), rows)), expected)
+
+    def test_stats_keep_results(self):
+        rnd = random.Random(4)
+        rows = [[rnd.choice(['Jack', 'Mary']), 'y', str(rnd.randint(0, 20))][:rnd.randint(0, 3)]
+                for _ in range(1500)]
+        path = self.write_file('rows.csv', csv_bytes([['a', 'b', 'c']] + rows)[0])
+        checks = {
+            'A=Jack': lambda row: row[:1] == ['Jack'],
+            'A=Mary': lambda row: row[:1] == ['Mary'],
+            'C=7': lambda row: row[2:] == ['7'],
+            'C>=10': lambda row: len(row) > 2 and int(row[2]) >= 10,
+        }
+        for filters in ([['A=Jack'], ['C=7']], [['A=Mary', 'C>=10']]):
+            expected = self.run_modes(path, filters)
+            hits = [sum(1 for row in rows if all(checks[f](row) for f in group)) for group in filters]
+            modes = self.modes
+            self.modes = dict((name, dict(options, stats=True)) for name, options in modes.items())
+            try:
+                self.assertEqual(self.run_modes(path, filters), expected)
+            finally:
+                self.modes = modes
+            for name, options in modes.items():
+                sc = SubCsv(path, stats=True, **options)
+                sc.chunk_size = 97
+                for filter_arr in filters:
+                    sc.sub(filter_arr)
+                sc.write_all(os.path.join(self.folder, name + '.csv'))
+                stats = sc.stats.as_dict()
+                self.assertEqual([g['hits'] for g in stats['groups']], hits, name)
+                self.assertIsNotNone(stats['peak_memory'])
+
+    def test_no_row_matched(self):
+        path = self.write_file('rows.csv', csv_bytes([['id', 'a', 'b', 'n']] + random_rows(50))[0])
+        count, _ = self.assert_same_results(self.run_modes(path, [['B=nobody']]))
+        self.assertEqual(count, 0)
+
+    def test_failure_leaves_no_output(self):
+        path = self.write_file('rows.csv', csv_bytes([['id', 'a', 'b', 'n']] + random_rows(300))[0])
+        for name in ('streaming', 'pipelined', 'parallel'):
+            sc = SubCsv(path, **self.modes[name])
+            sc.chunk_size = 97
+            sc.convert('B', fail_on_mary)
+            output = os.path.join(self.folder, name + '.csv')
+            self.assertRaises(ValueError, sc.write_all, output)
+            self.assertFalse(os.path.exists(output), name)
+
+
+class TestOutputPath(CsvFileTestCase):
+    def test_default_names_are_unique(self):
+        path = self.write_file('rows.csv', csv_bytes([['id', 'a', 'b', 'n']] + random_rows(50))[0])
+        results = []
+        for options in ({'streaming': True}, {'streaming': False}, {'workers': 2}, {'streaming': True}):
+            sc = SubCsv(path, **options)
+            sc.sub(['B=Jack'])
+            results.append(sc.write_all())
+        # Runs in the same second get names with a counter.
+        self.assertEqual(len(set(result for _, result in results)), len(results))
+        for count, result in results:
+            self.assertEqual(count, results[0][0])
+            self.assertEqual(self.read_file(result), self.read_file(results[0][1]))
+
+    def test_no_file_left_without_rows(self):
+        path = self.write_file('rows.csv', csv_bytes([['id', 'a', 'b', 'n']] + random_rows(50))[0])
+        sc = SubCsv(path)
+        sc.sub(['B=nobody'])
+        self.assertEqual(sc.write_all()[0], 0)
+        self.assertEqual(sc.partition(by='B'), {})
+        self.assertEqual(os.listdir(self.folder), ['rows.csv'])
+
+
+class TestParseCache(CsvFileTestCase):
+    def test_cache(self):
+        path = self.write_file('rows.csv', csv_bytes([['id', 'a', 'b', 'n']] + random_rows(100))[0])
+        expected = SubCsv(path).get_matrix()
+        for columnar in (False, True):
+            self.assertEqual(list(SubCsv(path, columnar=columnar, use_cache=True).get_matrix()), expected)
+            self.assertTrue(os.path.exists(parse_cache.cache_path(path, columnar and 'columnar' or 'rows')))
+            self.assertEqual(list(SubCsv(path, columnar=columnar, use_cache=True).get_matrix()), expected)
+
+    def test_cache_not_written(self):
+        path = self.write_file('rows.csv', csv_bytes([['id', 'a', 'b', 'n']] + random_rows(100))[0])
+        # A folder in the place of the cache file can be neither read nor replaced.
+        os.mkdir(parse_cache.cache_path(path))
+        sc = SubCsv(path, use_cache=True)
+        sc.sub(['B=Jack'])
+        count, result = sc.write_all(os.path.join(self.folder, 'cached.csv'))
+        self.assertEqual(result, os.path.join(self.folder, 'cached.csv'))
+
+        sc = SubCsv(path)
+        sc.sub(['B=Jack'])
+        self.assertEqual((count, self.read_file(result)),
+                         (sc.write_all(os.path.join(self.folder, 'expected.csv'))[0],
+                          self.read_file(os.path.join(self.folder, 'expected.csv'))))
+
+
+class TestIncremental(CsvFileTestCase):
+    def setUp(self):
+        super(TestIncremental, self).setUp()
+        self.header, _ = csv_bytes([['id', 'a', 'b', 'n']])
+        self.rows = random_rows(300)
+        self.source = os.path.join(self.folder, 'source.csv')
+        self.output = os.path.join(self.folder, 'output.csv')
+
+    def append(self, data):
+        with open(self.source, 'ab') as f:
+            f.write(data)
+
+    def run_incremental(self, filters=(['B=Jack'], ['D>=9'])):
+        sc = SubCsv(self.source)
+        # Small blocks so a checkpoint is saved every few rows.
+        sc.chunk_size = 50
+        for filter_arr in filters:
+            sc.sub(filter_arr)
+        count, result = sc.write_incremental(self.output)
+        self.assertEqual(result, self.output)
+        return count
+
+    def expected_output(self, filters=(['B=Jack'], ['D>=9'])):
+        sc = SubCsv(self.source, streaming=True)
+        for filter_arr in filters:
+            sc.sub(filter_arr)
+        _, result = sc.write_all(os.path.join(self.folder, 'expected.csv'))
+        return self.read_file(result)
+
+    def test_last_row_end(self):
+        self.assertEqual(last_row_end(b''), 0)
+        self.assertEqual(last_row_end(b'a,b'), 0)
+        self.assertEqual(last_row_end(b'a,b\nc'), 4)
+        self.assertEqual(last_row_end(b'a,"b\nc'), 0)
+        self.assertEqual(last_row_end(b'a,"b\nc"\nd,"e\n'), 8)
+        self.assertEqual(last_row_end(b'a,"b""\n""c"\n'), 12)
+
+    def test_row_blocks(self):
+        data, starts = csv_bytes(random_rows(200))
+        path = self.write_file('rows.csv', data + b'9,"partial\n')
+        for block_size in (1, 13, 1 << 20):
+            blocks = list(iter_row_blocks(path, starts[5], block_size))
+            self.assertEqual(b''.join(block for _, block in blocks), data[starts[5]:])
+            for end, block in blocks:
+                self.assertIn(end, starts[6:] + [len(data)])
+
+    def test_resume_after_appended_rows(self):
+        data, starts = csv_bytes(self.rows)
+        self.append(self.header + data[:starts[100]])
+        first = self.run_incremental()
+        self.assertEqual(self.read_file(self.output), self.expected_output())
+
+        self.append(data[starts[100]:])
+        second = self.run_incremental()
+        self.assertEqual(self.read_file(self.output), self.expected_output())
+        written = list(csv.reader(io.StringIO(self.expected_output().decode('utf-8-sig'), newline='')))
+        self.assertEqual(first + second, len(written) - 1)
+        self.assertEqual(self.run_incremental(), 0)
+
+    def test_partial_last_row(self):
+        data, starts = csv_bytes(self.rows)
+        # Cut the file inside a quoted line break, then inside an unquoted row.
+        cuts = [starts[i] + data[starts[i]:starts[i + 1]].index(b'\n') for i in range(len(self.rows) - 1)
+                if b'"' in data[starts[i]:starts[i + 1]] and data[starts[i]:starts[i + 1]].count(b'\n') > 1]
+        cut = cuts[len(cuts) // 2] + 1
+        self.append(self.header + data[:cut])
+        self.run_incremental()
+        self.append(data[cut:starts[250] + 2])
+        self.run_incremental()
+        self.append(data[starts[250] + 2:])
+        self.run_incremental()
+        self.assertEqual(self.read_file(self.output), self.expected_output())
+
+    def test_filter_change_rewrites(self):
+        self.append(self.header + csv_bytes(self.rows)[0])
+        self.run_incremental()
+        filters = (['C=Mary'], )
+        self.run_incremental(filters)
+        self.assertEqual(self.read_file(self.output), self.expected_output(filters))
+
+    def test_types_kept_by_checkpoint(self):
+        def run(types=None, output=self.output, incremental=True):
+            sc = SubCsv(self.source, streaming=True)
+            sc.chunk_size = 50
+            sc.sub(['D>=9'])
+            sc.declare_types(types or {})
+            if incremental:
+                return sc.write_incremental(output)[0]
+            return self.read_file(sc.write_all(output)[1])
+
+        # D is mostly text in the first rows, so it is compared as strings.
+        self.append(self.header + csv_bytes([[str(i), 'x', 'y', 'n/a' if i % 3 else '10']
+                                             for i in range(30)])[0])
+        run()
+        self.assertEqual(checkpoint.load(self.output)['types'], {'3': 'str'})
+        # Numbers appended later would make it numeric for a new run.
+        self.append(csv_bytes([[str(i), 'x', 'y', str(i % 20)] for i in range(30, 1300)])[0])
+        run()
+        expected = os.path.join(self.folder, 'expected.csv')
+        self.assertEqual(self.read_file(self.output), run({'D': 'str'}, expected, incremental=False))
+        self.assertNotEqual(self.read_file(self.output), run(output=expected, incremental=False))
+
+        # Declaring another type rewrites the output.
+        run({'D': 'int'})
+        self.assertEqual(self.read_file(self.output), run({'D': 'int'}, expected, incremental=False))
+        self.assertEqual(checkpoint.load(self.output)['types'], {'3': 'int'})
+
+    def test_source_truncated_or_replaced(self):
+        data, starts = csv_bytes(self.rows)
+        self.append(self.header + data)
+        self.run_incremental()
+
+        # Truncated: fewer bytes than the saved offset.
+        with open(self.source, 'wb') as f:
+            f.write(self.header + data[:starts[150]])
+        self.run_incremental()
+        self.assertEqual(self.read_file(self.output), self.expected_output())
+
+        # Replaced: at least as many bytes but different ones before the saved offset.
+        replaced, replaced_starts = csv_bytes([[row[0], 'Jack', 'x', '1'] for row in self.rows])
+        end = min(s for s in replaced_starts if s >= starts[150])
+        with open(self.source, 'wb') as f:
+            f.write(self.header + replaced[:end])
+        self.run_incremental()
+        self.assertEqual(self.read_file(self.output), self.expected_output())
+
+    def test_interrupted_output_is_truncated(self):
+        data, starts = csv_bytes(self.rows)
+        self.append(self.header + data[:starts[100]])
+        self.run_incremental()
+        # Rows written after the last checkpoint by an interrupted run.
+        with open(self.output, 'ab') as f:
+            f.write(b'written,before,the,interruption\r\n')
+        self.append(data[starts[100]:])
+        self.run_incremental()
+        self.assertEqual(self.read_file(self.output), self.expected_output())
+        self.assertEqual(checkpoint.load(self.output)['output_size'], os.path.getsize(self.output))
+
+
+if __name__ == '__main__':
+    unittest.main()